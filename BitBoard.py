@@ -0,0 +1,71 @@
+from Board import Board, NUM_COLS, NUM_ROWS, WINNING_NUMBER
+
+# Each column takes NUM_ROWS + 1 bits, the extra bit on top keeps columns from bleeding into each other when shifting.
+# Bit (col * COL_BITS + row) is the tile at that column and row, with row 0 at the bottom like Board.board_arr.
+COL_BITS = NUM_ROWS + 1
+BOTTOM_MASKS = [1 << (c * COL_BITS) for c in range(NUM_COLS)]
+TOP_MASKS = [1 << (NUM_ROWS - 1 + c * COL_BITS) for c in range(NUM_COLS)]
+COLUMN_MASKS = [((1 << NUM_ROWS) - 1) << (c * COL_BITS) for c in range(NUM_COLS)]
+FULL_MASK = sum(COLUMN_MASKS)
+
+# shift distances between neighbouring tiles: vertical, horizontal, positive diagonal, negative diagonal
+DIRECTIONS = (1, COL_BITS, COL_BITS + 1, COL_BITS - 1)
+
+def has_winning_line(bits: int) -> bool:
+    """shift-and-AND check for WINNING_NUMBER tiles in a row in any direction"""
+    for shift in DIRECTIONS:
+        line = bits
+        for k in range(1, WINNING_NUMBER):
+            line &= bits >> (k * shift)
+        if line:
+            return True
+    return False
+
+class BitBoard(Board):
+    """
+    Board backed by integer bitboards instead of a NumPy array. Has the same API as Board,
+    so the server and client can use either one
+    """
+
+    def _init_grid(self):
+        self.position = [0, 0] # one bitboard per player id, a set bit is one of their tiles
+        self.mask = 0 # every occupied slot, which doubles as the height of each column
+
+    def rows(self):
+        rows = [[self.FILL_VALUE] * NUM_COLS for _ in range(NUM_ROWS)]
+        for player_id, bits in enumerate(self.position):
+            for c in range(NUM_COLS):
+                for r in range(NUM_ROWS):
+                    if bits >> (c * COL_BITS + r) & 1:
+                        rows[r][c] = player_id
+        return rows
+
+    @property
+    def board_arr(self):
+        """the grid as a NumPy array, only built (and NumPy only loaded) when something asks for it"""
+        import numpy as np
+        return np.array(self.rows(), dtype=int)
+
+    def can_play(self, column: int) -> bool:
+        """column is 0 indexed"""
+        return 0 <= column < NUM_COLS and not self.mask & TOP_MASKS[column]
+
+    def place_tile(self, selected_column: int, playr_num):
+        selected_column -= 1
+        if not self.can_play(selected_column):
+            return False
+        # adding the bottom bit carries up to the first empty slot in the column
+        move = (self.mask + BOTTOM_MASKS[selected_column]) & COLUMN_MASKS[selected_column]
+        self.mask |= move
+        self.position[self.players[playr_num].id] |= move
+        return True
+
+    def game_over(self):
+        """
+        Game over check, will only be called by the server
+        """
+        for player_id, bits in enumerate(self.position):
+            if has_winning_line(bits):
+                self.winner = player_id
+                return True
+        return self.mask == FULL_MASK
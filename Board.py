@@ -1,12 +1,7 @@
-import auxillary as aux
-
-import numpy as np
-import pygame
-
 NUM_COLS, NUM_ROWS = 7, 6
 # NUM_COLS, NUM_ROWS = 3, 3     # change to test draw state (really hard not to accidentally win)
 WINNING_NUMBER = 4
-CIRCLE = '\u25CF'
+LINE_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1)) # horizontal, vertical, positive and negative diagonals as (row, col) steps
 
 class Board:
     FILL_VALUE = -1
@@ -16,8 +11,9 @@ class Board:
     EMPTY_COLOR = (255, 255, 0)  # Yellow for empty slots
     PLAYER_COLORS = [(255, 0, 0), (0, 0, 255)]  # Red, Blue
 
-    def __init__(self, players, in_terminal=True):
-        self.board_arr = np.full((NUM_ROWS, NUM_COLS), self.FILL_VALUE, dtype=int)
+    def __init__(self, players, in_terminal=True, store=None):
+        self.store = store # GameStore that holds the tiles, None when the board owns its array
+        self._init_grid()
         self.players = players
         for i, ply in enumerate(players):
             if ply.is_me:
@@ -31,138 +27,114 @@ class Board:
         if not self.in_terminal:
             self.init_pygame()
 
+    def _init_grid(self):
+        """create the storage for the tiles, row 0 is the bottom of the board"""
+        if self.store is None:
+            import numpy as np # loaded by the first board that owns its array, BitBoard clients never need it
+            self.board_arr = np.full((NUM_ROWS, NUM_COLS), self.FILL_VALUE, dtype=int)
+            self.heights = [0] * NUM_COLS # the next open row in each column
+        else: # views into a slot of the store
+            self.slot = self.store.allocate()
+            self.board_arr = self.store.grids[self.slot]
+            self.heights = self.store.heights[self.slot]
+        self.tile_count = 0
+        self.last_move = None # (row, col) of the tile placed last
+
+    def release(self):
+        """
+        give the slot back to the store as soon as the game is over. The tiles are copied out first, so the finished board
+        can still be read (e.g. by a player resuming) without seeing the next game to use the slot
+        """
+        if self.store is not None:
+            self.board_arr = self.board_arr.copy()
+            self.heights = self.heights.copy()
+            self.store.release(self.slot)
+            self.store = None
+
     def init_pygame(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode(
-            (NUM_COLS * self.SLOT_SIZE, NUM_ROWS * self.SLOT_SIZE + 50 + 60)
-        )
-        pygame.display.set_caption(f"{self.me.name}'s Connect 4")
-        self.font = pygame.font.SysFont("arial", 24)
-        pygame.event.set_grab(False)
+        from pygame_renderer import PygameRenderer # only GUI clients load pygame
+        self.renderer = PygameRenderer(self)
         self.draw_in_pygame(f"waiting for other player {self.players[(self.my_idx+1)%2].name}...")
 
     def draw_in_pygame(self, status=""):
-        human_board = np.flip(self.board_arr, 0)
-        self.screen.fill(self.BG_COLOR)
-
-        player_info_text_surface = self.font.render(f"{self.me.name}'s game", True, self.color)  # White text
-        self.screen.blit(player_info_text_surface, (10, 10))  # Position at top-left with padding
-
-        text_surface = self.font.render(status, True, (255, 255, 255))  # White text
-        self.screen.blit(text_surface, (10, 60))  # Position at top-left with padding under other text box
-        for r in range(NUM_ROWS):
-            for c in range(NUM_COLS):
-                color = (
-                    self.PLAYER_COLORS[0]
-                    if human_board[r][c] == self.players[0].id
-                    else self.PLAYER_COLORS[1]
-                    if human_board[r][c] == self.players[1].id
-                    else self.EMPTY_COLOR
-                )
-                pygame.draw.circle(
-                    self.screen,
-                    color,
-                    (
-                        c * self.SLOT_SIZE + self.SLOT_SIZE // 2,
-                        r * self.SLOT_SIZE + self.SLOT_SIZE // 2 + 50 + 60,
-                    ),
-                    self.SLOT_SIZE // 2 - self.PADDING,
-                )
-        pygame.display.flip()
+        self.renderer.draw(status)
 
     def update_board(self, current_player=None):
-
         self.draw_in_pygame("It's your turn!")
-        pygame.event.clear()
-        while True:  
-            # event = pygame.event.wait()
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return None 
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    x, y = event.pos
-                    if y < 50 + 60:
-                        continue
-                    selected_column = x // self.SLOT_SIZE + 1
-                    if self.place_tile(selected_column, current_player):
-                        self.draw_in_pygame(f"waiting for other player {self.players[(self.my_idx+1)%2].name}...")
-                        return selected_column
-                    else:
-                        print(f"Invalid move: {selected_column}")
-            pygame.time.delay(10)
+        while True:
+            selected_column = self.renderer.wait_for_click()
+            if selected_column is None: # window closed
+                return None
+            if self.place_tile(selected_column, current_player):
+                self.draw_in_pygame(f"waiting for other player {self.players[(self.my_idx+1)%2].name}...")
+                return selected_column
+            print(f"Invalid move: {selected_column}")
 
     def update_board_game_over(self, message):
         self.draw_in_pygame(message)
-        while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT or event.type == pygame.MOUSEBUTTONDOWN:
-                    return
-            pygame.time.delay(10)
+        self.renderer.wait_for_close()
 
     def place_tile(self, selected_column: int, playr_num):
         selected_column -= 1
-        placed = False
-        playr = self.players[playr_num]
-        if selected_column < len(self.board_arr[0]) and selected_column >= 0:
-            for row in self.board_arr:
-                if row[selected_column] == self.FILL_VALUE:
-                    row[selected_column] = playr.id
-                    placed = True
-                    break
-        return placed
+        if selected_column >= NUM_COLS or selected_column < 0:
+            return False
+        row = self.heights[selected_column]
+        if row >= NUM_ROWS:
+            return False
+        self.board_arr[row, selected_column] = self.players[playr_num].id
+        self.heights[selected_column] += 1
+        self.tile_count += 1
+        self.last_move = (row, selected_column)
+        return True
 
     def game_over(self):
         """
         Game over check, will only be called by the server
+        Only the tile placed last can have made a line, so just the lines through it are checked
         """
-        horozontal = self.check_straight(self.board_arr)
-        vertical = self.check_straight(self.board_arr.T)
-        positive = self.check_diagonal(self.board_arr)
-        negative = self.check_diagonal(np.flip(self.board_arr, 0))
-        board_is_full = not np.any(self.board_arr == self.FILL_VALUE)
-        return horozontal or vertical or positive or negative or board_is_full
-    
-    def check_straight(self, b):
-        for row in b:
-            for i in range(len(row) - WINNING_NUMBER + 1):
-                if row[i] != self.FILL_VALUE and np.all(row[i:i+WINNING_NUMBER] == row[i]):
-                    self.winner = row[i]
-                    return True
-        return False
-    
-    def check_diagonal(self, b):
-        for r in range(len(b) + 1 - WINNING_NUMBER):
-            for c in range(len(b[0]) + 1 - WINNING_NUMBER):
-                if b[r][c] != self.FILL_VALUE and all(b[r][c] == b[r+k][c+k] for k in range(WINNING_NUMBER)):
-                    self.winner = b[r][c]
-                    return True
+        if self.last_move is not None and self.check_lines_through(*self.last_move):
+            return True
+        return self.tile_count == NUM_ROWS * NUM_COLS
+
+    def check_lines_through(self, row, col):
+        tile = self.board_arr[row, col]
+        for d_row, d_col in LINE_DIRECTIONS:
+            in_a_row = 1 + self.count_matching(tile, row, col, d_row, d_col) + self.count_matching(tile, row, col, -d_row, -d_col)
+            if in_a_row >= WINNING_NUMBER:
+                self.winner = tile
+                return True
         return False
 
+    def count_matching(self, tile, row, col, d_row, d_col):
+        """how many tiles match in a row walking away from (row, col), stops after enough for a win"""
+        count = 0
+        for _ in range(WINNING_NUMBER - 1):
+            row += d_row
+            col += d_col
+            if not (0 <= row < NUM_ROWS and 0 <= col < NUM_COLS) or self.board_arr[row, col] != tile:
+                break
+            count += 1
+        return count
+
+    def rows(self):
+        """the tiles as lists of player ids (FILL_VALUE when empty), row 0 at the bottom, for the renderers"""
+        return self.board_arr.tolist()
+
+    # each way of drawing the board lives in its own module, loaded the first time the board is drawn that way
     def __str__(self):
-        human_board = np.flip(self.board_arr, 0)
-        return self.draw_board_in_terminal(human_board)
-    
-    def draw_board_in_terminal(self, human_board):
-        board_str = "\n"
-        board_str += '  ' + "   ".join(str(n+1) for n in range(NUM_COLS)) + ' \n\n'
-        for row in human_board:
-            board_str += '| ' + " | ".join(
-                aux.color_text(self.players[0], CIRCLE) if c == self.players[0].id else
-                aux.color_text(self.players[1], CIRCLE) if c == self.players[1].id else
-                ' ' if c == -1 else str(c) 
-                for c in row
-            ) + ' |\n'
-        return board_str
-    
+        from terminal_renderer import draw_board
+        return draw_board(self)
+
     def draw_board_for_log(self):
-        human_board = np.flip(self.board_arr, 0)
-        board_str = "\n"
-        board_str += '  ' + "   ".join(str(n+1) for n in range(NUM_COLS)) + ' \n\n'
-        for row in human_board:
-            board_str += '| ' + " | ".join(
-                str(self.players[0].id) if c == self.players[0].id else
-                str(self.players[1].id) if c == self.players[1].id else
-                ' ' if c == -1 else str(c) 
-                for c in row
-            ) + ' |\n'
-        return board_str
+        from log_renderer import draw_board
+        return draw_board(self)
+
+
+BOARD_ENGINES = ('numpy', 'bitboard')
+
+def get_board_class(engine='numpy'):
+    """return the Board implementation for an engine name, both share the same API"""
+    if engine == 'bitboard':
+        from BitBoard import BitBoard
+        return BitBoard
+    return Board
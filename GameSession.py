@@ -0,0 +1,55 @@
+import random
+
+from Player import Player
+from Board import Board
+
+class GameSession:
+    """All of the state for a single game: its two connections, whose turn it is and the board"""
+    session_count = 0
+
+    def __init__(self, connections, new_board=Board) -> None:
+        self.id = GameSession.session_count
+        GameSession.session_count += 1
+        self.connections = list(connections) # selector keys of the players, indexed by seat (player id)
+        self.cur_player = random.choice([0,1]) # the index (in connections) of the player whom the server is waiting for a move from
+
+        players = []
+        for key in self.connections:
+            players.append( Player(key.data.player_name, key.data.player_id) )
+            key.data.session = self
+        Player.set_player_colors(players)
+        self.board = new_board(players) # a Board class or GameStore.new_board
+        self.record_id = None # the game's id in the game record file, once it's been recorded
+        self.moves = [] # (player id, column counted from 1) of every move so far, sent to players who resume
+        self.forfeited = False
+
+    def is_full(self):
+        return len(self.connections) == 2
+
+    def current_key(self):
+        return self.connections[self.cur_player]
+
+    def advance_turn(self):
+        self.cur_player = (self.cur_player + 1) % 2
+        return self.current_key()
+
+    def opponent_of(self, key):
+        for other in self.connections:
+            if other.data is not key.data: # selector keys are replaced when their events change, their data stays the same
+                return other
+        return None
+
+    def remove(self, key):
+        """detach a connection from the game, returns True when the game has no connections left"""
+        self.connections = [other for other in self.connections if other.data is not key.data]
+        key.data.session = None
+        return len(self.connections) == 0
+
+    def replace(self, old_key, new_key):
+        """seat a player's new connection in place of their old one, when they resume the game"""
+        self.connections = [new_key if other.data is old_key.data else other for other in self.connections]
+        new_key.data.session = self
+
+    def __str__(self):
+        names = ", ".join(key.data.player_name for key in self.connections)
+        return f"game {self.id} ({names})"
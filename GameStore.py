@@ -0,0 +1,85 @@
+import numpy as np
+
+from Board import Board, NUM_COLS, NUM_ROWS, WINNING_NUMBER
+from auxillary import CustomError
+
+# (row step, col step) of each line direction: horizontal, vertical, positive and negative diagonals
+WINDOW_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+class GameStore:
+    """
+    Struct-of-arrays storage for every live board on the server. The tiles of all games sit in one
+    preallocated (n_games, NUM_ROWS, NUM_COLS) int8 array, and a Board made by new_board is a view into one slot of it.
+    Keeping them together lets game over be checked for many games at once.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.grids = np.full((capacity, NUM_ROWS, NUM_COLS), Board.FILL_VALUE, dtype=np.int8)
+        self.heights = np.zeros((capacity, NUM_COLS), dtype=np.int8)
+        self.free_slots = list(range(capacity - 1, -1, -1)) # used as a stack so recently freed slots are reused first
+
+    def allocate(self) -> int:
+        if not self.free_slots:
+            raise CustomError(f"All {self.capacity} game slots are in use")
+        slot = self.free_slots.pop()
+        self.grids[slot] = Board.FILL_VALUE
+        self.heights[slot] = 0
+        return slot
+
+    def release(self, slot: int):
+        self.free_slots.append(slot)
+
+    def live_count(self):
+        return self.capacity - len(self.free_slots)
+
+    def new_board(self, players, in_terminal=True):
+        return Board(players, in_terminal, store=self)
+
+    def game_over_batch(self, slots):
+        """
+        Vectorised game over check for many slots in a single pass. Returns (over, winners) arrays in the order of slots,
+        winners is FILL_VALUE for games without a winner
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        grids = self.grids[slots]
+        winners = np.full(len(slots), Board.FILL_VALUE, dtype=np.int8)
+        for player_id in (0, 1):
+            won = np.zeros(len(slots), dtype=bool)
+            tiles = (grids == player_id).view(np.int8)
+            for d_row, d_col in WINDOW_DIRECTIONS:
+                won |= np.any(window_sums(tiles, d_row, d_col) == WINNING_NUMBER, axis=(1, 2))
+            winners[won] = player_id
+        full = self.heights[slots].sum(axis=1, dtype=np.int32) == NUM_ROWS * NUM_COLS
+        over = (winners != Board.FILL_VALUE) | full
+        return over, winners
+
+def window_sums(tiles, d_row, d_col):
+    """
+    Sum every WINNING_NUMBER long window along one direction, for all boards at once, by adding shifted slices
+    (a convolution with a line shaped kernel). A window adding up to WINNING_NUMBER is a line of one player's tiles
+    """
+    rows = NUM_ROWS - (WINNING_NUMBER - 1) * d_row
+    cols = NUM_COLS - (WINNING_NUMBER - 1) * abs(d_col)
+    total = np.zeros((tiles.shape[0], rows, cols), dtype=np.int8)
+    for i in range(WINNING_NUMBER):
+        r = i * d_row
+        c = i * d_col if d_col >= 0 else (WINNING_NUMBER - 1 - i)
+        total += tiles[:, r:r + rows, c:c + cols]
+    return total
+
+def game_over_many(boards):
+    """game over for a list of boards, boards that share a GameStore are checked in one batch"""
+    results = [False] * len(boards)
+    batches = {}
+    for i, board in enumerate(boards):
+        if board.store is None:
+            results[i] = board.game_over()
+        else:
+            batches.setdefault(id(board.store), (board.store, []))[1].append(i)
+    for store, indexes in batches.values():
+        over, winners = store.game_over_batch([boards[i].slot for i in indexes])
+        for i, is_over, winner in zip(indexes, over, winners):
+            boards[i].winner = int(winner)
+            results[i] = bool(is_over)
+    return results
@@ -0,0 +1,93 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Board import NUM_COLS
+from BitBoard import COLUMN_MASKS
+from solver import DEFAULT_TIME_BUDGET, playable, position_of, score_move
+from game_records import DEFAULT_RECORD_PATH, RecordFile, RecordKinds
+
+DEFAULT_ANALYSIS_TIME = DEFAULT_TIME_BUDGET * 4
+
+class PositionAnalyser:
+    """
+    Scores every move of a batch of positions at once. Each legal root move is its own job in a process pool, so a batch
+    keeps every core busy. Positions go to the workers as three ints (current, mask, moves) rather than pickled Boards
+    """
+
+    def __init__(self, workers: int = None, time_budget: float = DEFAULT_ANALYSIS_TIME) -> None:
+        self.workers = workers or os.cpu_count()
+        self.time_budget = time_budget
+        self.pool = ProcessPoolExecutor(self.workers)
+
+    def analyse_boards(self, boards, to_move):
+        """per-column scores of each Board (or BitBoard), with to_move[i] the player id whose turn it is on boards[i]"""
+        return self.analyse_positions([position_of(board, player_id) for board, player_id in zip(boards, to_move)])
+
+    def analyse_positions(self, positions):
+        """
+        a list of NUM_COLS scores per (current, mask, moves) position, from the side of the player to move: positive
+        wins, 0 a draw or unclear, negative loses (see solver.py). None for full columns
+        """
+        jobs = [(index, column) for index, (_, mask, _) in enumerate(positions)
+                for column in range(NUM_COLS) if playable(mask) & COLUMN_MASKS[column]]
+        scores = [[None] * NUM_COLS for _ in positions]
+        if not jobs:
+            return scores
+        chunksize = max(1, len(jobs) // (self.workers * 4)) # big enough to keep pickling overhead down, small enough to balance
+        results = self.pool.map(score_move, *zip(*[(*positions[index], column, self.time_budget) for index, column in jobs]), chunksize=chunksize)
+        for (index, column), score in zip(jobs, results):
+            scores[index][column] = score
+        return scores
+
+    def close(self):
+        self.pool.shutdown()
+
+def recorded_positions(record_file, game):
+    """(position before the move, player, column played) for every move of a recorded game"""
+    bits = [0, 0]
+    mask = 0
+    moves = []
+    for record in record_file.game(game):
+        if int(record['kind']) != RecordKinds.MOVE:
+            continue
+        player, column = int(record['player']), int(record['column'])
+        moves.append(((bits[player], mask, mask.bit_count()), player, column))
+        move = playable(mask) & COLUMN_MASKS[column]
+        bits[player] |= move
+        mask |= move
+    return moves
+
+def format_score(score):
+    if score is None:
+        return '-'
+    if score >= 1:
+        return f"W{score}"
+    if score <= -1:
+        return f"L{-score}"
+    return f"{score:+.2f}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score every move of a recorded game, looking for mistakes')
+    parser.add_argument('game', type=int, help='Game id, from python3 game_records.py list')
+    parser.add_argument('-f', '--file', default=DEFAULT_RECORD_PATH, help='Game record file')
+    parser.add_argument('-t', '--time', type=float, default=DEFAULT_ANALYSIS_TIME, help='Seconds the solver spends on each move of each position')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes, one per CPU if not given')
+    args = parser.parse_args()
+
+    record_file = RecordFile(args.file)
+    moves = recorded_positions(record_file, args.game)
+    record_file.close()
+    analyser = PositionAnalyser(args.jobs, args.time)
+    started = time.monotonic()
+    all_scores = analyser.analyse_positions([position for position, _, _ in moves])
+    analyser.close()
+
+    print("W is a forced win and L a forced loss, the higher the number the sooner. Other scores are the solver's guess")
+    print(f"{'move':>4} {'player':>6} {'played':>6}  " + ''.join(f"{col + 1:>7}" for col in range(NUM_COLS)))
+    for number, ((_, player, column), scores) in enumerate(zip(moves, all_scores), 1):
+        best = max(score for score in scores if score is not None)
+        flag = '  mistake' if scores[column] < best and (best >= 1 or scores[column] <= -1) else ''
+        print(f"{number:>4} {player:>6} {column + 1:>6}  " + ''.join(f"{format_score(score):>7}" for score in scores) + flag)
+    print(f"Analysed {len(moves)} positions in {time.monotonic() - started:.1f}s with {analyser.workers} workers")
@@ -1,13 +1,9 @@
 from colorama import Fore, Style
-import os, platform
 
 RED = Fore.RED
 BLUE = Fore.BLUE
 WHITE = Fore.WHITE
 
-def clear_terminal():
-    os.system('cls') if platform.system() == "Windows" else os.system('clear')
-
 def color_text(player, text): 
     return player.color_code + text + Style.RESET_ALL
 
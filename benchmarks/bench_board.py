@@ -0,0 +1,55 @@
+"""
+Moves per second for each Board engine. Plays the same random games on each engine,
+placing a tile and checking for game over after every move like the server does.
+
+Run from the repository root: python3 -m benchmarks.bench_board
+"""
+import argparse
+import random
+import time
+
+from Board import BOARD_ENGINES, NUM_COLS, get_board_class
+from Player import Player
+
+def make_players():
+    players = [Player('red', 0), Player('blue', 1)]
+    Player.set_player_colors(players)
+    return players
+
+def random_games(num_games, seed):
+    """column orders to try for each move, fixed up front so every engine plays identical games"""
+    rng = random.Random(seed)
+    return [[rng.sample(range(1, NUM_COLS + 1), NUM_COLS) for _ in range(NUM_COLS * 6)] for _ in range(num_games)]
+
+def play(board_class, games):
+    moves = 0
+    start = time.perf_counter()
+    for game in games:
+        board = board_class(make_players())
+        turn = 0
+        for choices in game:
+            for col in choices:
+                if board.place_tile(col, turn):
+                    break
+            moves += 1
+            if board.game_over():
+                break
+            turn = (turn + 1) % 2
+    return moves, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare moves/sec of the Board engines')
+    parser.add_argument('-n', '--games', type=int, default=2000, help='Number of random games to play per engine')
+    parser.add_argument('-s', '--seed', type=int, default=457)
+    args = parser.parse_args()
+
+    games = random_games(args.games, args.seed)
+    results = {}
+    for engine in BOARD_ENGINES:
+        moves, elapsed = play(get_board_class(engine), games)
+        results[engine] = moves / elapsed
+        print(f"{engine:>9}: {moves} moves in {elapsed:.3f}s, {results[engine]:,.0f} moves/sec")
+    print(f"bitboard speedup: {results['bitboard'] / results['numpy']:.1f}x")
+
+if __name__ == '__main__':
+    main()
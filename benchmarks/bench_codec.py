@@ -0,0 +1,39 @@
+"""
+Encode/decode cost and frame size of the JSON and binary wire formats, plain and under the session cipher.
+
+Run from the repository root: python3 -m benchmarks.bench_codec
+"""
+import argparse
+import timeit
+
+import protocols
+
+MESSAGES = {
+    'OTHER_PLAYER': protocols.other_player('paige', 1),
+    'YOUR_TURN': protocols.your_turn(4),
+    'MAKE_MOVE': protocols.make_move(4),
+    'GAME_OVER': protocols.game_over(1, 4),
+}
+
+def round_trip(message, wire_format, cipher):
+    frame = protocols.encode_message(message, wire_format, cipher, cipher is not None)
+    header = protocols.parse_header(frame, 0, len(frame))
+    header_size, _, mode, proto = header
+    return protocols.decode_payload(mode, frame[header_size:], None, cipher, proto)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the JSON and binary wire formats')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='Round trips timed per message')
+    args = parser.parse_args()
+
+    cipher = protocols.SessionCipher(protocols.SessionCipher.generate_key())
+    print(f"{'message':<13}{'format':<8}{'bytes':>6}{'plain us':>10}{'session us':>12}")
+    for name, message in MESSAGES.items():
+        for wire_format in (protocols.WireFormats.JSON, protocols.WireFormats.BINARY):
+            size = len(protocols.encode_message(message, wire_format, None, False))
+            plain = timeit.timeit(lambda: round_trip(message, wire_format, None), number=args.number)
+            session = timeit.timeit(lambda: round_trip(message, wire_format, cipher), number=args.number)
+            print(f"{name:<13}{wire_format:<8}{size:>6}{plain / args.number * 1e6:>10.2f}{session / args.number * 1e6:>12.2f}")
+
+if __name__ == '__main__':
+    main()
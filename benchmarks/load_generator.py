@@ -0,0 +1,207 @@
+"""
+Headless load generator: many simulated players connect to a server at once, register and play whole games of legal
+moves, reconnecting for a new game when one ends. Reports handshakes/sec, moves/sec, latency percentiles and errors.
+
+Move latency is end to end: from a player sending a move until their opponent receives it, so both players of a game
+have to be simulated by the same load generator. Players reuse a small set of RSA keys (--keys) since generating one
+per player would bottleneck the load generator, so the server's certificate verification cache sees repeat keys.
+
+Run from the repository root: python3 -m benchmarks.load_generator -p 55668 -c 100 -d 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+import protocols
+from auxillary import CustomError
+from Board import NUM_COLS, NUM_ROWS
+from key_pool import KeyPool, DEFAULT_SPOOL_DIR
+from metrics import Histogram
+from simulate_certificate_authority import CertificateAuthority
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.handshakes = 0
+        self.moves = 0
+        self.games = 0
+        self.handshake_latency = Histogram() # connect until REGISTER_CONFIRM, in nanoseconds
+        self.move_latency = Histogram() # a move being sent until the opponent receives it, in nanoseconds
+        self.errors = Counter()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'seconds': round(elapsed, 3),
+            'handshakes': self.handshakes,
+            'handshakes_per_second': self.handshakes / elapsed,
+            'moves': self.moves,
+            'moves_per_second': self.moves / elapsed,
+            'games': self.games,
+            'handshake_latency_ms': latency_percentiles(self.handshake_latency),
+            'move_latency_ms': latency_percentiles(self.move_latency),
+            'errors': dict(self.errors),
+        }
+
+def latency_percentiles(histogram):
+    latencies = {f"p{percent:g}": histogram.percentile(percent) / 1e6 for percent in PERCENTILES}
+    latencies['max'] = histogram.max / 1e6
+    return latencies
+
+class SimulatedPlayer:
+    """one simulated player, playing games back to back until the deadline"""
+    by_name = {} # every player in a game, so a player can find the opponent who sent them a move and time it
+
+    def __init__(self, number, keys, options, stats, ca) -> None:
+        self.number = number
+        self.pub_key, self.pri_key = keys
+        self.options = options
+        self.stats = stats
+        self.ca = ca
+        self.moves = itertools.cycle(options.script) if options.script else None
+        self.last_sent = 0 # perf_counter_ns when this player last sent a move
+
+    async def play_games(self, deadline):
+        for game in itertools.count():
+            if time.monotonic() >= deadline:
+                return
+            try:
+                await asyncio.wait_for(self.play_game(game), self.options.timeout)
+            except asyncio.TimeoutError:
+                self.stats.errors['timeout'] += 1
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.stats.errors['disconnected'] += 1
+            except OSError:
+                self.stats.errors['connect'] += 1
+                await asyncio.sleep(1)
+            except CustomError as e:
+                self.stats.errors[str(e)] += 1
+                await asyncio.sleep(1) # e.g. the server is full, don't hammer it
+
+    async def play_game(self, game):
+        name = f"load{self.number}-{game}"
+        started = time.perf_counter_ns()
+        reader, writer = await asyncio.open_connection(self.options.ipaddr, self.options.port)
+        try:
+            message = protocols.register_with_server(name, self.pub_key, self.ca)
+            writer.write(protocols.encode_frame(protocols.make_json_bytes(message), None, False))
+            response = await read_message(reader, None, None)
+            if response['proto'] == protocols.Protocols.ERROR:
+                raise CustomError(f"server error: {response['error_message']}")
+            if not self.ca.verify_signature(response['pub_key'], response['signature']):
+                raise CustomError("server key not verified")
+            cipher = protocols.open_session_key(response, self.pri_key)
+            wire_format = response.get('format', protocols.WireFormats.JSON)
+            server_key = cipher if cipher is not None else response['pub_key']
+            my_id = response['player_id']
+            self.stats.handshakes += 1
+            self.stats.handshake_latency.record(time.perf_counter_ns() - started)
+
+            SimulatedPlayer.by_name[name] = self
+            try:
+                other = await read_message(reader, self.pri_key, cipher)
+                if other['proto'] != protocols.Protocols.OTHER_PLAYER:
+                    raise CustomError(f"unexpected {protocols.Protocols.PROTO_NAMES[other['proto']]} message")
+                opponent = other['other_name']
+                await self.play_moves(reader, writer, my_id, opponent, wire_format, server_key, cipher)
+            finally:
+                del SimulatedPlayer.by_name[name]
+        finally:
+            writer.close()
+
+    async def play_moves(self, reader, writer, my_id, opponent, wire_format, server_key, cipher):
+        heights = [0] * NUM_COLS
+        while True:
+            message = await read_message(reader, self.pri_key, cipher)
+            if message['proto'] not in (protocols.Protocols.YOUR_TURN, protocols.Protocols.GAME_OVER):
+                raise CustomError(f"unexpected {protocols.Protocols.PROTO_NAMES[message['proto']]} message")
+            opponents_move = message['proto'] == protocols.Protocols.YOUR_TURN or message['winner'] not in (my_id, -1)
+            if message['last_move'] > 0 and opponents_move: # a winner's GAME_OVER repeats their own move
+                heights[message['last_move'] - 1] += 1
+                sender = SimulatedPlayer.by_name.get(opponent)
+                if sender is not None:
+                    self.stats.move_latency.record(time.perf_counter_ns() - sender.last_sent)
+            if message['proto'] == protocols.Protocols.GAME_OVER:
+                if message['winner'] == my_id or message['winner'] == -1 and my_id == 0: # count each game once
+                    self.stats.games += 1
+                return
+            if self.options.move_delay:
+                await asyncio.sleep(random.uniform(0, 2 * self.options.move_delay))
+            column = self.choose_move(heights)
+            heights[column - 1] += 1
+            self.last_sent = time.perf_counter_ns()
+            writer.write(protocols.encode_message(protocols.make_move(column), wire_format, server_key))
+            self.stats.moves += 1
+
+    def choose_move(self, heights):
+        """the next scripted column if there's room in it, otherwise a random legal one"""
+        if self.moves is not None:
+            column = next(self.moves)
+            if 1 <= column <= NUM_COLS and heights[column - 1] < NUM_ROWS:
+                return column
+        return random.choice([col + 1 for col in range(NUM_COLS) if heights[col] < NUM_ROWS])
+
+async def read_message(reader, pri_key, cipher):
+    start = await reader.readexactly(len(protocols.BINARY_MAGIC))
+    header_size = protocols.BINARY_HEADER_SIZE if start == protocols.BINARY_MAGIC else protocols.HEADER_SIZE
+    header = start + await reader.readexactly(header_size - len(start))
+    _, length, mode, proto = protocols.parse_header(header, 0, header_size)
+    payload = await reader.readexactly(length)
+    return protocols.decode_payload(mode, payload, pri_key, cipher, proto)
+
+async def report(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        summary = stats.summary()
+        print(f"{summary['seconds']:>7.1f}s  {summary['handshakes_per_second']:>8.1f} handshakes/s  {summary['moves_per_second']:>9.1f} moves/s  "
+              f"move p99 {summary['move_latency_ms']['p99']:.2f}ms  errors {sum(stats.errors.values())}")
+
+async def run(options, keys):
+    stats = LoadStats()
+    ca = CertificateAuthority(is_server=False)
+    deadline = time.monotonic() + options.duration
+    players = [SimulatedPlayer(number, keys[number % len(keys)], options, stats, ca) for number in range(options.connections)]
+    reporter = asyncio.create_task(report(stats, options.interval))
+    tasks = []
+    for player in players:
+        tasks.append(asyncio.create_task(player.play_games(deadline)))
+        if options.connect_rate:
+            await asyncio.sleep(1 / options.connect_rate)
+    await asyncio.gather(*tasks)
+    reporter.cancel()
+    return stats.summary()
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many players to load test the server')
+    parser.add_argument('-i', '--ipaddr', default='127.0.0.1', help='Address of the server')
+    parser.add_argument('-p', '--port', type=int, default=55668, help='Port of the server')
+    parser.add_argument('-c', '--connections', type=int, default=100, help='Simulated players connected at once, the server needs -m of at least half this')
+    parser.add_argument('-d', '--duration', type=float, default=30, help='Seconds to keep starting new games for')
+    parser.add_argument('-r', '--connect-rate', type=float, default=0, help='New players per second while starting up, 0 for all at once')
+    parser.add_argument('--move-delay', type=float, default=0, help='Average seconds a player thinks before each move')
+    parser.add_argument('--script', type=lambda text: [int(col) for col in text.split(',')], help='Columns to play in order (repeating), e.g. 4,4,3,5')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds a game can take before it counts as an error')
+    parser.add_argument('--keys', type=int, default=16, help='RSA key pairs shared by the players')
+    parser.add_argument('-k', '--key-spool', default=DEFAULT_SPOOL_DIR, help='Directory of pre-generated RSA keys, pass "" to disable')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between progress lines')
+    parser.add_argument('--json', help='Also write the results to this file as JSON')
+    options = parser.parse_args()
+
+    pool = KeyPool(size=options.keys, spool_dir=options.key_spool)
+    keys = [pool.pop() for _ in range(options.keys)]
+    pool.close()
+
+    summary = asyncio.run(run(options, keys))
+    print(json.dumps(summary, indent=4))
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump(summary, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Startup import time of the client, server and load generator, measured with python -X importtime in a fresh interpreter
+for each run. Fails (exit status 1) if a program's imports take longer than its budget, or if it imports a module it
+has no use for, like pygame in anything that isn't a GUI client. Clients are started by the hundred, so this adds up.
+
+Run from the repository root:
+    python3 -m benchmarks.startup
+    python3 -m benchmarks.startup --budget client=150   # tighter budget for one program
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# program -> (module it starts from, budget in milliseconds, modules it must not import)
+TARGETS = {
+    'client': ('client', 250, ('pygame', 'numpy')),
+    'server': ('server', 350, ('pygame',)),
+    'load_generator': ('benchmarks.load_generator', 300, ('pygame', 'numpy')),
+}
+
+def measure(module):
+    """(milliseconds importing module took, every module it imported) in a fresh interpreter"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, total, name = line.split('|')
+        if not total.strip().isdigit(): # the column headings
+            continue
+        imported.add(name.strip())
+        if name.strip() == module and not name[1:].startswith(' '): # the top level import, not one of the same name inside it
+            cumulative = int(total) / 1000
+    return cumulative, imported
+
+def parse_budget(text):
+    name, _, ms = text.partition('=')
+    if name not in TARGETS or not ms:
+        raise argparse.ArgumentTypeError(f"expected PROGRAM=MS with PROGRAM one of {', '.join(TARGETS)}")
+    return name, float(ms)
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of each program against a budget')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per program, the median is reported')
+    parser.add_argument('--budget', type=parse_budget, action='append', default=[], help='Override a budget, e.g. client=150')
+    args = parser.parse_args()
+    budgets = {name: budget for name, (_, budget, _) in TARGETS.items()}
+    budgets.update(args.budget)
+
+    failures = []
+    print(f"{'program':<16}{'median ms':>12}{'budget ms':>12}  ")
+    for name, (module, _, forbidden) in TARGETS.items():
+        runs = [measure(module) for _ in range(args.repeat)]
+        median = statistics.median(ms for ms, _ in runs)
+        unwanted = sorted({module.split('.')[0] for _, imported in runs for module in imported} & set(forbidden))
+        flag = ''
+        if median > budgets[name]:
+            flag = '  OVER BUDGET'
+            failures.append(name)
+        if unwanted:
+            flag += f"  imports {', '.join(unwanted)}"
+            failures.append(name)
+        print(f"{name:<16}{median:>12.1f}{budgets[name]:>12.0f}{flag}")
+    if failures:
+        print(f"\nFailed: {', '.join(sorted(set(failures)))}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Micro-benchmarks of the hot operations: message encoding and decoding, RSA and session encryption, CA signatures
+and the Board engines. Results can be saved as JSON and compared against a saved baseline, failing (exit status 1)
+if anything got slower than the threshold allows.
+
+Run from the repository root:
+    python3 -m benchmarks.suite --save benchmarks/baseline.json     # record a baseline on this machine
+    python3 -m benchmarks.suite --compare benchmarks/baseline.json  # after a change
+"""
+import argparse
+import json
+import platform
+import random
+import socket
+import statistics
+import sys
+import timeit
+
+import rsa
+
+import protocols
+from Board import BOARD_ENGINES, NUM_COLS, NUM_ROWS, get_board_class
+from GameStore import GameStore
+from Player import Player
+from key_pool import KeyPool, DEFAULT_SPOOL_DIR
+from simulate_certificate_authority import CertificateAuthority, check_signature, key_to_string
+
+DEFAULT_THRESHOLD = 0.10
+MID_GAME_MOVES = (4, 4, 3, 5, 2, 2, 6, 6, 1, 7, 5, 3) # nobody has won yet
+
+def make_players():
+    players = [Player('red', 0), Player('blue', 1)]
+    Player.set_player_colors(players)
+    return players
+
+def drawn_game(seed=457):
+    """the moves of a random game that fills the board without anyone winning"""
+    rng = random.Random(seed)
+    board_class = get_board_class('bitboard')
+    while True:
+        board = board_class(make_players())
+        moves = []
+        for turn in range(NUM_COLS * NUM_ROWS):
+            col = rng.choice([col for col in range(1, NUM_COLS + 1) if board.can_play(col - 1)])
+            board.place_tile(col, turn % 2)
+            moves.append(col)
+            if board.game_over():
+                break
+        if len(moves) == NUM_COLS * NUM_ROWS and board.winner == -1:
+            return moves
+
+def board_after(engine, moves):
+    board = get_board_class(engine)(make_players())
+    for turn, col in enumerate(moves):
+        board.place_tile(col, turn % 2)
+    return board
+
+def fill_board(board, moves):
+    board._init_grid()
+    for turn, col in enumerate(moves):
+        board.place_tile(col, turn % 2)
+
+def benchmarks(keys):
+    """name -> function to time, built once so setup isn't timed"""
+    (pub_key, pri_key), (other_pub_key, _) = keys
+    ca = CertificateAuthority(is_server=False)
+    message = protocols.your_turn(4)
+    json_bytes = protocols.make_json_bytes(message)
+    cipher = protocols.SessionCipher(protocols.SessionCipher.generate_key())
+    rsa_payload = rsa.encrypt(json_bytes, pub_key)
+    session_payload = cipher.encrypt(json_bytes)
+    key_ser = key_to_string(other_pub_key)
+    signature = ca.create_signature(key_ser)
+    ca.verify_signature(other_pub_key, signature) # cached from here on
+
+    reader, writer = socket.socketpair()
+    frame = protocols.encode_frame(json_bytes, None, False)
+    def read_json_bytes():
+        writer.sendall(frame)
+        return protocols.read_json_bytes(reader.recv(protocols.HEADER_SIZE), reader, None)
+
+    cases = {
+        'codec.make_json_bytes': lambda: protocols.make_json_bytes(message),
+        'codec.read_json_bytes (socketpair)': read_json_bytes,
+        'codec.encode_message binary+session': lambda: protocols.encode_message(message, protocols.WireFormats.BINARY, cipher),
+        'crypto.rsa_encrypt': lambda: rsa.encrypt(json_bytes, pub_key),
+        'crypto.rsa_decrypt': lambda: rsa.decrypt(rsa_payload, pri_key),
+        'crypto.session_encrypt': lambda: cipher.encrypt(json_bytes),
+        'crypto.session_decrypt': lambda: cipher.decrypt(session_payload),
+        'ca.create_signature': lambda: ca.create_signature(key_ser),
+        'ca.verify_signature uncached': lambda: check_signature(ca.ca_keys['pri_key'], other_pub_key, signature),
+        'ca.verify_signature cached': lambda: ca.verify_signature(other_pub_key, signature),
+    }
+
+    drawn = drawn_game()
+    for engine in BOARD_ENGINES:
+        boards = {'empty': board_after(engine, ()), 'mid-game': board_after(engine, MID_GAME_MOVES), 'full': board_after(engine, drawn)}
+        scratch = get_board_class(engine)(make_players())
+        cases[f'board.{engine}.place_tile x{len(drawn)} (fill a board)'] = lambda scratch=scratch: fill_board(scratch, drawn)
+        for name, board in boards.items():
+            cases[f'board.{engine}.game_over {name}'] = board.game_over
+        cases[f'board.{engine}.draw_board_for_log'] = boards['mid-game'].draw_board_for_log
+        cases[f'board.{engine}.__str__'] = boards['mid-game'].__str__
+
+    store = GameStore(100)
+    store_boards = [store.new_board(make_players()) for _ in range(100)]
+    for board in store_boards:
+        for turn, col in enumerate(MID_GAME_MOVES):
+            board.place_tile(col, turn % 2)
+    slots = [board.slot for board in store_boards]
+    cases['board.store.game_over_batch x100'] = lambda: store.game_over_batch(slots)
+    return cases
+
+def run(cases, repeat, min_time):
+    """ns per call for each case: the median and best of repeat runs, each at least min_time seconds long"""
+    results = {}
+    for name, function in cases.items():
+        timer = timeit.Timer(function)
+        number = 1
+        while timer.timeit(number) < min_time:
+            number *= 2
+        times = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat, number)]
+        results[name] = {'ns_per_op': statistics.median(times), 'best_ns_per_op': min(times)}
+        print(f"{name:<48}{results[name]['ns_per_op']:>14,.0f} ns{1e9 / results[name]['ns_per_op']:>16,.0f} ops/sec")
+    return results
+
+def compare(results, baseline, threshold):
+    """print each case's change from the baseline, returns the names that got slower than threshold allows"""
+    regressions = []
+    print(f"\n{'compared to baseline':<48}{'baseline ns':>14}{'now ns':>14}{'change':>10}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, now = baseline[name]['ns_per_op'], result['ns_per_op']
+        change = now / before - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<48}{before:>14,.0f}{now:>14,.0f}{change:>+10.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the codec, crypto and Board operations')
+    parser.add_argument('-f', '--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timed runs per benchmark, the median is reported')
+    parser.add_argument('--min-time', type=float, default=0.1, help='Seconds each timed run lasts at least')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Slowdown that counts as a regression, 0.1 is 10%%')
+    parser.add_argument('-k', '--key-spool', default=DEFAULT_SPOOL_DIR, help='Directory of pre-generated RSA keys, pass "" to disable')
+    args = parser.parse_args()
+
+    pool = KeyPool(size=2, spool_dir=args.key_spool)
+    keys = [pool.pop(), pool.pop()]
+    pool.close()
+    cases = {name: function for name, function in benchmarks(keys).items() if args.filter in name}
+    results = run(cases, args.repeat, args.min_time)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python': sys.version, 'machine': platform.platform(), 'results': results}, file, indent=4)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
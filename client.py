@@ -1,21 +1,28 @@
 import socket
 import argparse
+import time
 import traceback
-import rsa
 
 import protocols
 from Player import Player
-from Board import Board
+from Board import BOARD_ENGINES, get_board_class
 import auxillary
 
 from simulate_certificate_authority import CertificateAuthority
+from key_pool import KeyPool, DEFAULT_SPOOL_DIR
+from framing import FrameDecoder
 
 ca = CertificateAuthority(is_server=False)
 
 KEYS = {}
+DECODER = FrameDecoder()
+RENDERER = None # keeps the board up to date in the terminal, unless the GUI is used
+MOVES = [] # (player id, column) of every move on our board in order, to catch up with the server's after resuming
+RESUME_RETRY_INTERVAL = 1 # seconds between attempts to reconnect after losing the connection mid game
 
 def main():
     game_over = False
+    KEYS['pool'] = KeyPool(size=1, spool_dir=args.key_spool) # starts generating our keys while the player types their name
     
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
@@ -35,12 +42,27 @@ def main():
             players = sorted(players)
             Player.set_player_colors(players)
 
-            board = Board(players, in_terminal=(not args.gui))
+            board = get_board_class(args.board)(players, in_terminal=(not args.gui))
+            if not args.gui:
+                from terminal_renderer import TerminalRenderer
+                global RENDERER
+                RENDERER = TerminalRenderer(board)
+                RENDERER.draw(f"Waiting for {other_player.name}...")
             while(True):
                 try:
-                    recv_data = sock.recv(11)
-                    if recv_data:
-                        message = protocols.read_json_bytes(recv_data, sock, KEYS['pri_key'])
+                    try:
+                        message = read_message(sock, KEYS['pri_key'])
+                    except OSError: # e.g. the connection was reset, treated like the server disconnecting
+                        message = None
+                    if not message:
+                        resumed, message = resume_game(sock, board)
+                        if resumed is None:
+                            print('Server has disconnected, closing socket')
+                            break
+                        sock = resumed
+                        if not args.gui:
+                            RENDERER.draw(f"Waiting for {other_player.name}...")
+                    if message:
                         if message['proto'] == protocols.Protocols.GAME_OVER:
                             game_over = True
                             break
@@ -52,12 +74,10 @@ def main():
                             # raise auxillary.CustomError(f"Game was exited")
                             break
                         message = protocols.make_move(my_move)
-                        protocols.send_bytes(protocols.make_json_bytes(message), sock, KEYS['server_pub_key'], True)
-
-                    else:
-                        print('Server has disconnected, closing socket')
-                        sock.close()
-                        break
+                        try:
+                            protocols.send_message(message, sock, KEYS['format'], server_key())
+                        except OSError:
+                            pass # the next read finds the connection gone, the move is sent again after resuming
                 except auxillary.CustomError as e:
                     print(e)
                     continue
@@ -76,6 +96,7 @@ def main():
         print(f"An unexpected error occurred: {e}")
     finally:
         sock.close()
+        KEYS['pool'].close()
         print("Restart to play again")
 
 def game_over_handling(message, board, players, other_player):
@@ -84,12 +105,11 @@ def game_over_handling(message, board, players, other_player):
             board.update_board_game_over(f"{other_player.name} has forfeited.")
         else:
             print(f"{auxillary.color_text(other_player, other_player.name)} has forfeited.")
-    if message['winner'] != MY_ID: # if I am not the winner, reprint the board with the winning move
-        col = message['last_move']
+    if message['winner'] != MY_ID and message['last_move'] > 0: # if I am not the winner, reprint the board with the winning move
+        col = message['last_move'] # (-1 when resuming already brought the board up to date)
         board.place_tile(col, (MY_ID + 1)%2)
         if not args.gui:
-            auxillary.clear_terminal()
-            print(board)
+            RENDERER.draw("Game over")
     if message['winner'] == -1:
         if args.gui:
             board.update_board_game_over("There are no more valid moves; the game is a draw")
@@ -104,13 +124,12 @@ def game_over_handling(message, board, players, other_player):
 
 
 def setup(sock):
-    KEYS['pub_key'], KEYS['pri_key'] = rsa.newkeys(512)
+    KEYS['pub_key'], KEYS['pri_key'] = KEYS['pool'].pop()
     name = input('Please enter your name: ')
     message = protocols.register_with_server(name, KEYS['pub_key'], ca)
     protocols.send_bytes( protocols.make_json_bytes(message), sock, None, False)
     try:
-        recv_data = sock.recv(11)
-        response = protocols.read_json_bytes(recv_data, sock, None)
+        response = read_message(sock, None)
     except socket.error as e:
         print(f"Error: Socket error during setup - {e}")
         return
@@ -127,13 +146,86 @@ def setup(sock):
         raise auxillary.CustomError("Server's public key could not be verified. Disconnecting and exiting.")
     print(f'Server key verified: {verified}')
     KEYS['server_pub_key'] = response['pub_key']
+    KEYS['cipher'] = protocols.open_session_key(response, KEYS['pri_key'])
+    KEYS['format'] = response.get('format', protocols.WireFormats.JSON) # older servers only speak JSON
+    KEYS['ticket'] = response.get('ticket') # for resuming the game if the connection drops, only with a session cipher
+    KEYS['resume_within'] = response.get('resume_within', 0)
     MY_ID = response['player_id']
     my_player = Player(name, MY_ID, True)
     return my_player
 
+def read_message(sock, my_priKey):
+    """wait for the next complete message from the server, None if the server disconnected"""
+    frame = DECODER.next_frame(sock)
+    if frame is None:
+        return None
+    mode, payload, proto = frame
+    return protocols.decode_payload(mode, payload, my_priKey, KEYS.get('cipher'), proto)
+
+def server_key():
+    """the session cipher agreed on with the server, or its public key if it doesn't support one"""
+    return KEYS['cipher'] if KEYS['cipher'] is not None else KEYS['server_pub_key']
+
+def resume_game(sock, board):
+    """
+    After the connection to the server drops mid game, reconnect and pick up where we left off with the ticket from
+    registration instead of registering again. Returns the new socket (None if the game can't be resumed) and the
+    message to carry on with, like a YOUR_TURN that was lost, or None if it's the other player's turn
+    """
+    sock.close()
+    sock, response = reconnect()
+    if sock is None:
+        return None, None
+    if len(response['moves']) < len(MOVES): # our last move was lost with the connection, send it again
+        protocols.send_message(protocols.make_move(MOVES[-1][1]), sock, KEYS['format'], server_key())
+        return sock, None
+    for player_id, col in response['moves'][len(MOVES):]: # moves made while we were gone
+        board.place_tile(col, player_id)
+        MOVES.append((player_id, col))
+    if response['turn'] == -1:
+        return sock, protocols.game_over(response['winner'], -2 if response['forfeit'] else -1)
+    if response['turn'] == MY_ID:
+        return sock, protocols.your_turn(-1) # the other player's move, if there was one, is already on the board
+    return sock, None
+
+def reconnect():
+    """
+    keep trying to reconnect and resume for as long as the server holds our seat. Returns the new socket and the
+    server's RESUME_CONFIRM, or (None, None) if the game can't be resumed
+    """
+    global DECODER
+    if KEYS.get('ticket') is None:
+        return None, None
+    print("Lost the connection to the server, reconnecting...")
+    deadline = time.monotonic() + KEYS['resume_within']
+    while time.monotonic() < deadline:
+        try:
+            sock = socket.create_connection((args.server_ip, args.port), timeout=max(0.1, deadline - time.monotonic()))
+        except OSError:
+            time.sleep(RESUME_RETRY_INTERVAL)
+            continue
+        DECODER = FrameDecoder() # anything left over from the old connection is of no use
+        try:
+            protocols.send_bytes(protocols.make_json_bytes(protocols.resume_session(KEYS['ticket'], KEYS['cipher'])), sock, None, False)
+            response = read_message(sock, KEYS['pri_key'])
+        except OSError:
+            response = None
+        if response is None: # dropped again before the server answered
+            sock.close()
+            time.sleep(RESUME_RETRY_INTERVAL)
+            continue
+        if response['proto'] != protocols.Protocols.RESUME_CONFIRM:
+            print(response.get('error_message', f"Unexpected message from server: {response}"))
+            sock.close()
+            return None, None
+        sock.settimeout(None)
+        KEYS['ticket'] = response['ticket']
+        print("Reconnected")
+        return sock, response
+    return None, None
+
 def get_other_player_info(sock):
-    recv_data = sock.recv(11)
-    response = protocols.read_json_bytes(recv_data, sock, KEYS['pri_key'])
+    response = read_message(sock, KEYS['pri_key'])
     other_player = Player(response['other_name'], response['other_id'], False)
     return other_player
 
@@ -141,13 +233,13 @@ def take_my_turn(message, board, players):
     if message['last_move'] != -1: #place the other players tile because this isn't the first move
         col = message['last_move']
         board.place_tile(col, (MY_ID + 1)%2)
+        MOVES.append(((MY_ID + 1)%2, col))
         
     if args.gui:
         col = board.update_board(MY_ID)
 
     else:
-        auxillary.clear_terminal()
-        print(board)
+        RENDERER.draw("It's your turn!")
         while True:
             try:
                 col = int(input(f'{auxillary.color_text(players[MY_ID], players[MY_ID].name)}, what column? '))
@@ -157,8 +249,9 @@ def take_my_turn(message, board, players):
                 print("Invalid location")
             except ValueError:
                 print('input must be a valid column number')
-        auxillary.clear_terminal()
-        print(board)
+        RENDERER.draw(f"Waiting for {players[(MY_ID + 1) % 2].name}...")
+    if col is not None:
+        MOVES.append((MY_ID, col))
     return col
 
 def get_instructions():
@@ -190,6 +283,16 @@ if __name__ == '__main__':
                         default=False, 
                         required=False,
                         help='Opt in for GUI board')
+    parser.add_argument('-b', '--board',
+                        choices=BOARD_ENGINES,
+                        default='bitboard', # doesn't need NumPy, so the client starts faster
+                        required=False,
+                        help='Game engine used to store the board')
+    parser.add_argument('-k', '--key-spool',
+                        metavar='<Directory>',
+                        default=DEFAULT_SPOOL_DIR,
+                        required=False,
+                        help='Directory of pre-generated RSA keys shared between processes, pass "" to disable')
     args = parser.parse_args()
     main()
 
@@ -0,0 +1,162 @@
+from collections import deque
+
+from protocols import parse_header
+from auxillary import CustomError
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+MAX_IOVECS = 1024 # most buffers one sendmsg call takes (IOV_MAX on Linux)
+
+class FrameDecoder:
+    """
+    Per-connection receive state machine. Reads straight into one reusable buffer with recv_into,
+    splits out every complete frame and keeps a partial frame buffered until the rest of it arrives.
+    Frames can be in either the JSON or binary format, proto is None for JSON frames.
+    """
+
+    def __init__(self, size: int = DEFAULT_BUFFER_SIZE) -> None:
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte not yet parsed
+        self.end = 0 # one past the last byte received
+        self.frames = deque() # (mode, payload, proto) of complete frames not yet handed out, only used by next_frame
+
+    def read_from(self, sock):
+        """
+        For non-blocking sockets. Pulls everything available with as few recv_into calls as possible.
+        Returns (frames, closed), frames is a list of (mode, payload, proto) and closed is True when the peer closed the connection
+        """
+        closed = False
+        frames = []
+        while True:
+            if self.end == len(self.buffer):
+                # parse before making room, so a frame claiming more than MAX_FRAME_SIZE is refused before the buffer grows
+                frames.extend(self._parse())
+                if self.end == len(self.buffer):
+                    self._make_room()
+            try:
+                received = sock.recv_into(self.view[self.end:])
+            except BlockingIOError:
+                break
+            if received == 0:
+                closed = True
+                break
+            self.end += received
+            if self.end < len(self.buffer): # the socket had less than the free space, so it's drained
+                break
+        frames.extend(self._parse())
+        return frames, closed
+
+    def next_frame(self, sock):
+        """For blocking sockets. Waits for the next complete frame, returns None if the connection closes first"""
+        while not self.frames:
+            if self.end == len(self.buffer):
+                self._make_room()
+            received = sock.recv_into(self.view[self.end:])
+            if received == 0:
+                return None
+            self.end += received
+            self.frames.extend(self._parse())
+        return self.frames.popleft()
+
+    def _parse(self):
+        frames = []
+        while True:
+            try:
+                header = parse_header(self.buffer, self.start, self.end - self.start)
+            except CustomError: # lost track of where frames start, drop what's buffered
+                self.start = self.end = 0
+                raise
+            if header is None:
+                break
+            header_size, length, mode, proto = header
+            frame_end = self.start + header_size + length
+            if frame_end > self.end:
+                if header_size + length > len(self.buffer):
+                    self._grow(header_size + length)
+                break
+            frames.append((mode, bytes(self.view[self.start + header_size:frame_end]), proto))
+            self.start = frame_end
+        if self.start == self.end: # everything parsed, start over at the front of the buffer
+            self.start = self.end = 0
+        return frames
+
+    def _make_room(self):
+        """move the unparsed bytes to the front of the buffer, or grow it if they already fill it"""
+        if self.start == 0:
+            self._grow(2 * len(self.buffer))
+            return
+        remaining = self.end - self.start
+        self.buffer[:remaining] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, remaining
+
+    def _grow(self, size):
+        new_buffer = bytearray(max(size, len(self.buffer)))
+        remaining = self.end - self.start
+        new_buffer[:remaining] = self.view[self.start:self.end]
+        self.view.release()
+        self.buffer, self.view = new_buffer, memoryview(new_buffer)
+        self.start, self.end = 0, remaining
+
+class OutboundQueue:
+    """
+    Frames waiting to be written to a non-blocking socket. Everything queued is written with one scatter-gather
+    sendmsg call, so frames queued during the same tick go out together without being copied into one buffer.
+    """
+
+    def __init__(self) -> None:
+        self.frames = deque()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, frame) -> bool:
+        """queue a frame, returns True if the queue was empty so the caller knows to schedule a flush"""
+        was_empty = not self.frames
+        self.frames.append(frame)
+        return was_empty
+
+    def flush(self, sock) -> bool:
+        """write as much as the socket will take, returns True once nothing is left queued"""
+        while self.frames:
+            try:
+                if hasattr(sock, 'sendmsg'):
+                    sent = sock.sendmsg([self.frames[i] for i in range(min(len(self.frames), MAX_IOVECS))])
+                else: # Windows has no sendmsg
+                    sent = sock.send(b''.join(self.frames))
+            except (BlockingIOError, InterruptedError):
+                return False
+            partial = self._consume(sent)
+            if partial: # the socket's send buffer is full
+                return False
+        return True
+
+    def _consume(self, sent):
+        """drop the frames that were fully written, returns True if a frame was only partly written"""
+        while sent:
+            head = self.frames[0]
+            if len(head) > sent:
+                self.frames[0] = memoryview(head)[sent:]
+                return True
+            sent -= len(head)
+            self.frames.popleft()
+        return False
+
+class StreamOutbound:
+    """Stands in for OutboundQueue with asyncio streams, the StreamWriter does its own buffering and non-blocking writes"""
+
+    def __init__(self, writer) -> None:
+        self.writer = writer
+
+    def __len__(self):
+        return 0
+
+    def push(self, frame) -> bool:
+        self.writer.write(frame)
+        return False # nothing for the caller to flush
+
+    def flush(self, sock) -> bool:
+        return True
+
+    def close(self):
+        """close the stream, which ends the task reading from it"""
+        self.writer.close()
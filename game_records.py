@@ -0,0 +1,202 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+import uuid
+
+import numpy as np
+
+DEFAULT_RECORD_PATH = 'game-records.c4r'
+
+# Every record is 16 bytes: kind, shard (the server worker the game ran on), player seat, column, game id and a timestamp
+# in microseconds. The file starts with a header padded to the same size, so record i is always at RECORD_SIZE * (i + 1).
+# Game ids are unique within a file, across server runs and workers
+RECORD_FORMAT = '<BBbbIQ'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_DTYPE = np.dtype([('kind', 'u1'), ('shard', 'u1'), ('player', 'i1'), ('column', 'i1'), ('game', '<u4'), ('time', '<u8')])
+FILE_MAGIC = b'C4REC'
+FILE_VERSION = 1
+FILE_HEADER_FORMAT = f'<5sBbb{RECORD_SIZE - 8}x' # magic, version, board rows and columns
+
+class RecordKinds:
+    START = 1 # player is the seat that moves first
+    MOVE = 2 # player is the seat that moved, column where they played counted from 0
+    RESULT = 3 # player is the winning seat (-1 for a draw), column is one of the RESULT_ reasons below
+
+RESULT_FINISHED = 0
+RESULT_FORFEIT = 1
+
+class GameRecorder:
+    """
+    Appends game records to the record file. Records are buffered and written with one write per server tick.
+    The file is opened with O_APPEND, so workers of the same server can all write to it without tearing records.
+    Each of the shards workers hands out the game ids that are shard modulo shards, starting above every id already
+    in the file, so they never give out the same id. Only one server should write to a file at a time.
+    """
+
+    def __init__(self, path: str = DEFAULT_RECORD_PATH, shard: int = 0, shards: int = 1, rows: int = 6, cols: int = 7) -> None:
+        self.path = path
+        self.shard = shard
+        self.shards = shards
+        self.pending = []
+        create_record_file(path, rows, cols)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        self.next_game = self._first_free_game()
+
+    def start(self, first_player):
+        """record a new game, returns its id"""
+        game = self.next_game
+        self.next_game += self.shards
+        self._add(RecordKinds.START, first_player, -1, game)
+        return game
+
+    def move(self, game, player, column):
+        self._add(RecordKinds.MOVE, player, column, game)
+
+    def result(self, game, winner, reason=RESULT_FINISHED):
+        self._add(RecordKinds.RESULT, winner, reason, game)
+
+    def flush(self):
+        if self.pending:
+            os.write(self.fd, b''.join(self.pending))
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+    def _first_free_game(self):
+        record_file = RecordFile(self.path)
+        games = record_file.records['game']
+        first = int(games.max()) + 1 if len(games) else 0
+        del games # the mmap can't close while a view of it is alive
+        record_file.close()
+        return first + (self.shard - first) % self.shards
+
+    def _add(self, kind, player, column, game):
+        self.pending.append(struct.pack(RECORD_FORMAT, kind, self.shard, player, column, game, time.time_ns() // 1000))
+
+def create_record_file(path, rows, cols):
+    """create the file with its header unless it exists, linking a finished temp file in so nobody sees it half made"""
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(struct.pack(FILE_HEADER_FORMAT, FILE_MAGIC, FILE_VERSION, rows, cols))
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError: # another process made it first
+        pass
+    finally:
+        os.remove(tmp_path)
+
+class RecordFile:
+    """Read only view of a record file, the records are a numpy structured array over an mmap of the file"""
+
+    def __init__(self, path: str = DEFAULT_RECORD_PATH) -> None:
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rows, self.cols = struct.unpack_from(FILE_HEADER_FORMAT, self.map)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path} is not a version {FILE_VERSION} game record file")
+        count = len(self.map) // RECORD_SIZE - 1 # a record cut off by a crash is left out
+        self.records = np.frombuffer(self.map, dtype=RECORD_DTYPE, count=count, offset=RECORD_SIZE)
+
+    def game(self, game):
+        """the records of one game, in the order they were written"""
+        return self.records[self.records['game'] == game]
+
+    def stats(self):
+        records = self.records
+        starts = records[records['kind'] == RecordKinds.START]
+        moves = records[records['kind'] == RecordKinds.MOVE]
+        results = records[records['kind'] == RecordKinds.RESULT]
+        columns = moves['column'][(moves['column'] >= 0) & (moves['column'] < self.cols)] # older servers could record bad moves
+        _, moves_per_game = np.unique(moves['game'], return_counts=True)
+
+        # match each result with its game's start to see whether whoever moved first won
+        start_keys = starts['game']
+        order = np.argsort(start_keys)
+        result_keys = results['game']
+        found = np.searchsorted(start_keys, result_keys, sorter=order)
+        found = np.minimum(found, max(len(order) - 1, 0))
+        if len(order):
+            has_start = start_keys[order[found]] == result_keys
+        else:
+            has_start = np.zeros(len(results), dtype=bool)
+        started = results[has_start]
+        first_players = starts['player'][order[found[has_start]]]
+        decided = started[started['column'] == RESULT_FINISHED]
+        decided_first = first_players[started['column'] == RESULT_FINISHED]
+        durations = (started['time'] - starts['time'][order[found[has_start]]]) / 1e6
+
+        return {
+            'games started': len(starts),
+            'games finished': int(np.count_nonzero(results['column'] == RESULT_FINISHED)),
+            'games forfeited': int(np.count_nonzero(results['column'] == RESULT_FORFEIT)),
+            'draws': int(np.count_nonzero((results['column'] == RESULT_FINISHED) & (results['player'] < 0))),
+            'first player wins': int(np.count_nonzero(decided['player'] == decided_first)),
+            'moves': len(moves),
+            'mean moves per game': float(moves_per_game.mean()) if len(moves_per_game) else 0.0,
+            'mean game seconds': float(durations.mean()) if len(durations) else 0.0,
+            'moves per column': np.bincount(columns, minlength=self.cols).tolist(),
+        }
+
+    def close(self):
+        del self.records
+        self.map.close()
+
+def replay(record_file, game, show_steps=False):
+    """rebuild a game on a Board, returns the board and the text to print"""
+    from Board import Board
+    from Player import Player
+    records = record_file.game(game)
+    if len(records) == 0:
+        raise ValueError(f"No records of game {game}")
+    players = [Player('player 0', 0), Player('player 1', 1)]
+    Player.set_player_colors(players)
+    board = Board(players)
+    lines = []
+    for record in records:
+        kind, player, column = int(record['kind']), int(record['player']), int(record['column'])
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(record['time']) / 1e6))
+        if kind == RecordKinds.START:
+            lines.append(f"{when} game {game} started, player {player} moves first")
+        elif kind == RecordKinds.MOVE:
+            board.place_tile(column + 1, player) # the board counts columns from 1 like the protocol
+            lines.append(f"{when} player {player} played column {column + 1}")
+            if show_steps:
+                lines.append(str(board))
+        elif kind == RecordKinds.RESULT:
+            outcome = "a draw" if player < 0 else f"won by player {player}"
+            how = " by forfeit" if column == RESULT_FORFEIT else ""
+            lines.append(f"{when} game {game} was {outcome}{how}")
+    if not show_steps:
+        lines.append(str(board))
+    return board, "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay and analyse the server's game records")
+    parser.add_argument('-f', '--file', default=DEFAULT_RECORD_PATH, help='Game record file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List the recorded games')
+    show = commands.add_parser('show', help='Replay one game')
+    show.add_argument('game', type=int, help='Game id, from list')
+    show.add_argument('-s', '--steps', action='store_true', help='Print the board after every move')
+    commands.add_parser('stats', help='Statistics over every recorded game')
+    args = parser.parse_args()
+
+    record_file = RecordFile(args.file)
+    if args.command == 'list':
+        starts = record_file.records[record_file.records['kind'] == RecordKinds.START]
+        for record in starts:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(record['time']) / 1e6))
+            print(f"{record['game']:>8}  {when}  worker {record['shard']}")
+    elif args.command == 'show':
+        _, text = replay(record_file, args.game, show_steps=args.steps)
+        print(text)
+    else:
+        for name, value in record_file.stats().items():
+            print(f"{name:>20}: {value}")
+    record_file.close()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import uuid
+import rsa
+from concurrent.futures import ProcessPoolExecutor
+
+KEY_BITS = 512
+# private keys don't belong in the checkout: the per-user runtime directory if there is one, otherwise the temp directory
+SPOOL_OWNER = os.getuid() if hasattr(os, 'getuid') else os.getlogin() # the temp directory can be shared between users
+DEFAULT_SPOOL_DIR = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"connect4-key-spool-{SPOOL_OWNER}")
+
+def generate_private_pem(bits: int) -> bytes:
+    """runs in a worker process, the private key PEM also carries the public key"""
+    _, pri_key = rsa.newkeys(bits)
+    return pri_key.save_pkcs1(format='PEM')
+
+def keys_from_pem(pem: bytes):
+    pri_key = rsa.PrivateKey.load_pkcs1(pem, format='PEM')
+    return rsa.PublicKey(pri_key.n, pri_key.e), pri_key
+
+class KeyPool:
+    """
+    Keeps fresh RSA key pairs ready so nobody waits on key generation when they need one.
+    Keys are generated by a background process pool. With a spool directory, keys left over at close are saved there
+    and any process sharing the directory can claim them, so a new process usually gets a key without generating one.
+    """
+
+    def __init__(self, size: int = 1, spool_dir: str = DEFAULT_SPOOL_DIR, workers: int = None, bits: int = KEY_BITS) -> None:
+        self.size = size
+        self.spool_dir = spool_dir
+        self.bits = bits
+        self.pending = [] # futures of keys being generated, oldest first
+        self.ready = [] # generated keys (private PEMs) that haven't been handed out
+        self.executor = ProcessPoolExecutor(max_workers=workers or min(size, os.cpu_count() or 1))
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, mode=0o700, exist_ok=True) # only this user can claim or read the keys
+        self.fill()
+
+    def fill(self):
+        """start generating keys until size keys are ready or on the way"""
+        while len(self.ready) + len(self.pending) < self.size:
+            self.pending.append(self.executor.submit(generate_private_pem, self.bits))
+
+    def pop(self):
+        """return a (public key, private key) pair, instantly unless no key is ready anywhere"""
+        pem = self._take_generated(wait=False) or self._claim_from_spool() or self._take_generated(wait=True)
+        if pem is None: # nothing ready or pending, generate one here
+            pem = generate_private_pem(self.bits)
+        self.fill()
+        return keys_from_pem(pem)
+
+    def close(self, wait=False):
+        """
+        stop the workers, saving any keys that are ready (or almost ready) to the spool for the next process.
+        Without a spool, wait says whether to wait for the workers to exit (needed before forking)
+        """
+        if self.spool_dir:
+            for future in self.pending:
+                future.cancel()
+            self.executor.shutdown(wait=True)
+            for future in self.pending:
+                if not future.cancelled() and future.exception() is None:
+                    self.ready.append(future.result())
+            for pem in self.ready:
+                self._add_to_spool(pem)
+        else:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+        self.pending, self.ready = [], []
+
+    def _take_generated(self, wait):
+        if self.ready:
+            return self.ready.pop()
+        for future in self.pending:
+            if wait or future.done():
+                self.pending.remove(future)
+                return future.result()
+        return None
+
+    def _claim_from_spool(self):
+        """take a key from the spool, renaming the file first so two processes can never take the same key"""
+        if not self.spool_dir:
+            return None
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith('.pem'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed)
+            except OSError: # someone else got it first
+                continue
+            with open(claimed, 'rb') as file:
+                pem = file.read()
+            os.remove(claimed)
+            return pem
+        return None
+
+    def _add_to_spool(self, pem):
+        """write to a temporary name and rename, so a partly written key is never claimed"""
+        name = uuid.uuid4().hex
+        tmp_path = os.path.join(self.spool_dir, f"{name}.tmp")
+        with open(tmp_path, 'wb') as file:
+            file.write(pem)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, os.path.join(self.spool_dir, f"{name}.pem"))
@@ -0,0 +1,10 @@
+from Board import NUM_COLS
+
+HEADER = '\n  ' + "   ".join(str(n+1) for n in range(NUM_COLS)) + ' \n\n'
+
+def draw_board(board):
+    """the board for the log file, each tile as its player's id so it reads without colors"""
+    lines = [HEADER]
+    for row in reversed(board.rows()): # top row first
+        lines.append('| ' + " | ".join(' ' if tile == board.FILL_VALUE else str(tile) for tile in row) + ' |\n')
+    return ''.join(lines)
@@ -0,0 +1,149 @@
+import time
+from collections import deque
+
+SUB_BUCKET_BITS = 5 # values are recorded to within 1/16 (about 6%)
+MAX_VALUE_BITS = 40 # about 18 minutes in nanoseconds, longer values are counted in the last bucket
+# le buckets of the Prometheus histograms, in seconds
+DEFAULT_BOUNDS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+def bucket_index(value):
+    """
+    HDR-style log-linear bucketing: values below 2**SUB_BUCKET_BITS get a bucket each, above that every power of two
+    is split into 2**(SUB_BUCKET_BITS - 1) equal buckets
+    """
+    bits = value.bit_length()
+    if bits <= SUB_BUCKET_BITS:
+        return value
+    shift = bits - SUB_BUCKET_BITS
+    half = 1 << (SUB_BUCKET_BITS - 1)
+    return (1 << SUB_BUCKET_BITS) + (shift - 1) * half + (value >> shift) - half
+
+def bucket_upper(index):
+    """the largest value recorded in a bucket"""
+    if index < 1 << SUB_BUCKET_BITS:
+        return index
+    half = 1 << (SUB_BUCKET_BITS - 1)
+    shift, mantissa = divmod(index - (1 << SUB_BUCKET_BITS), half)
+    shift += 1
+    return ((mantissa + half + 1) << shift) - 1
+
+BUCKET_COUNT = bucket_index((1 << MAX_VALUE_BITS) - 1) + 1
+
+class Histogram:
+    """Durations in nanoseconds, recorded in constant time into log-linear buckets so percentiles stay accurate at any scale"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index if index < BUCKET_COUNT else BUCKET_COUNT - 1] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """the value percent% of recordings are at or below, to the histogram's precision"""
+        if self.count == 0:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """number of recordings at or below each bound (in nanoseconds), counting whole buckets"""
+        counts = []
+        index = seen = 0
+        for bound in bounds:
+            while index < BUCKET_COUNT and bucket_upper(index) <= bound:
+                seen += self.counts[index]
+                index += 1
+            counts.append(seen)
+        return counts
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Rate:
+    """events per second over the last window seconds, kept as one count per second"""
+
+    def __init__(self, window: int = 10) -> None:
+        self.window = window
+        self.seconds = deque() # [second, count]
+
+    def mark(self, amount=1):
+        second = int(time.monotonic())
+        if self.seconds and self.seconds[-1][0] == second:
+            self.seconds[-1][1] += amount
+        else:
+            self.seconds.append([second, amount])
+            if len(self.seconds) > self.window:
+                self.seconds.popleft()
+
+    def per_second(self):
+        start = int(time.monotonic()) - self.window
+        return sum(count for second, count in self.seconds if second > start) / self.window
+
+class Metrics:
+    """
+    The server's counters, gauges and histograms, rendered in the Prometheus text exposition format.
+    Counters and histograms are updated inline, gauges are functions only called when the metrics are scraped.
+    labels are added to every metric, e.g. which worker process they're from
+    """
+
+    def __init__(self, namespace: str, bounds=DEFAULT_BOUNDS) -> None:
+        self.namespace = namespace
+        self.bounds = bounds
+        self.labels = {}
+        self.families = {} # name -> (type, help, {labels: Counter, Histogram or gauge function})
+
+    def counter(self, name, help, **labels):
+        return self._add(name, 'counter', help, labels, Counter())
+
+    def histogram(self, name, help, **labels):
+        return self._add(name, 'histogram', help, labels, Histogram())
+
+    def gauge(self, name, help, read, **labels):
+        return self._add(name, 'gauge', help, labels, read)
+
+    def _add(self, name, kind, help, labels, metric):
+        _, _, metrics = self.families.setdefault(f"{self.namespace}_{name}", (kind, help, {}))
+        metrics[tuple(sorted(labels.items()))] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for name, (kind, help, metrics) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics.items():
+                labels = {**self.labels, **dict(labels)}
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {metric.value}")
+                elif kind == 'gauge':
+                    lines.append(f"{name}{format_labels(labels)} {metric()}")
+                else:
+                    bounds_ns = [bound * 1e9 for bound in self.bounds]
+                    for bound, count in zip(self.bounds, metric.cumulative(bounds_ns)):
+                        lines.append(f"{name}_bucket{format_labels({**labels, 'le': repr(bound)})} {count}")
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {metric.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {metric.total / 1e9}")
+                    lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
@@ -0,0 +1,150 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Board import NUM_COLS, NUM_ROWS
+from BitBoard import COL_BITS, COLUMN_MASKS, has_winning_line
+from solver import DEFAULT_TIME_BUDGET, playable, search
+
+DEFAULT_BOOK_PATH = 'opening-book.c4b'
+DEFAULT_DEPTH = 4
+
+# The file is a 16 byte header, then every position's key as a sorted uint64, then the best column (counted from 0) of
+# each as an int8, then each score as an int8. A position's key is current + mask in BitBoard's layout, which is unique
+# per position. A position and its mirror image are stored once, under whichever of their keys is smaller.
+# Scores are the solver's from the player to move's side, 0 is a draw or a position it couldn't solve in its time
+FILE_MAGIC = b'C4BK'
+FILE_VERSION = 3 # version 1 books scored some losses one too low and version 2 books mirrored some columns by mistake
+FILE_HEADER_FORMAT = '<4sBBBxII' # magic, version, board rows and columns, depth, position count, padding
+HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+COLUMN_BITS = (1 << COL_BITS) - 1 # one column's slots and the spare bit above them, in the lowest column
+
+def mirror(bits):
+    """the bitboard flipped left to right"""
+    mirrored = 0
+    for col in range(NUM_COLS):
+        mirrored |= ((bits >> (col * COL_BITS)) & COLUMN_BITS) << ((NUM_COLS - 1 - col) * COL_BITS)
+    return mirrored
+
+def canonical_key(current, mask):
+    """(key of the position or its mirror image, whichever is smaller, whether it was the mirror image)"""
+    key = current + mask
+    mirrored = mirror(key) # the column sums don't carry into each other, so mirroring the sum is the sum of the mirrors
+    return (mirrored, True) if mirrored < key else (key, False)
+
+def positions_up_to(depth):
+    """one (current, mask, moves) per position with at most depth tiles that nobody has won yet, as the image with the smaller key"""
+    level = {canonical_key(0, 0)[0]: (0, 0, 0)}
+    found = dict(level)
+    for moves in range(depth):
+        following = {}
+        for current, mask, _ in level.values():
+            possible = playable(mask)
+            for col in range(NUM_COLS):
+                move = possible & COLUMN_MASKS[col]
+                if not move:
+                    continue
+                if has_winning_line(current | move): # the game is over, no position to look up
+                    continue
+                child_current, child_mask = current ^ mask, mask | move # the other player is to move
+                key, mirrored = canonical_key(child_current, child_mask)
+                if mirrored: # keep the image the key is for, so its solved column is in the frame lookup expects
+                    child_current, child_mask = mirror(child_current), mirror(child_mask)
+                following.setdefault(key, (child_current, child_mask, moves + 1))
+        found.update(following)
+        level = following
+    return found
+
+class OpeningBook:
+    """
+    Read only view of an opening book file. The keys are a numpy array over an mmap of the file, so processes that open
+    the same book share its pages and opening it reads nothing until the first lookup
+    """
+
+    def __init__(self, path: str = DEFAULT_BOOK_PATH) -> None:
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, cols, self.depth, count = struct.unpack_from(FILE_HEADER_FORMAT, self.map)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path} is not a version {FILE_VERSION} opening book, rebuild it with opening_book.py build")
+        if (rows, cols) != (NUM_ROWS, NUM_COLS):
+            raise ValueError(f"{path} is for a {rows}x{cols} board, not {NUM_ROWS}x{NUM_COLS}")
+        self.keys = np.frombuffer(self.map, dtype='<u8', count=count, offset=HEADER_SIZE)
+        self.columns = np.frombuffer(self.map, dtype='i1', count=count, offset=HEADER_SIZE + 8 * count)
+        self.scores = np.frombuffer(self.map, dtype='i1', count=count, offset=HEADER_SIZE + 9 * count)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, current, mask):
+        """(best column counted from 0, score) of a position, None if it isn't in the book"""
+        key, mirrored = canonical_key(current, mask)
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index == len(self.keys) or int(self.keys[index]) != key:
+            return None
+        column = int(self.columns[index])
+        return (NUM_COLS - 1 - column if mirrored else column), int(self.scores[index])
+
+    def close(self):
+        del self.keys, self.columns, self.scores # the mmap can't close while a view of it is alive
+        self.map.close()
+
+def write_book(path, depth, entries):
+    """write {key: (column, score)} as a book, linked into place once it's complete so readers never see half of it"""
+    keys = np.array(sorted(entries), dtype='<u8')
+    columns = np.array([entries[int(key)][0] for key in keys], dtype='i1')
+    scores = np.array([entries[int(key)][1] for key in keys], dtype='i1')
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(struct.pack(FILE_HEADER_FORMAT, FILE_MAGIC, FILE_VERSION, NUM_ROWS, NUM_COLS, depth, len(keys)))
+        file.write(keys.tobytes())
+        file.write(columns.tobytes())
+        file.write(scores.tobytes())
+    os.replace(tmp_path, path)
+
+def solve_position(position, time_budget):
+    """(column, score) for the book, scores the solver couldn't prove are stored as 0"""
+    column, score, _ = search(*position, time_budget)
+    return column, int(score) if abs(score) >= 1 else 0
+
+def build_book(path, depth, time_budget, workers=None):
+    positions = positions_up_to(depth)
+    print(f"Solving {len(positions)} positions of up to {depth} tiles, {time_budget}s each")
+    started = time.monotonic()
+    keys = list(positions)
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(solve_position, [positions[key] for key in keys], [time_budget] * len(keys), chunksize=64)
+        entries = dict(zip(keys, results))
+    write_book(path, depth, entries)
+    print(f"Wrote {path} in {time.monotonic() - started:.1f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or query the computer opponent's opening book")
+    parser.add_argument('-f', '--file', default=DEFAULT_BOOK_PATH, help='Opening book file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Solve every position up to a number of tiles and write the book')
+    build.add_argument('-d', '--depth', type=int, default=DEFAULT_DEPTH, help='Most tiles on the board of a position in the book')
+    build.add_argument('-t', '--time', type=float, default=DEFAULT_TIME_BUDGET * 20, help='Seconds the solver spends on each position')
+    build.add_argument('-j', '--jobs', type=int, help='Worker processes, one per CPU if not given')
+    show = commands.add_parser('show', help="The book's move for a position")
+    show.add_argument('moves', nargs='?', default='', help='Columns played so far counted from 1, e.g. 4453')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_book(args.file, args.depth, args.time, args.jobs)
+    else:
+        book = OpeningBook(args.file)
+        current = mask = 0
+        for col in args.moves:
+            move = playable(mask) & COLUMN_MASKS[int(col) - 1]
+            current, mask = current ^ mask, mask | move
+        entry = book.lookup(current, mask)
+        print(f"{len(book)} positions of up to {book.depth} tiles")
+        print("not in the book" if entry is None else f"play column {entry[0] + 1}, score {entry[1]}")
+        book.close()
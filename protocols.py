@@ -1,16 +1,24 @@
 import json
+import os
 import struct
 import rsa
 import base64
 
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
 from auxillary import CustomError
+from server_log import INFO, DEBUG, format_message
 
 IS_SERVER = False
 SERVER_LOG_PATH = 'server-log.log'
+LOG = None # the server's server_log.ServerLog, without one logging writes straight to SERVER_LOG_PATH
 
 class Protocols:
     REGISTER_CLIENT = 0
     REGISTER_CONFIRM = 1
+    RESUME_SESSION = 2
+    RESUME_CONFIRM = 3
     OTHER_PLAYER = 8
     YOUR_TURN = 5
     MAKE_MOVE = 6
@@ -20,6 +28,8 @@ class Protocols:
     PROTO_NAMES = {
         0: "REGISTER_CLIENT",
         1: "REGISTER_CONFIRM",
+        2: "RESUME_SESSION",
+        3: "RESUME_CONFIRM",
         8: "OTHER_PLAYER",
         5: "YOUR_TURN",
         6: "MAKE_MOVE",
@@ -27,99 +37,361 @@ class Protocols:
         -1: "ERROR"
     }
 
+class Modes:
+    """how the payload after the header is encrypted, the last byte of the header"""
+    PLAIN = 0
+    RSA = 1 # encrypted with the recipient's RSA public key, only used when a session cipher wasn't agreed on
+    SESSION = 2 # encrypted with the symmetric session key agreed on during registration
+
+class SessionCipher:
+    """Authenticated symmetric cipher for a connection, using the key agreed on during registration"""
+    NAME = 'chacha20-poly1305'
+    NONCE_SIZE = 12
+
+    def __init__(self, key: bytes) -> None:
+        self.key = key
+        self.aead = ChaCha20Poly1305(key)
+
+    @staticmethod
+    def generate_key() -> bytes:
+        return ChaCha20Poly1305.generate_key()
+
+    def encrypt(self, data: bytes) -> bytes:
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self.aead.encrypt(nonce, data, None)
+
+    def decrypt(self, data: bytes) -> bytes:
+        try:
+            return self.aead.decrypt(data[:self.NONCE_SIZE], data[self.NONCE_SIZE:], None)
+        except InvalidTag:
+            raise CustomError("Message failed authentication with the session key. Ignoring message.")
+
+class WireFormats:
+    """how messages after registration are encoded, negotiated during registration. Registration itself is always JSON"""
+    BINARY = 'binary'
+    JSON = 'json'
+    SUPPORTED = (BINARY, JSON) # most preferred first
+
 class Errors:
     PLAYER_COUNT_EXCEEDED = 1
     PUBLIC_KEY_NOT_VERIFIED = 2
+    RESUME_FAILED = 3
     CUSTOM_ERROR = -1
 
-def print_and_log(log_str):
+def print_and_log(log_str, level=INFO):
     """ONLY CALLED BY SERVER, print to terminal and to a log file"""
-    with open(SERVER_LOG_PATH, 'a') as file:
-        if isinstance(log_str, dict):
-            log_str = log_str.copy()
-            for key, value in log_str.items():
-                if key == 'pub_key' or key == 'signature':
-                    log_str[key] = 'REDACTED'
-                file.write(f"\t{key}: {log_str[key]}\n")
-                if key == 'proto':
-                    file.write(f"\tmessag_type: {Protocols.PROTO_NAMES[value]}\n")
-        else:
-            file.write(log_str + '\n')
+    if isinstance(log_str, dict):
+        log_message('', log_str, level)
+        return
+    if LOG is not None:
+        LOG.log(log_str, level)
+        return
+    write_log(log_str + '\n')
     print(log_str)
 
-def send_bytes(message_bytes, sock, other_pubKey, encrypt): #will only be none and False for the first messages between client and server
-    if encrypt:
-        message_bytes = rsa.encrypt(message_bytes, other_pubKey)
-    length = len(message_bytes)
-    encrypt_flag = int(encrypt)
-    prefix = struct.pack('>6sI?', b'length', length, encrypt_flag)
-    message_bytes = prefix + message_bytes
+def write_log(text, level=INFO):
+    """ONLY CALLED BY SERVER, append text to the log"""
+    if LOG is not None:
+        LOG.write(text, level)
+        return
+    with open(SERVER_LOG_PATH, 'a') as file:
+        file.write(text)
 
-    total_sent = 0
-    while total_sent < length:
-        try:
-            message_bytes = message_bytes[total_sent:]
-            sent = sock.send(message_bytes)
-            total_sent += sent
-        except BlockingIOError:
-            continue
-
-def read_json_bytes(recv_data, sock, my_priKey): #will only be none for the first messages between client and server
-    label, json_length, encrypt_flag = struct.unpack('>6sI?', recv_data)
+def log_enabled(level):
+    """whether anything logged at level is kept, check it before building expensive log text"""
+    return LOG is None or LOG.enabled(level)
+
+HEADER_FORMAT = '>6sIB' # label, payload length, encryption mode
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_FRAME_SIZE = 256 * 1024 # most payload bytes a frame can claim, the biggest real message (a registration) is a few KiB
+
+BINARY_MAGIC = b'C4'
+BINARY_VERSION = 1
+BINARY_HEADER_FORMAT = '>2sBBbH' # magic, version, encryption mode, proto, payload length
+BINARY_HEADER_SIZE = struct.calcsize(BINARY_HEADER_FORMAT)
+
+# fixed part of each binary message body, strings follow it as utf-8 and their length is the last field
+BINARY_BODIES = {
+    Protocols.OTHER_PLAYER : ('>bB', ('other_id',), 'other_name'),
+    Protocols.YOUR_TURN : ('>b', ('last_move',), None),
+    Protocols.MAKE_MOVE : ('>b', ('move',), None),
+    Protocols.GAME_OVER : ('>bb', ('winner', 'last_move'), None),
+    Protocols.ERROR : ('>bH', ('error_code',), 'error_message'),
+}
+
+def parse_header(buffer, offset, available):
+    """
+    Header at offset in buffer, either format. Returns (header size, payload length, mode, proto), proto is None for JSON frames.
+    Returns None if the whole header hasn't arrived yet
+    """
+    if available < len(BINARY_MAGIC):
+        return None
+    if buffer[offset:offset + len(BINARY_MAGIC)] == BINARY_MAGIC:
+        if available < BINARY_HEADER_SIZE:
+            return None
+        _, version, mode, proto, length = struct.unpack_from(BINARY_HEADER_FORMAT, buffer, offset)
+        if version != BINARY_VERSION:
+            raise CustomError(f"Message recieved with unsupported binary protocol version {version}.")
+        return BINARY_HEADER_SIZE, length, mode, proto
+    if available < HEADER_SIZE:
+        return None
+    label, length, mode = struct.unpack_from(HEADER_FORMAT, buffer, offset)
+    if label != b'length':
+        raise CustomError("Message recieved has an incompatible header.")
+    if length > MAX_FRAME_SIZE: # the length isn't authenticated, don't buffer up to 4 GiB on its say so
+        raise CustomError(f"Message recieved claims to be {length} bytes, more than the {MAX_FRAME_SIZE} allowed.")
+    return HEADER_SIZE, length, mode, None
+
+def encrypt_payload(payload, other_key, encrypt):
+    """returns (mode, payload), other_key is the peer's SessionCipher once one is agreed on, otherwise their RSA public key"""
+    if not encrypt:
+        return Modes.PLAIN, payload
+    if isinstance(other_key, SessionCipher):
+        return Modes.SESSION, other_key.encrypt(payload)
+    return Modes.RSA, rsa.encrypt(payload, other_key)
+
+def encode_frame(message_bytes, other_key, encrypt):
+    """
+    JSON header and (optionally encrypted) payload, ready to send
+    """
+    mode, message_bytes = encrypt_payload(message_bytes, other_key, encrypt)
+    prefix = struct.pack(HEADER_FORMAT, b'length', len(message_bytes), mode)
+    return prefix + message_bytes
+
+def encode_message(data, wire_format, other_key, encrypt=True):
+    """a whole frame for a message dict in the connection's wire format"""
+    return frame_message(serialize_message(data, wire_format), data['proto'], wire_format, other_key, encrypt)
+
+def serialize_message(data, wire_format):
+    """the unencrypted payload of a message dict in the connection's wire format"""
+    if wire_format != WireFormats.BINARY:
+        return make_json_bytes(data)
+    return make_binary_bytes(data)
+
+def frame_message(message_bytes, proto, wire_format, other_key, encrypt=True):
+    """encrypt a serialized message and put the wire format's header in front of it"""
+    if wire_format != WireFormats.BINARY:
+        return encode_frame(message_bytes, other_key, encrypt)
+    mode, payload = encrypt_payload(message_bytes, other_key, encrypt)
+    return struct.pack(BINARY_HEADER_FORMAT, BINARY_MAGIC, BINARY_VERSION, mode, proto, len(payload)) + payload
+
+def make_binary_bytes(data):
+    """pack a message into its fixed binary struct"""
+    if data['proto'] not in BINARY_BODIES:
+        raise CustomError(f"{Protocols.PROTO_NAMES[data['proto']]} messages can't be sent in the binary format")
+    body_format, fields, text_field = BINARY_BODIES[data['proto']]
+    values = [data[field] for field in fields]
+    text = b''
+    if text_field is not None:
+        text = truncate_utf8(data[text_field], 255 if body_format.endswith('B') else 65535)
+        values.append(len(text))
+    log_message('Message sent:', data)
+    return struct.pack(body_format, *values) + text
+
+def truncate_utf8(text, limit):
+    """text encoded as utf-8 and cut to at most limit bytes without splitting a character"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= limit:
+        return encoded
+    return encoded[:limit].decode('utf-8', 'ignore').encode('utf-8')
+
+def read_binary_bytes(proto, data):
+    if proto not in BINARY_BODIES:
+        raise CustomError(f"Binary message recieved with unknown type {proto}. Ignoring message.")
+    body_format, fields, text_field = BINARY_BODIES[proto]
+    try:
+        values = struct.unpack_from(body_format, data)
+        message = {'proto' : proto}
+        message.update(zip(fields, values))
+        if text_field is not None:
+            start = struct.calcsize(body_format)
+            message[text_field] = data[start:start + values[-1]].decode('utf-8')
+    except (struct.error, UnicodeDecodeError) as e:
+        raise CustomError(f"Malformed {Protocols.PROTO_NAMES[proto]} message recieved ({e}). Ignoring message.")
+    return message
+
+def send_bytes(message_bytes, sock, other_key, encrypt): #will only be none and False for the first messages between client and server
+    """send a whole message on a blocking socket, the server queues frames with framing.OutboundQueue instead"""
+    sock.sendall(encode_frame(message_bytes, other_key, encrypt))
+
+def send_message(data, sock, wire_format, other_key, encrypt=True):
+    """send a message dict on a blocking socket in the negotiated wire format"""
+    sock.sendall(encode_message(data, wire_format, other_key, encrypt))
+
+def decode_payload(mode, data, my_priKey, cipher=None, proto=None):
+    """decrypt a payload with whichever key its mode says was used and load the message, proto is only given for binary frames"""
+    return load_message(decrypt_payload(mode, data, my_priKey, cipher), proto)
+
+def decrypt_payload(mode, data, my_priKey, cipher=None):
+    """the reverse of encrypt_payload"""
+    if mode == Modes.SESSION:
+        if cipher is None:
+            raise CustomError("Message recieved encrypted with a session key that was never agreed on. Ignoring message.")
+        return cipher.decrypt(data)
+    if mode == Modes.RSA:
+        return rsa.decrypt(data, my_priKey)
+    return data
+
+def load_message(data, proto=None):
+    """turn a decrypted payload back into a message dict, proto is only given for binary frames"""
+    if proto is not None:
+        message = read_binary_bytes(proto, data)
+        log_message('Message received:', message)
+        return message
+    try:
+        message = json.loads(data.decode('utf-8'))
+        if not isinstance(message, dict) or message.get('proto') not in Protocols.PROTO_NAMES:
+            raise ValueError("not a message object")
+
+        # convert the key from a serialized object back to the type we need
+        if message['proto'] == Protocols.REGISTER_CLIENT or message['proto'] == Protocols.REGISTER_CONFIRM:
+            load_registration_keys(message)
+    except (ValueError, KeyError, TypeError) as e: # bad utf-8, json, base64 or PEM are all ValueErrors
+        raise CustomError(f"Malformed message recieved ({e}). Ignoring message.")
+
+    log_message('Message received:', message)
+    return message
+
+def read_json_bytes(recv_data, sock, my_priKey, cipher=None): #will only be none for the first messages between client and server
+    """read one message from a blocking socket given its header, framing.FrameDecoder handles non-blocking sockets"""
+    label, json_length, mode = struct.unpack(HEADER_FORMAT, recv_data)
     if label != b'length':
         print(label)
         raise CustomError("Message recieved has an incompatible header. Ignoring message.")
-    data = sock.recv(json_length)
-    if encrypt_flag:
-        data = rsa.decrypt(data, my_priKey)
-    message = json.loads(data.decode('utf-8'))
-
-    # convert the key from a serialized object back to the type we need
-    if message['proto'] == Protocols.REGISTER_CLIENT or message['proto'] == Protocols.REGISTER_CONFIRM:
-        message['pub_key'] = rsa.PublicKey.load_pkcs1(base64.b64decode(message['pub_key']), format='PEM')
-        message['signature'] = base64.b64decode(message['signature'])
-
-    if IS_SERVER:
-        with open(SERVER_LOG_PATH, 'a') as file:
-            file.write('Message received:\n')
-        print_and_log(message)
-    return message
-        
+    if json_length > MAX_FRAME_SIZE:
+        raise CustomError(f"Message recieved claims to be {json_length} bytes, more than the {MAX_FRAME_SIZE} allowed.")
+    data = b''
+    while len(data) < json_length: # recv can return less than asked for
+        chunk = sock.recv(json_length - len(data))
+        if not chunk:
+            raise ConnectionResetError("Connection closed partway through a message")
+        data += chunk
+    return decode_payload(mode, data, my_priKey, cipher)
+
 
 def make_json_bytes(data):
     json_bytes = json.dumps(data).encode('utf-8')
-    if IS_SERVER:
-        with open(SERVER_LOG_PATH, 'a') as file:
-            file.write('Message sent:\n')
-        print_and_log(data)
+    log_message('Message sent:', data)
     return json_bytes
 
+def load_registration_keys(message):
+    """turn the serialized key and signature of a registration message into an rsa.PublicKey and bytes, in place"""
+    message['pub_key'] = rsa.PublicKey.load_pkcs1(base64.b64decode(message['pub_key']), format='PEM')
+    message['signature'] = base64.b64decode(message['signature'])
+    return message
+
+def dump_registration_keys(message):
+    """the reverse of load_registration_keys, as a copy that can be sent as JSON again"""
+    message = message.copy()
+    message['pub_key'] = base64.b64encode(message['pub_key'].save_pkcs1(format='PEM')).decode('utf-8')
+    message['signature'] = base64.b64encode(message['signature']).decode('utf-8')
+    return message
+
+def log_message(direction, message, level=DEBUG):
+    """ONLY LOGS ON SERVER"""
+    if not IS_SERVER:
+        return
+    if LOG is not None:
+        LOG.log_message(direction, message, Protocols.PROTO_NAMES, level)
+        return
+    file_text, console_text = format_message(direction, message, Protocols.PROTO_NAMES)
+    write_log(file_text)
+    print(console_text)
+
 def register_with_server(player_name, client_public_key, ca):
     """
     SENT BY CLIENT
     """
-    client_public_key_ser = base64.b64encode(client_public_key.save_pkcs1(format='PEM')).decode('utf-8')
-    signature = base64.b64encode(ca.create_signature(client_public_key_ser)).decode('utf-8')
+    client_public_key_ser, signature = ca.sign_key(client_public_key)
+    signature = base64.b64encode(signature).decode('utf-8')
     return {
         'proto' : Protocols.REGISTER_CLIENT,
         'name' : player_name,
         'pub_key' : client_public_key_ser,
-        'signature': signature
+        'signature': signature,
+        'ciphers' : [SessionCipher.NAME], # session ciphers the client supports, missing for clients that only use RSA
+        'formats' : list(WireFormats.SUPPORTED) # wire formats the client supports, missing for clients that only use JSON
     }
 
-def confirm_registration(player_id, server_public_key, ca):
+def confirm_registration(player_id, server_public_key, ca, session_key=None, client_public_key=None, wire_format=WireFormats.JSON, ticket=None, resume_within=None):
     """
     SENT BY SERVER
+    The session key, when there is one, is encrypted with the client's public key so only they can read it. The ticket
+    lets the client resume the game for resume_within seconds after losing the connection, it's only given with a session key
     """
-    server_public_key_ser = base64.b64encode(server_public_key.save_pkcs1(format='PEM')).decode('utf-8')
-    signature = base64.b64encode(ca.create_signature(server_public_key_ser)).decode('utf-8')
-    return {
+    server_public_key_ser, signature = ca.sign_key(server_public_key) # signed once, then cached
+    signature = base64.b64encode(signature).decode('utf-8')
+    message = {
         'proto' : Protocols.REGISTER_CONFIRM,
         'player_id' : player_id,
         'pub_key' : server_public_key_ser,
-        'signature': signature
+        'signature': signature,
+        'format' : wire_format
+    }
+    if session_key is not None:
+        message['cipher'] = SessionCipher.NAME
+        message['session_key'] = base64.b64encode(rsa.encrypt(session_key, client_public_key)).decode('utf-8')
+    if ticket is not None:
+        message['ticket'] = ticket
+        message['resume_within'] = resume_within
+    return message
+
+def open_session_key(message, my_priKey):
+    """
+    CALLED BY CLIENT
+    the session cipher from a REGISTER_CONFIRM, None if the server didn't send one
+    """
+    if message.get('cipher') != SessionCipher.NAME:
+        return None
+    return SessionCipher(rsa.decrypt(base64.b64decode(message['session_key']), my_priKey))
+
+def resume_session(ticket, cipher):
+    """
+    SENT BY CLIENT
+    Rejoin a game after the connection dropped. The ticket encrypted with the session key is the proof that this is the
+    player it was given to, so no RSA is needed
+    """
+    return {
+        'proto' : Protocols.RESUME_SESSION,
+        'ticket' : ticket,
+        'proof' : base64.b64encode(cipher.encrypt(ticket.encode('utf-8'))).decode('utf-8')
     }
 
+def check_resume_proof(message, cipher):
+    """
+    CALLED BY SERVER
+    whether a RESUME_SESSION's proof is its ticket encrypted with the session key of the player the ticket was given to
+    """
+    try:
+        return cipher.decrypt(base64.b64decode(message['proof'])) == message['ticket'].encode('utf-8')
+    except (CustomError, KeyError, ValueError, AttributeError):
+        return False
+
+def confirm_resume(ticket, moves, turn, winner, forfeit):
+    """
+    SENT BY SERVER, encrypted with the session key
+    A new ticket and the game so far, so the client can catch up on the moves it missed. turn is the player id whose
+    turn it is, -1 once the game is over
+    """
+    return {
+        'proto' : Protocols.RESUME_CONFIRM,
+        'ticket' : ticket,
+        'moves' : moves,
+        'turn' : turn,
+        'winner' : int(winner),
+        'forfeit' : forfeit
+    }
+
+def choose_wire_format(message):
+    """
+    CALLED BY SERVER
+    the first format in the client's REGISTER_CLIENT that the server supports
+    """
+    for wire_format in message.get('formats', [WireFormats.JSON]):
+        if wire_format in WireFormats.SUPPORTED:
+            return wire_format
+    return WireFormats.JSON
+
 def other_player(other_name, other_id):
     """
     SENT BY SERVER
@@ -162,6 +434,8 @@ def error_response(error, custom_message=""):
     match error:
         case Errors.PLAYER_COUNT_EXCEEDED:
             error_message = "The maximum player count has been reached. Please try again later"
+        case Errors.RESUME_FAILED:
+            error_message = "The game could not be resumed, it has ended or waited too long for you to come back"
         case Errors.CUSTOM_ERROR:
             error_message = custom_message
         case _:
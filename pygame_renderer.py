@@ -0,0 +1,95 @@
+import pygame
+
+from Board import NUM_COLS, NUM_ROWS
+
+TITLE_HEIGHT = 50 # the player's name
+STATUS_HEIGHT = 60 # whose turn it is, or how the game ended
+HEADER_HEIGHT = TITLE_HEIGHT + STATUS_HEIGHT
+EVENT_WAIT_MS = 250 # longest a wait for input blocks at once, so a Ctrl-C in the terminal is noticed
+TEXT_COLOR = (255, 255, 255)
+
+class PygameRenderer:
+    """
+    Draws a Board in a pygame window. Everything that doesn't change is rendered once: a tile surface per color and the
+    title, and status text surfaces are cached. Each draw only blits the cells that changed since the last one (and the
+    status strip if its text changed) and updates just those rectangles of the display. Waiting for input blocks on
+    pygame.event.wait, so a client whose window is idle uses next to no CPU
+    """
+
+    def __init__(self, board) -> None:
+        pygame.init()
+        self.board = board
+        self.slot = board.SLOT_SIZE
+        self.screen = pygame.display.set_mode((NUM_COLS * self.slot, NUM_ROWS * self.slot + HEADER_HEIGHT))
+        pygame.display.set_caption(f"{board.me.name}'s Connect 4")
+        pygame.event.set_grab(False)
+        pygame.event.set_blocked(pygame.MOUSEMOTION) # would wake the event wait every time the mouse moves
+        self.font = pygame.font.SysFont("arial", 24)
+        self.title = self.font.render(f"{board.me.name}'s game", True, board.color)
+        self.statuses = {} # text -> rendered surface, there are only a handful of different ones
+        self.tiles = {board.FILL_VALUE: self._tile(board.EMPTY_COLOR)} # tile value -> surface of one cell
+        for player, color in zip(board.players, board.PLAYER_COLORS):
+            self.tiles[player.id] = self._tile(color)
+        self.drawn = [[None] * NUM_COLS for _ in range(NUM_ROWS)] # tile value on screen per cell, row 0 at the bottom
+        self.status = None
+
+    def _tile(self, color):
+        surface = pygame.Surface((self.slot, self.slot))
+        surface.fill(self.board.BG_COLOR)
+        pygame.draw.circle(surface, color, (self.slot // 2, self.slot // 2), self.slot // 2 - self.board.PADDING)
+        return surface
+
+    def _status_surface(self, status):
+        surface = self.statuses.get(status)
+        if surface is None:
+            surface = self.statuses[status] = self.font.render(status, True, TEXT_COLOR)
+        return surface
+
+    def draw(self, status):
+        """bring the window up to date with the board and status, redrawing only what changed"""
+        dirty = []
+        if self.status is None: # first draw
+            self.screen.fill(self.board.BG_COLOR)
+            self.screen.blit(self.title, (10, 10))
+            dirty.append(self.screen.get_rect())
+        if status != self.status:
+            strip = pygame.Rect(0, TITLE_HEIGHT, self.screen.get_width(), STATUS_HEIGHT)
+            self.screen.fill(self.board.BG_COLOR, strip)
+            self.screen.blit(self._status_surface(status), (10, TITLE_HEIGHT + 10))
+            dirty.append(strip)
+            self.status = status
+        for row, tiles in enumerate(self.board.rows()):
+            drawn = self.drawn[row]
+            for col, tile in enumerate(tiles):
+                if drawn[col] != tile:
+                    drawn[col] = tile
+                    dirty.append(self.screen.blit(self.tiles[tile], self.cell_position(row, col)))
+        if dirty:
+            pygame.display.update(dirty)
+
+    def cell_position(self, row, col):
+        """top left of a cell in the window, row 0 is the bottom of the board"""
+        return col * self.slot, (NUM_ROWS - 1 - row) * self.slot + HEADER_HEIGHT
+
+    def wait_for_click(self):
+        """the column (counted from 1) of the next click on the board, None if the window is closed"""
+        pygame.event.clear()
+        while True:
+            event = self._wait()
+            if event.type == pygame.QUIT:
+                return None
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                x, y = event.pos
+                if y >= HEADER_HEIGHT:
+                    return x // self.slot + 1
+
+    def wait_for_close(self):
+        """block until the window is clicked or closed"""
+        while self._wait().type not in (pygame.QUIT, pygame.MOUSEBUTTONDOWN):
+            pass
+
+    def _wait(self):
+        event = pygame.event.wait(EVENT_WAIT_MS)
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED): # the window was uncovered, put it all back
+            pygame.display.update()
+        return event
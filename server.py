@@ -1,51 +1,120 @@
 import socket
 import argparse
+import os
+import heapq
+import itertools
+import json
+import secrets
 import selectors
+import sys
+import time
 import types
-import random
-import rsa
 import traceback
+import rsa
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 is_server = True 
 import protocols
 protocols.IS_SERVER = is_server
+from auxillary import CustomError
+from framing import FrameDecoder, OutboundQueue, StreamOutbound
 from Player import Player
-from Board import Board
-from simulate_certificate_authority import CertificateAuthority
+from Board import Board, BOARD_ENGINES, NUM_ROWS, NUM_COLS, get_board_class
+from GameSession import GameSession
+from GameStore import GameStore, game_over_many
+from simulate_certificate_authority import CertificateAuthority, check_signature
+from key_pool import KeyPool, DEFAULT_SPOOL_DIR
+from supervisor import Supervisor, send_control, recv_control
+from game_records import GameRecorder, RESULT_FORFEIT, DEFAULT_RECORD_PATH
+from server_log import ServerLog, LOG_LEVELS, ERROR, DEBUG, DEFAULT_MAX_BYTES
+from metrics import Metrics, Rate
+from solver import DEFAULT_TIME_BUDGET, centre_most_move, choose_move, position_of
+from opening_book import OpeningBook, DEFAULT_BOOK_PATH
 
 ca = CertificateAuthority(is_server)
 
 SEL = selectors.DefaultSelector()
 SERVER_CONTEXT = {
     'conn_ct' : 0, # the total number of connections, incremented at accapt
-    'reg_ct' : 0, # the number of players who have registered, incremented after the registration was successful
-    'homeless' : [], # connections that haven't been added to the game
+    'homeless' : ({}, {}), # registered connections that haven't been added to a game, one dict (fd -> key) per seat
+    'sessions' : {}, # the games currently being played, session id -> GameSession
+    'moved' : [], # (session, last move) for every move made this selector tick, checked for game over together
+    'unflushed' : {}, # fd -> key for connections that had frames queued this tick
+    'tick_scheduled' : False, # asyncio engine only, whether end_of_tick is already scheduled on the loop
+    'timers' : [], # heap of (deadline, sequence number, callback) for call_later
+    'worker' : None, # worker process state when running under a supervisor (--workers)
+    'records' : None, # GameRecorder writing the game record file, None with --record ""
+    'stats_socket' : None, # listening socket of the metrics endpoint, with --stats-port
+    'finished_jobs' : deque(), # selectors engine only, callbacks of process pool jobs that finished, run on the loop
+    'wakeup' : None, # selectors engine only, socket the pool's threads write to so the loop runs finished_jobs
+    'book' : None, # the computer opponent's OpeningBook, with --bot-after and a book file
+    'store' : None, # the GameStore every game's board lives in, with -b numpy
+    'tickets' : {}, # resumption ticket -> key of the player it was given to, see resume_player
     'server_socket' : socket.socket()
 }
 
-GAME_CONTEXT = {
-    'cur_player' : 0, # the index (in connections) of the player whom the server is waiting for a move from
-    'connections' : [], # a list of the selector keys associated with client sockets
-    'board' : None # the board, which represents the gameplay state
-}
-
 DEFAULT_PORT = 55668
+DEFAULT_MAX_GAMES = 100
+DEFAULT_RESUME_GRACE = 30 # seconds a player who drops out of a game has to come back before they forfeit
+ENGINES = ('selectors', 'asyncio')
+WORKER_STATS_INTERVAL = 5 # seconds between a worker's stats reports to its supervisor
+WORKER_LOG_CHUNK = 8 * 1024 # most JSON encoded bytes of log text per message to the supervisor, well under its message size
+TIMER_SEQUENCE = itertools.count() # breaks ties between timers with the same deadline
+MAX_STATS_REQUEST = 8 * 1024
+CONSOLE_IS_TTY = sys.stdout.isatty() # boards are only drawn on the console when someone can see them
+BOT_NAME = 'Computer'
+BOT_FDS = itertools.count(-1, -1) # the computer's connections have no socket, they get negative fds so they can't clash
+
+# Metrics, served in the Prometheus text format on --stats-port. Everything is updated inline on the event loop
+METRICS = Metrics('connect4')
+PHASES = {phase: METRICS.histogram('phase_seconds', 'Time spent in each phase of handling messages', phase=phase)
+          for phase in ('decrypt', 'decode', 'board_update', 'win_check', 'encode', 'encrypt', 'send')}
+MESSAGES_RECEIVED = {proto: METRICS.counter('messages_received_total', 'Messages received by type', type=name)
+                     for proto, name in protocols.Protocols.PROTO_NAMES.items()}
+BAD_MESSAGES = METRICS.counter('bad_messages_total', 'Frames that could not be decrypted or decoded')
+CONNECTIONS_ACCEPTED = METRICS.counter('connections_accepted_total', 'Connections accepted from players')
+HANDSHAKES = METRICS.counter('handshakes_total', 'Registrations with a verified key')
+HANDSHAKE_FAILURES = METRICS.counter('handshake_failures_total', 'Registrations whose key could not be verified')
+HANDSHAKE_RATE = Rate()
+RESUMES = METRICS.counter('resumes_total', 'Players who came back to their game after their connection dropped')
+RESUME_FAILURES = METRICS.counter('resume_failures_total', 'Attempts to resume a game with a ticket that is unknown, expired or not proven')
+GAMES_STARTED = METRICS.counter('games_started_total', 'Games started')
+GAMES_ENDED = {result: METRICS.counter('games_ended_total', 'Games ended by how they ended', result=result) for result in ('win', 'draw', 'forfeit')}
+BOT_MOVE_TIME = METRICS.histogram('bot_move_seconds', "Time from the computer's turn starting until its move is played")
+METRICS.gauge('active_games', 'Games in progress', lambda: len(SERVER_CONTEXT['sessions']))
+METRICS.gauge('connections', 'Open player connections', lambda: SERVER_CONTEXT['conn_ct'])
+METRICS.gauge('waiting_players', 'Registered players waiting for an opponent', lambda: len(SERVER_CONTEXT['homeless'][0]) + len(SERVER_CONTEXT['homeless'][1]))
+METRICS.gauge('handshakes_per_second', f'Verified registrations per second over the last {HANDSHAKE_RATE.window} seconds', HANDSHAKE_RATE.per_second)
 
 def main():
     """THE MAIN EVENT"""
     try:
-        check_sockets()
+        if args.engine == 'asyncio':
+            asyncio.run(serve_asyncio())
+        else:
+            check_sockets()
     except KeyboardInterrupt:
         protocols.print_and_log("caught keyboard interrupt, exiting")
     except Exception as e:
-        protocols.print_and_log("Server encountered an error. Exiting")
+        protocols.print_and_log("Server encountered an error. Exiting", ERROR)
         # protocols.print_and_log(e)
         traceback.print_exc()
     finally:
+        protocols.print_and_log(f"Certificate verification cache: {ca.cache_info()}")
         protocols.print_and_log("Server shutting down")
         print("closing socket")
         SERVER_CONTEXT['server_socket'].close()
+        if SERVER_CONTEXT['stats_socket'] is not None:
+            SERVER_CONTEXT['stats_socket'].close()
         SEL.close()
+        SERVER_CONTEXT['key_pool'].close()
+        if 'executor' in SERVER_CONTEXT:
+            SERVER_CONTEXT['executor'].shutdown(cancel_futures=True)
+        if SERVER_CONTEXT['records'] is not None:
+            SERVER_CONTEXT['records'].close()
+        protocols.LOG.close()
 
 def handle_events(message, key):
     """based on the proto number, route incoming client messages to the correct handling"""
@@ -53,128 +122,402 @@ def handle_events(message, key):
     match message_type:
         case protocols.Protocols.REGISTER_CLIENT:
             register_a_player(message, key)
+        case protocols.Protocols.RESUME_SESSION:
+            resume_player(message, key)
         case protocols.Protocols.MAKE_MOVE:
             make_players_move(message, key)
 
 def register_a_player(message, key):
     """register a player with the server as waiting for a game, including associating their socket to their public key for decryption"""
-    #TODO add signature verification
     verified = ca.verify_signature(message['pub_key'], message['signature'])
     protocols.print_and_log(f'Key verified: {verified}')
     if not verified: 
+        HANDSHAKE_FAILURES.inc()
         # close connection to client who we can't verify
         protocols.print_and_log("Close connection to client with unverified key")
-        error_bytes = protocols.make_json_bytes(protocols.error_response(protocols.Errors.PUBLIC_KEY_NOT_VERIFIED))
-        protocols.send_bytes(error_bytes, key.sock, None, False)
-        close_bad_connection(key, key.data.addr, key.sock)
+        reject_connection(key, protocols.Errors.PUBLIC_KEY_NOT_VERIFIED)
+        return
+    HANDSHAKES.inc()
+    HANDSHAKE_RATE.mark()
+
+    worker = SERVER_CONTEXT['worker']
+    if worker is not None:
+        # the supervisor pairs players across workers, ask it where this player should be seated
+        worker.parked.append((key, message))
+        send_control(worker.channel, {'op': 'lobby?'})
         return
+    seat_player(message, key)
+
+def reject_connection(key, error):
+    """send an error and close the connection"""
+    error_bytes = protocols.make_json_bytes(protocols.error_response(error))
+    key.data.outbound.push(protocols.encode_frame(error_bytes, None, False))
+    key.data.outbound.flush(key.fileobj) # best effort, the connection is closed right after
+    close_bad_connection(key, key.data.addr, key.fileobj)
+    if key.fileobj is None: # the asyncio engine, end the connection's task in case it isn't the one handling this message
+        key.data.outbound.close()
 
-    player_id = key.data.player_id
+def seat_player(message, key):
+    """seat a verified player opposite whoever is waiting, so that any two waiting players can be paired, and confirm their registration"""
+    homeless = SERVER_CONTEXT['homeless']
+    player_id = 1 if len(homeless[0]) > len(homeless[1]) else 0
+    key.data.player_id = player_id
     key.data.player_name = message['name']
     key.data.pub_key = message['pub_key']
 
-    response = protocols.confirm_registration(player_id, SERVER_CONTEXT['pub_key'], ca)
-    SERVER_CONTEXT['reg_ct'] += 1
-    SERVER_CONTEXT['homeless'].append(key)
+    # agree on a symmetric session key for everything after registration, if the client supports one
+    session_key = None
+    if protocols.SessionCipher.NAME in message.get('ciphers', []):
+        session_key = protocols.SessionCipher.generate_key()
+        key.data.cipher = protocols.SessionCipher(session_key)
+
+    key.data.wire_format = protocols.choose_wire_format(message)
+    ticket = issue_ticket(key) if session_key is not None and args.resume_grace > 0 else None # resuming needs the session key
+    response = protocols.confirm_registration(player_id, SERVER_CONTEXT['pub_key'], ca, session_key, key.data.pub_key, key.data.wire_format,
+                                              ticket, args.resume_grace)
+    homeless[player_id][key.fd] = key
     repsonse_bytes = protocols.make_json_bytes(response)
-    sock = key.fileobj
-    protocols.send_bytes(repsonse_bytes, sock, None, False) #key.data.pub_key, True)
+    queue_frame(key, protocols.encode_frame(repsonse_bytes, None, False))
 
-    if SERVER_CONTEXT['reg_ct'] == 2:
-        SERVER_CONTEXT['reg_ct'] = 0
-        protocols.print_and_log('Starting Game')
+    if homeless[0] and homeless[1]:
         start_game()
+    elif args.bot_after is not None:
+        call_later(args.bot_after, partial(seat_bot, key))
+
+def issue_ticket(key):
+    """a new resumption ticket for a player, with the worker's index in front so any worker can tell whose it is"""
+    worker = SERVER_CONTEXT['worker']
+    ticket = f"{worker.index if worker is not None else 0}.{secrets.token_hex(16)}"
+    SERVER_CONTEXT['tickets'][ticket] = key
+    key.data.ticket = ticket
+    return ticket
+
+def resume_player(message, key):
+    """
+    put a player whose connection dropped back in their seat on this new connection. The ticket they were given
+    encrypted with their session key proves who they are, so unlike registering there's no RSA. They get a new ticket
+    and the moves so far, encrypted with the session key
+    """
+    ticket = str(message.get('ticket', ''))
+    worker = SERVER_CONTEXT['worker']
+    owner = ticket.partition('.')[0]
+    if worker is not None and owner.isdigit() and int(owner) != worker.index: # another worker holds their seat
+        protocols.print_and_log(f"Handing a resumed connection from {key.data.addr} over to worker {owner}")
+        hand_off(key, int(owner), resume=message)
+        return
+    old_key = SERVER_CONTEXT['tickets'].get(ticket)
+    proven = key.data.player_id < 0 and old_key is not None and protocols.check_resume_proof(message, old_key.data.cipher)
+    if proven and not old_key.data.closed: # the client noticed the connection was gone before the server did
+        close_bad_connection(old_key, old_key.data.addr, old_key.fileobj) # holds their seat, unless the game is over
+        if old_key.fileobj is None: # the asyncio engine, end the old connection's task
+            old_key.data.outbound.close()
+    if not proven or ticket not in SERVER_CONTEXT['tickets']:
+        RESUME_FAILURES.inc()
+        protocols.print_and_log(f"Unable to resume a game for {key.data.addr}, the ticket is unknown, expired or not proven")
+        reject_connection(key, protocols.Errors.RESUME_FAILED)
+        return
+    old = old_key.data
+    del SERVER_CONTEXT['tickets'][ticket]
+    settle_moves() # pass the turn on for any move made this tick first, so the state sent below is up to date
+
+    for field in ('player_id', 'player_name', 'pub_key', 'cipher', 'wire_format'):
+        setattr(key.data, field, getattr(old, field))
+    session = old.session
+    session.replace(old_key, key)
+    SERVER_CONTEXT['conn_ct'] -= 1 # the old connection was still counted while its seat was held
+    RESUMES.inc()
+    protocols.print_and_log(f"{key.data.player_name} resumed {session} from {key.data.addr}")
+
+    over = session.forfeited or session.board.game_over()
+    turn = -1 if over else session.current_key().data.player_id
+    response = protocols.confirm_resume(issue_ticket(key), session.moves, turn, session.board.winner, session.forfeited)
+    queue_frame(key, protocols.encode_frame(protocols.make_json_bytes(response), key.data.cipher, True))
+
+def expire_ticket(key):
+    """a player hasn't come back within --resume-grace seconds of dropping out, they leave the game for good"""
+    holder = SERVER_CONTEXT['tickets'].get(key.data.ticket)
+    if holder is None or holder.data is not key.data:
+        return # they resumed, which replaced the ticket
+    del SERVER_CONTEXT['tickets'][key.data.ticket]
+    key.data.ticket = None
+    protocols.print_and_log(f"{key.data.player_name} did not come back within {args.resume_grace}s")
+    close_bad_connection(key, key.data.addr, None)
+
+def seat_bot(key):
+    """give a player who has waited --bot-after seconds for an opponent the computer to play against instead"""
+    if key.data.closed or key.data.session is not None:
+        return # they left, or found an opponent in the meantime
+    bot_data = new_connection_data(('computer', 0), None)
+    bot_data.bot = True
+    bot_data.player_id = 1 - key.data.player_id
+    bot_data.player_name = BOT_NAME
+    bot = types.SimpleNamespace(fileobj=None, fd=next(BOT_FDS), data=bot_data)
+    protocols.print_and_log(f"{key.data.player_name} has waited {args.bot_after}s, seating the computer opposite them")
+    SERVER_CONTEXT['homeless'][bot_data.player_id][bot.fd] = bot
+    SERVER_CONTEXT['conn_ct'] += 1 # the game takes up a board like any other, so the computer counts against --max-games
+    start_game()
+    note_lobby_state()
+
+def send_to_bot(key, message):
+    """the computer's side of send_message, it only cares whose turn it is and when the game is over"""
+    match message['proto']:
+        case protocols.Protocols.YOUR_TURN:
+            started = time.perf_counter_ns()
+            board = key.data.session.board
+            position = position_of(board, key.data.player_id)
+            entry = SERVER_CONTEXT['book'].lookup(position[0], position[1]) if SERVER_CONTEXT['book'] is not None else None
+            if entry is not None: # no need to think, played next tick since this one's moves are being settled
+                call_later(0, partial(play_bot_move, key, started, entry[0]))
+            else:
+                run_in_pool(partial(bot_move_found, key, position, started), choose_move, *position, args.bot_time)
+        case protocols.Protocols.GAME_OVER:
+            close_bad_connection(key, key.data.addr, None)
+
+def bot_move_found(key, position, started, future):
+    try:
+        column = future.result()
+    except Exception as e: # e.g. the pool broke, play something legal rather than stall the game
+        protocols.print_and_log(f"The computer's move failed in the process pool: {e!r}", ERROR)
+        column = centre_most_move(position[1])
+    play_bot_move(key, started, column)
+
+def play_bot_move(key, started, column):
+    """play the computer's move, unless the game ended while it was thinking"""
+    if key.data.closed or key.data.session is None:
+        return
+    BOT_MOVE_TIME.record(time.perf_counter_ns() - started)
+    make_players_move(protocols.make_move(column + 1), key) # the solver counts columns from 0, the protocol from 1
+
+def run_in_pool(done, function, *arguments):
+    """run function in the process pool, then done(future) on the event loop of whichever engine is running"""
+    if 'executor' not in SERVER_CONTEXT: # the selectors engine only starts the pool when it's first needed
+        SERVER_CONTEXT['executor'] = ProcessPoolExecutor()
+        reader, writer = socket.socketpair()
+        reader.setblocking(False)
+        writer.setblocking(False)
+        SEL.register(reader, selectors.EVENT_READ, data=run_finished_jobs)
+        SERVER_CONTEXT['wakeup'] = writer
+    future = SERVER_CONTEXT['executor'].submit(function, *arguments)
+    if args.engine == 'asyncio':
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda future: loop.call_soon_threadsafe(run_timer_callback, partial(done, future)))
+    else:
+        future.add_done_callback(partial(finish_job, done))
+
+def finish_job(done, future):
+    """called on one of the pool's threads, hands the callback to the selector loop and wakes it"""
+    SERVER_CONTEXT['finished_jobs'].append(partial(done, future))
+    try:
+        SERVER_CONTEXT['wakeup'].send(b'\0')
+    except BlockingIOError:
+        pass # the loop has plenty of wake ups it hasn't read yet
+
+def run_finished_jobs(reader):
+    try:
+        while reader.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
+    finished = SERVER_CONTEXT['finished_jobs']
+    while finished:
+        finished.popleft()()
+
+def send_message(key, message):
+    """send an encrypted message to a registered player, with their session cipher or RSA key for older clients"""
+    if key.data.bot:
+        send_to_bot(key, message)
+        return
+    other_key = key.data.cipher if key.data.cipher is not None else key.data.pub_key
+    started = time.perf_counter_ns()
+    message_bytes = protocols.serialize_message(message, key.data.wire_format)
+    encoded = time.perf_counter_ns()
+    frame = protocols.frame_message(message_bytes, message['proto'], key.data.wire_format, other_key, True)
+    PHASES['encode'].record(encoded - started)
+    PHASES['encrypt'].record(time.perf_counter_ns() - encoded)
+    queue_frame(key, frame)
+
+def queue_frame(key, frame):
+    """queue a frame to be written at the end of this selector tick, along with anything else queued for the connection"""
+    if key.data.closed:
+        return
+    if key.data.outbound.push(frame):
+        SERVER_CONTEXT['unflushed'][key.fd] = key
+
+def flush_writes():
+    """
+    write out everything queued this tick, one sendmsg per connection and one write of the game records. Connections
+    whose send buffer fills up are watched for EVENT_WRITE until their queue drains, so a slow reader never blocks the loop
+    """
+    while SERVER_CONTEXT['unflushed']:
+        unflushed = SERVER_CONTEXT['unflushed']
+        SERVER_CONTEXT['unflushed'] = {} # closing a connection below can queue messages for its opponent
+        for key in unflushed.values():
+            if not key.data.closed and not key.data.writing:
+                write_pending(key)
+    if SERVER_CONTEXT['records'] is not None:
+        SERVER_CONTEXT['records'].flush()
+
+def write_pending(key):
+    """flush a connection's queue, switching EVENT_WRITE on while data is left over and off once it's all sent"""
+    data = key.data
+    started = time.perf_counter_ns()
+    try:
+        done = data.outbound.flush(key.fileobj)
+        PHASES['send'].record(time.perf_counter_ns() - started)
+    except (ConnectionResetError, BrokenPipeError) as e:
+        protocols.print_and_log(str(e), ERROR)
+        close_bad_connection(key, data.addr, key.fileobj)
+        return
+    if data.writing == done: # only touch the selector when the state changes
+        data.writing = not done
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if data.writing else selectors.EVENT_READ
+        SEL.modify(key.fileobj, events, data)
+
+def pop_homeless(seat):
+    """remove and return the longest waiting connection for a seat"""
+    waiting = SERVER_CONTEXT['homeless'][seat]
+    fd = next(iter(waiting))
+    return waiting.pop(fd)
 
 def start_game():
-    """update game context for server and players, randomly select the first player and allow request the first move"""
-    GAME_CONTEXT['connections'] = SERVER_CONTEXT['homeless'][:2]
-    SERVER_CONTEXT['homeless'] = SERVER_CONTEXT['homeless'][2:]
-    players = []
-
-    for p in range(2):
-        cur = GAME_CONTEXT['connections'][p]
-        p = Player(cur.data.player_name, cur.data.player_id)
-        print(p)
-        players.append( p )
-    # players = sorted(players)
-    Player.set_player_colors(players)
-    for p in players:
-        print(p)
-
-    GAME_CONTEXT['cur_player'] = random.choice([0,1])
-    GAME_CONTEXT['board'] = Board(players)
-
-    notify_other_player()
+    """pair two waiting players into a new game session, randomly select the first player and request the first move"""
+    if not board_available(): # server_is_full should prevent this, but running out of boards mustn't take the server down
+        protocols.print_and_log("No free board for a new game, turning the waiting players away", ERROR)
+        for seat in (0, 1):
+            key = pop_homeless(seat)
+            if key.data.bot:
+                close_bad_connection(key, key.data.addr, None)
+            else:
+                reject_connection(key, protocols.Errors.PLAYER_COUNT_EXCEEDED)
+        note_lobby_state()
+        return
+    session = GameSession([pop_homeless(0), pop_homeless(1)], SERVER_CONTEXT['new_board'])
+    SERVER_CONTEXT['sessions'][session.id] = session
+    if SERVER_CONTEXT['records'] is not None:
+        session.record_id = SERVER_CONTEXT['records'].start(session.cur_player)
+    GAMES_STARTED.inc()
+    protocols.print_and_log(f'Starting {session}, {len(SERVER_CONTEXT["sessions"])} games in progress')
+
+    notify_other_player(session)
 
     # notify a player that they will begin
     message = protocols.your_turn(-1)
-    cur_player = GAME_CONTEXT['connections'][GAME_CONTEXT['cur_player']]
+    cur_player = session.current_key()
     protocols.print_and_log(f"First player is {cur_player.data.player_name}, player id {cur_player.data.player_id}")
-    protocols.send_bytes(protocols.make_json_bytes(message), cur_player.fileobj, cur_player.data.pub_key, True)
+    send_message(cur_player, message)
 
-def notify_other_player():
+def notify_other_player(session):
     """Send both players the information they need about their opponent"""
-    protocols.print_and_log('Sending other player data')
-    for conn_i in range(len(GAME_CONTEXT['connections'])):
-        other_player = GAME_CONTEXT['connections'][(conn_i + 1) % 2]
-        cur_player = GAME_CONTEXT['connections'][conn_i]
+    protocols.print_and_log('Sending other player data', DEBUG)
+    for conn_i in range(len(session.connections)):
+        other_player = session.connections[(conn_i + 1) % 2]
+        cur_player = session.connections[conn_i]
         message = protocols.other_player(other_player.data.player_name, other_player.data.player_id)
-        protocols.send_bytes(protocols.make_json_bytes(message), cur_player.fileobj, cur_player.data.pub_key, True)
+        send_message(cur_player, message)
 
 def make_players_move(message, key):
-    if len(GAME_CONTEXT['connections']) != 2:
+    session = key.data.session
+    if session is None or not session.is_full():
         return # message was sent after the other player disconnected while live client was waiting for user input
         
-    cur_player_key = GAME_CONTEXT['connections'][GAME_CONTEXT['cur_player']]
-    # print(f"start game: cur player: {GAME_CONTEXT['connections'][GAME_CONTEXT['cur_player']]}")
-    print(f"The player whose turn it is making a move?: {cur_player_key.data.player_id} == {key.data.player_id} ? : {cur_player_key.data.player_id == key.data.player_id}")
-    board = GAME_CONTEXT['board']
+    cur_player_key = session.current_key()
+    board = session.board
     last_move = message['move']
-    board.place_tile(last_move, key.data.player_id)
+    started = time.perf_counter_ns()
+    valid = isinstance(last_move, int) and 1 <= last_move <= NUM_COLS and board.place_tile(last_move, key.data.player_id)
+    PHASES['board_update'].record(time.perf_counter_ns() - started)
+    if not valid: # clients check their moves, so this one is broken or malicious; it's ignored and not recorded
+        protocols.print_and_log(f"Ignoring invalid move {last_move!r} from {key.data.player_name} in {session}", ERROR)
+        return
+    session.moves.append((key.data.player_id, last_move))
+    if SERVER_CONTEXT['records'] is not None:
+        SERVER_CONTEXT['records'].move(session.record_id, key.data.player_id, last_move - 1)
 
-    print(board) # prints with colored circles
-    with open(protocols.SERVER_LOG_PATH, 'a') as file:
-        file.write(board.draw_board_for_log()) #print in log with player id
+    if protocols.log_enabled(DEBUG): # drawing the board is only worth it if it's going to be logged
+        protocols.print_and_log(f"The player whose turn it is making a move?: {cur_player_key.data.player_id} == {key.data.player_id} ? : {cur_player_key.data.player_id == key.data.player_id}", DEBUG)
+        console = str(board) if CONSOLE_IS_TTY else False # colored circles on the console, player ids in the log
+        protocols.LOG.log(board.draw_board_for_log(), DEBUG, console=console)
+    SERVER_CONTEXT['moved'].append((session, last_move))
 
-    over = board.game_over()
-    protocols.print_and_log(f'Checking for game over: {over}')
-    if over:
-        game_over(last_move)
+def settle_moves():
+    """check every game that had a move this tick for game over in one batch, then end the game or pass the turn along"""
+    moved = [(session, last_move) for session, last_move in SERVER_CONTEXT['moved'] if session.is_full()] # skip games a player left this tick
+    SERVER_CONTEXT['moved'] = []
+    if not moved:
         return
-    GAME_CONTEXT['cur_player'] = (GAME_CONTEXT['cur_player'] + 1) % 2
+    started = time.perf_counter_ns()
+    results = game_over_many([session.board for session, _ in moved]) # timed per batch, one per tick
+    PHASES['win_check'].record(time.perf_counter_ns() - started)
+    for (session, last_move), over in zip(moved, results):
+        protocols.print_and_log(f'Checking for game over in {session}: {over}', DEBUG)
+        if over:
+            game_over(session, last_move)
+            continue
 
-    message = protocols.your_turn(last_move)
-    next_player_socket = GAME_CONTEXT['connections'][GAME_CONTEXT['cur_player']].fileobj
-    player_public_key = GAME_CONTEXT['connections'][GAME_CONTEXT['cur_player']].data.pub_key
-    protocols.send_bytes(protocols.make_json_bytes(message), next_player_socket, player_public_key, True)
+        message = protocols.your_turn(last_move)
+        next_player = session.advance_turn()
+        send_message(next_player, message)
 
-def game_over(last_move):
-    board = GAME_CONTEXT['board']
-    protocols.print_and_log('game over')
+def game_over(session, last_move):
+    board = session.board
+    protocols.print_and_log(f'game over for {session}')
+    GAMES_ENDED['draw' if board.winner == Board.FILL_VALUE else 'win'].inc()
     if board.winner == Board.FILL_VALUE:
         protocols.print_and_log("The game is a draw")
     else:
         protocols.print_and_log(f'WINNER IS {Player.get_player_by_id(board.players, board.winner).name}, player id: {Player.get_player_by_id(board.players, board.winner).id}')
+    if SERVER_CONTEXT['records'] is not None:
+        SERVER_CONTEXT['records'].result(session.record_id, board.winner)
     message = protocols.game_over(board.winner, last_move)
-    for key in GAME_CONTEXT['connections']:
-        protocols.send_bytes(protocols.make_json_bytes(message), key.fileobj, key.data.pub_key, True)
+    for key in session.connections:
+        send_message(key, message)
+    board.release() # the board's slot is free for a new game, even while the players are still connected
 
 def check_sockets():
     try:
         while True:
-            events = SEL.select(timeout=None)
+            events = SEL.select(timeout=next_timer_timeout())
             for key, mask in events:
                 if key.data is None:
                     accept_wrapper(key.fileobj)
+                elif callable(key.data): # sockets with their own handler, like a worker's channel to its supervisor
+                    key.data(key.fileobj)
                 else:
                     service_connection(key, mask)
+            run_due_timers()
+            settle_moves()
+            flush_writes()
     except ConnectionResetError as e:
         print(e)
 
+def call_later(delay, callback):
+    """run callback after delay seconds, from the event loop of whichever engine is running"""
+    if args.engine == 'asyncio':
+        asyncio.get_running_loop().call_later(delay, run_timer_callback, callback)
+        return
+    heapq.heappush(SERVER_CONTEXT['timers'], (time.monotonic() + delay, next(TIMER_SEQUENCE), callback))
+
+def run_timer_callback(callback):
+    callback()
+    schedule_end_of_tick()
+
+def next_timer_timeout():
+    timers = SERVER_CONTEXT['timers']
+    if not timers:
+        return None
+    return max(0, timers[0][0] - time.monotonic())
+
+def run_due_timers():
+    timers = SERVER_CONTEXT['timers']
+    now = time.monotonic()
+    while timers and timers[0][0] <= now:
+        _, _, callback = heapq.heappop(timers)
+        callback()
+
 def accept_wrapper(sock):
     conn, addr = sock.accept()
     protocols.print_and_log(f"accepted connection from {addr}")
-    if SERVER_CONTEXT['conn_ct'] >= 2:
+    if server_is_full():
         # send message to say the game is full
         error_bytes = protocols.make_json_bytes(protocols.error_response(protocols.Errors.PLAYER_COUNT_EXCEEDED))
         protocols.send_bytes(error_bytes, conn, None, False)
@@ -182,77 +525,449 @@ def accept_wrapper(sock):
         return
     conn.setblocking(False)
     conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # WHY ARE MY SOCKETS TIMING OUT?
-    data = types.SimpleNamespace(addr=addr, player_id=SERVER_CONTEXT['conn_ct'], player_name="", pub_key=None)
+    data = new_connection_data(addr, OutboundQueue())
+    data.decoder = FrameDecoder()
     events = selectors.EVENT_READ
     SEL.register(conn, events, data=data)
     SERVER_CONTEXT['conn_ct'] += 1
+    CONNECTIONS_ACCEPTED.inc()
+
+def new_connection_data(addr, outbound):
+    """per-connection state, the same for both engines"""
+    return types.SimpleNamespace(addr=addr, player_id=-1, player_name="", pub_key=None, cipher=None, wire_format=protocols.WireFormats.JSON,
+                                 session=None, outbound=outbound, writing=False, closed=False, bot=False, ticket=None)
+
+def server_is_full():
+    return SERVER_CONTEXT['conn_ct'] >= 2 * args.max_games or not board_available()
+
+def board_available():
+    """whether a new game can get a board, only the GameStore has a limit"""
+    store = SERVER_CONTEXT['store']
+    return store is None or store.live_count() < store.capacity
 
 def service_connection(key, mask):
     sock = key.fileobj
     data = key.data
+    if data.closed:
+        return
     if mask & selectors.EVENT_READ:
         try:
-            recv_data = sock.recv(11)
-            if recv_data:
-                message = protocols.read_json_bytes(recv_data, sock, SERVER_CONTEXT['pri_key'])
-                handle_events(message, key)
-            else:
-                close_bad_connection(key, data.addr, sock)
-        except ConnectionResetError:
+            frames, closed = data.decoder.read_from(sock)
+        except (ConnectionResetError, CustomError) as e:
+            protocols.print_and_log(str(e), ERROR)
             close_bad_connection(key, data.addr, sock)
+            return
+        for mode, payload, proto in frames:
+            if data.closed: # an earlier message in this read got the connection closed
+                return
+            try:
+                message = decode_frame(mode, payload, proto, data.cipher)
+            except CustomError as e:
+                protocols.print_and_log(str(e), ERROR)
+                continue
+            handle_events(message, key)
+        if closed and not data.closed:
+            close_bad_connection(key, data.addr, sock)
+    if mask & selectors.EVENT_WRITE and not data.closed:
+        write_pending(key)
+
+def decode_frame(mode, payload, proto, cipher):
+    """decrypt and load a received frame, timing each step"""
+    started = time.perf_counter_ns()
+    try:
+        payload = protocols.decrypt_payload(mode, payload, SERVER_CONTEXT['pri_key'], cipher)
+        decrypted = time.perf_counter_ns()
+        message = protocols.load_message(payload, proto)
+    except CustomError:
+        BAD_MESSAGES.inc()
+        raise
+    PHASES['decrypt'].record(decrypted - started)
+    PHASES['decode'].record(time.perf_counter_ns() - decrypted)
+    counter = MESSAGES_RECEIVED.get(message['proto'])
+    if counter is not None:
+        counter.inc()
+    return message
 
 def close_bad_connection(key, addr, sock):
     """update server and game state and close server side socket when a player disconnects"""
     protocols.print_and_log(f"Closing connection to {addr} {key.data.player_name}")
-    if key in GAME_CONTEXT['connections']:
-        #remove the connection from game connections
-        GAME_CONTEXT['connections'].remove(key)
-        board = GAME_CONTEXT['board']
-        if not board.game_over() :
-            forfeit_game(key, board)
-    if key in SERVER_CONTEXT['homeless']: # remove connection from server context if it's been saved
-        SERVER_CONTEXT['homeless'].remove(key)
-        SERVER_CONTEXT['reg_ct'] -= 1
-    SEL.unregister(sock)
-    sock.close()
-    SERVER_CONTEXT['conn_ct'] -= 1
+    session = key.data.session
+    held = session is not None and can_resume(key)
+    if held:
+        # keep their seat, and the connection counted, in case they come back with their ticket
+        protocols.print_and_log(f"Holding {key.data.player_name}'s seat in {session} for {args.resume_grace}s")
+        call_later(args.resume_grace, partial(expire_ticket, key))
+    elif session is not None:
+        #remove the connection from its game, and the game from the server once everyone has left
+        if session.remove(key):
+            del SERVER_CONTEXT['sessions'][session.id]
+            session.board.release()
+        elif not session.board.game_over():
+            forfeit_game(key, session)
+    elif key.data.player_id >= 0: # remove connection from server context if it's been saved
+        SERVER_CONTEXT['homeless'][key.data.player_id].pop(key.fd, None)
+        note_lobby_state()
+    if not held:
+        SERVER_CONTEXT['tickets'].pop(key.data.ticket, None)
+        SERVER_CONTEXT['conn_ct'] -= 1
+    key.data.closed = True
+    if sock is not None: # the asyncio engine closes its own streams
+        SEL.unregister(sock)
+        sock.close()
     protocols.print_and_log(f"Current number of connections: {SERVER_CONTEXT['conn_ct']}")
 
-def forfeit_game(key, board):
+def can_resume(key):
+    """whether a player whose connection is closing can come back to their game, it has to still be going"""
+    session = key.data.session
+    return key.data.ticket is not None and not key.data.closed and session.is_full() and not session.board.game_over()
+
+def forfeit_game(key, session):
     # manually set the winner to the remaining player
-    if len(GAME_CONTEXT['connections']) > 0:
-        other_key = GAME_CONTEXT['connections'][0]
+    board = session.board
+    other_key = session.opponent_of(key)
+    if other_key is not None:
         protocols.print_and_log(f'Player {key.data.player_name} disconnected; Game forfeited to {other_key.data.player_name}')
         board.winner = other_key.data.player_id
+        session.forfeited = True
+        GAMES_ENDED['forfeit'].inc()
+        if SERVER_CONTEXT['records'] is not None:
+            SERVER_CONTEXT['records'].result(session.record_id, board.winner, RESULT_FORFEIT)
         message = protocols.game_over(board.winner, -2)
-        protocols.send_bytes(protocols.make_json_bytes(message), other_key.fileobj, other_key.data.pub_key, True)
+        send_message(other_key, message)
+        board.release()
+
+async def serve_asyncio():
+    """
+    The asyncio engine: one task per connection on asyncio streams instead of the selectors loop. RSA work runs in a
+    process pool so it can't hold up other games, and the game logic is shared with the selectors engine
+    """
+    SERVER_CONTEXT['executor'] = ProcessPoolExecutor()
+    if SERVER_CONTEXT['stats_socket'] is not None:
+        stats_server = await asyncio.start_server(handle_stats_stream, sock=SERVER_CONTEXT['stats_socket']) # serves until the loop stops
+    server = await asyncio.start_server(handle_stream, sock=SERVER_CONTEXT['server_socket'])
+    async with server:
+        await server.serve_forever()
 
-def set_up_server_socket():
+async def handle_stream(reader, writer):
+    """the task that serves one connection until it closes"""
+    addr = writer.get_extra_info('peername')
+    protocols.print_and_log(f"accepted connection from {addr}")
+    if server_is_full():
+        error_bytes = protocols.make_json_bytes(protocols.error_response(protocols.Errors.PLAYER_COUNT_EXCEEDED))
+        writer.write(protocols.encode_frame(error_bytes, None, False))
+        await writer.drain()
+        writer.close()
+        return
+    sock = writer.get_extra_info('socket')
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    data = new_connection_data(addr, StreamOutbound(writer))
+    key = types.SimpleNamespace(fileobj=None, fd=sock.fileno(), data=data) # stands in for a selector key in the game logic
+    SERVER_CONTEXT['conn_ct'] += 1
+    CONNECTIONS_ACCEPTED.inc()
+    try:
+        while not data.closed:
+            message = await read_message_async(reader, data)
+            if message is None:
+                break
+            handle_events(message, key)
+            schedule_end_of_tick()
+            await writer.drain()
+    except (ConnectionResetError, BrokenPipeError, CustomError) as e:
+        protocols.print_and_log(str(e), ERROR)
+    finally:
+        if not data.closed:
+            close_bad_connection(key, addr, None)
+            schedule_end_of_tick()
+        writer.close()
+
+async def read_message_async(reader, data):
+    """the next message from a stream, None once it closes. RSA decryption and signature checks go to the process pool"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            start = await reader.readexactly(len(protocols.BINARY_MAGIC))
+        except asyncio.IncompleteReadError:
+            return None
+        header_size = protocols.BINARY_HEADER_SIZE if start == protocols.BINARY_MAGIC else protocols.HEADER_SIZE
+        header = start + await reader.readexactly(header_size - len(start))
+        _, length, mode, proto = protocols.parse_header(header, 0, header_size)
+        payload = await reader.readexactly(length)
+        if mode == protocols.Modes.RSA:
+            payload = await loop.run_in_executor(SERVER_CONTEXT['executor'], rsa.decrypt, payload, SERVER_CONTEXT['pri_key'])
+            mode = protocols.Modes.PLAIN
+        try:
+            message = decode_frame(mode, payload, proto, data.cipher)
+        except CustomError as e:
+            protocols.print_and_log(str(e), ERROR)
+            continue
+        if message['proto'] == protocols.Protocols.REGISTER_CLIENT and not ca.is_cached(message['pub_key'], message['signature']):
+            # verify off the loop, register_a_player then finds the result in the cache
+            verified = await loop.run_in_executor(SERVER_CONTEXT['executor'], check_signature, ca.ca_keys['pri_key'], message['pub_key'], message['signature'])
+            ca.remember_verification(message['pub_key'], message['signature'], verified)
+        return message
+
+async def handle_stats_stream(reader, writer):
+    try:
+        request = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        request = b''
+    try:
+        writer.write(stats_response(request))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+def schedule_end_of_tick():
+    """the asyncio engine's version of the end of a selector tick, runs once per loop iteration however many messages came in"""
+    if not SERVER_CONTEXT['tick_scheduled']:
+        SERVER_CONTEXT['tick_scheduled'] = True
+        asyncio.get_running_loop().call_soon(end_of_tick)
+
+def end_of_tick():
+    SERVER_CONTEXT['tick_scheduled'] = False
+    settle_moves()
+    flush_writes()
+
+def run_supervisor():
+    """--workers: fork the worker processes and supervise them, the workers do all of the serving"""
+    SERVER_CONTEXT['key_pool'].close(wait=True) # no key pool processes or threads can be running when the workers fork
+    write_worker_log = lambda text: protocols.write_log(text, ERROR) # the workers have already dropped what --log-level leaves out
+    supervisor = Supervisor(args.workers, run_worker, write_worker_log, protocols.print_and_log)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        protocols.print_and_log("caught keyboard interrupt, exiting")
+    finally:
+        protocols.print_and_log("Server shutting down")
+        SERVER_CONTEXT['server_socket'].close()
+        protocols.LOG.close()
+
+def run_worker(index, channel):
+    """runs in a forked worker: its own listening socket on the shared port, selector loop and game registry"""
+    global SEL
+    SEL = selectors.DefaultSelector() # the parent's selector can't be shared between processes
+    SERVER_CONTEXT['server_socket'].close()
+    SERVER_CONTEXT['worker'] = types.SimpleNamespace(index=index, channel=channel, has_waiter=False,
+                                                     parked=deque()) # (key, registration) waiting on a reply to 'lobby?'
+    protocols.LOG = ServerLog(protocols.SERVER_LOG_PATH, LOG_LEVELS[args.log_level], args.log_max_bytes, sink=send_log_to_supervisor, prefix=f"[worker {index}] ")
+    SEL.register(channel, selectors.EVENT_READ, data=handle_supervisor_message)
+    open_game_records(index)
+    METRICS.labels['worker'] = index
+    if args.stats_port is not None: # each worker serves its own metrics, on the stats port plus its index
+        set_up_stats_socket(args.stats_port + index)
+    set_up_server_socket()
+    call_later(WORKER_STATS_INTERVAL, send_worker_stats)
+    main()
+    return 0
+
+def handle_supervisor_message(channel):
+    """replies to matchmaking requests and connections handed over from other workers"""
+    worker = SERVER_CONTEXT['worker']
+    try:
+        message, fds = recv_control(channel)
+    except ValueError as e:
+        protocols.print_and_log(str(e), ERROR)
+        return
+    if message is None:
+        raise KeyboardInterrupt # the supervisor is gone, shut the worker down
+    match message['op']:
+        case 'keep':
+            key, registration = worker.parked.popleft()
+            worker.has_waiter = message['waiting']
+            if not key.data.closed:
+                seat_player(registration, key)
+            note_lobby_state()
+        case 'handoff':
+            key, registration = worker.parked.popleft()
+            if not key.data.closed:
+                protocols.print_and_log(f"Handing {key.data.player_name or registration['name']} over to worker {message['to']}")
+                hand_off(key, message['to'], registration=protocols.dump_registration_keys(registration))
+            else: # the supervisor took the other worker's waiting player out of the lobbies for this one, put them back
+                send_control(worker.channel, {'op': 'lobby_claim', 'worker': message['to']})
+        case 'adopt':
+            key = adopt_connection(fds[0])
+            if 'resume' in message: # a player coming back to a game on this worker
+                resume_player(message['resume'], key)
+                return
+            worker.has_waiter = message['waiting']
+            seat_player(protocols.load_registration_keys(message['registration']), key)
+            note_lobby_state()
+
+def send_log_to_supervisor(text):
+    """the worker's log sink, the supervisor writes every worker's log text to the one log file"""
+    channel = SERVER_CONTEXT['worker'].channel
+    for chunk in log_chunks(text):
+        send_control(channel, {'op': 'log', 'text': chunk})
+
+def log_chunks(text):
+    """
+    split text into pieces of at most WORKER_LOG_CHUNK bytes once JSON encoded. Escaping can make a character up to 12
+    bytes (a surrogate pair), so a piece that's too long is shrunk by how much it's over until it fits
+    """
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + WORKER_LOG_CHUNK)
+        while (encoded := len(json.dumps(text[start:end]))) > WORKER_LOG_CHUNK:
+            end = start + (end - start) * WORKER_LOG_CHUNK // encoded
+        yield text[start:end]
+        start = end
+
+def hand_off(key, to, **details):
+    """
+    pass an unseated connection to another worker through the supervisor, and forget it here. details is either the
+    verified registration of a player to seat, or the RESUME_SESSION of a player whose seat is on that worker
+    """
+    message = {'op': 'handoff', 'to': to, **details}
+    send_control(SERVER_CONTEXT['worker'].channel, message, [key.fileobj.fileno()])
+    key.data.closed = True
+    SEL.unregister(key.fileobj)
+    key.fileobj.close()
+    SERVER_CONTEXT['conn_ct'] -= 1
+
+def adopt_connection(fd):
+    """take over a connection another worker handed us, anything it sent was already read and checked there"""
+    conn = socket.socket(fileno=fd)
+    conn.setblocking(False)
+    data = new_connection_data(conn.getpeername(), OutboundQueue())
+    data.decoder = FrameDecoder()
+    key = SEL.register(conn, selectors.EVENT_READ, data=data)
+    SERVER_CONTEXT['conn_ct'] += 1
+    return key
+
+def note_lobby_state():
+    """tell the supervisor when this worker has, or no longer has, a player waiting for an opponent and it doesn't know"""
+    worker = SERVER_CONTEXT['worker']
+    if worker is None:
+        return
+    has_waiter = any(SERVER_CONTEXT['homeless'])
+    if has_waiter != worker.has_waiter:
+        worker.has_waiter = has_waiter
+        send_control(worker.channel, {'op': 'lobby_claim' if has_waiter else 'lobby_empty'})
+
+def send_worker_stats():
+    stats = {
+        'connections': SERVER_CONTEXT['conn_ct'],
+        'games': len(SERVER_CONTEXT['sessions']),
+        'waiting': len(SERVER_CONTEXT['homeless'][0]) + len(SERVER_CONTEXT['homeless'][1])
+    }
+    send_control(SERVER_CONTEXT['worker'].channel, {'op': 'stats', 'stats': stats})
+    call_later(WORKER_STATS_INTERVAL, send_worker_stats)
+
+def set_up_server_socket(listen=True):
+    """
+    bind the server socket, and listen on it unless this is the supervisor. With --workers every process binds the
+    same port with SO_REUSEPORT, the supervisor binds it first (without listening) to pick the port
+    """
     port = DEFAULT_PORT
     if args.port is not None:
         port = args.port
+    if 'port' in SERVER_CONTEXT:
+        port = SERVER_CONTEXT['port']
     try:
         ss = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         ss.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if args.workers > 1:
+            ss.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         try:
             ss.bind(('0.0.0.0', port)) # static port, default when one isn't provided at startup
         except OSError as e:
             ss.bind(('0.0.0.0', 0)) # any available port, if the requested one won't bind
             protocols.print_and_log(f"Port {port} is unavailable, using port {ss.getsockname()[1]}")
-        ss.listen()
-        ss.setblocking(False)
-        SEL.register(ss, selectors.EVENT_READ, data=None)
+        SERVER_CONTEXT['port'] = ss.getsockname()[1]
+        if listen:
+            ss.listen()
+            ss.setblocking(False)
+            SEL.register(ss, selectors.EVENT_READ, data=None)
         SERVER_CONTEXT['server_socket'] = ss
     except:
         traceback.print_exc()
         protocols.print_and_log('Unable to set up server connection. Exiting.')
         exit()
 
+def set_up_stats_socket(port):
+    """the metrics endpoint, only reachable from this machine"""
+    try:
+        ss = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        ss.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        ss.bind(('127.0.0.1', port))
+        ss.listen()
+        ss.setblocking(False)
+    except OSError as e:
+        protocols.print_and_log(f"Unable to serve metrics on port {port}: {e}", ERROR)
+        return
+    if args.engine == 'selectors':
+        SEL.register(ss, selectors.EVENT_READ, data=accept_stats_connection)
+    SERVER_CONTEXT['stats_socket'] = ss
+    protocols.print_and_log(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+def accept_stats_connection(sock):
+    conn, _ = sock.accept()
+    conn.setblocking(False)
+    SEL.register(conn, selectors.EVENT_READ, data=partial(read_stats_request, bytearray()))
+
+def read_stats_request(request, conn):
+    """collect a scrape's request headers, then answer it"""
+    try:
+        chunk = conn.recv(MAX_STATS_REQUEST)
+    except BlockingIOError:
+        return
+    except ConnectionError:
+        chunk = b''
+    if not chunk:
+        SEL.unregister(conn)
+        conn.close()
+        return
+    request += chunk
+    if b'\r\n\r\n' not in request and len(request) < MAX_STATS_REQUEST:
+        return
+    outbound = OutboundQueue()
+    outbound.push(stats_response(bytes(request)))
+    SEL.modify(conn, selectors.EVENT_WRITE, data=partial(write_stats_response, outbound))
+
+def write_stats_response(outbound, conn):
+    try:
+        done = outbound.flush(conn)
+    except ConnectionError:
+        done = True
+    if done:
+        SEL.unregister(conn)
+        conn.close()
+
+def stats_response(request):
+    """an HTTP/1.0 response to a scrape, /metrics (or /) gets the metrics and any other path a 404"""
+    parts = request.split(b' ', 2)
+    path = parts[1].split(b'?')[0] if len(parts) == 3 else b''
+    if path in (b'/metrics', b'/'):
+        status, body = '200 OK', METRICS.render().encode('utf-8')
+    else:
+        status, body = '404 Not Found', b'not found\n'
+    headers = f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    return headers.encode('utf-8') + body
+
+def open_game_records(shard=0):
+    if args.record:
+        SERVER_CONTEXT['records'] = GameRecorder(args.record, shard, args.workers, NUM_ROWS, NUM_COLS)
+
 def handle_args():
+    protocols.LOG = ServerLog(protocols.SERVER_LOG_PATH, LOG_LEVELS[args.log_level], args.log_max_bytes)
     protocols.print_and_log('STARTING SERVER')
-    set_up_server_socket()
+    set_up_server_socket(listen=args.workers <= 1)
     hostname = socket.gethostname()
-    SERVER_CONTEXT['pub_key'], SERVER_CONTEXT['pri_key'] = rsa.newkeys(512)
+    SERVER_CONTEXT['key_pool'] = KeyPool(size=1, spool_dir=args.key_spool)
+    SERVER_CONTEXT['pub_key'], SERVER_CONTEXT['pri_key'] = SERVER_CONTEXT['key_pool'].pop()
+    if args.workers <= 1: # with workers, each worker opens the game records and stats port itself
+        open_game_records()
+        if args.stats_port is not None:
+            set_up_stats_socket(args.stats_port)
+    if args.bot_after is not None and os.path.exists(args.book): # opened before forking, so workers share its pages
+        SERVER_CONTEXT['book'] = OpeningBook(args.book)
+        protocols.print_and_log(f"Opening book {args.book}: {len(SERVER_CONTEXT['book'])} positions of up to {SERVER_CONTEXT['book'].depth} tiles")
+    if args.board == 'numpy': # every game's board lives in one shared store
+        SERVER_CONTEXT['store'] = GameStore(args.max_games)
+        SERVER_CONTEXT['new_board'] = SERVER_CONTEXT['store'].new_board
+    else:
+        SERVER_CONTEXT['new_board'] = get_board_class(args.board)
     if args.dns:
         protocols.print_and_log(f'DNS name of server: {hostname}')
     if args.ipaddr:
@@ -266,8 +981,30 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--ipaddr', action='store_true', help='Prints the IPv4 address of the server')
     parser.add_argument('-p', '--port', type=int, help='Port number for the server to listen on')
     parser.add_argument('-d', '--dns', action='store_true', help='Prints the DNS name of the server')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes sharing the port with SO_REUSEPORT')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='selectors', help='Event loop the server runs on')
+    parser.add_argument('-b', '--board', choices=BOARD_ENGINES, default='numpy', help='Game engine used to store the boards')
+    parser.add_argument('-k', '--key-spool', default=DEFAULT_SPOOL_DIR, help='Directory of pre-generated RSA keys shared between processes, pass "" to disable')
+    parser.add_argument('-l', '--log-level', choices=LOG_LEVELS, default='info', help='How much to log, debug logs every message and board')
+    parser.add_argument('--log-max-bytes', type=int, default=DEFAULT_MAX_BYTES, help='Size the log file is rotated at')
+    parser.add_argument('-r', '--record', default=DEFAULT_RECORD_PATH, help='File every game is recorded to, pass "" to disable')
+    parser.add_argument('-s', '--stats-port', type=int, help='Serve metrics in the Prometheus text format on this localhost port')
+    parser.add_argument('--bot-after', type=float, help='Seconds a player waits for an opponent before the computer plays them, never if not given')
+    parser.add_argument('--book', default=DEFAULT_BOOK_PATH, help="The computer's opening book, built with opening_book.py, used if it exists")
+    parser.add_argument('--bot-time', type=float, default=DEFAULT_TIME_BUDGET, help="Seconds the computer thinks about each move")
+    parser.add_argument('--resume-grace', type=float, default=DEFAULT_RESUME_GRACE, help='Seconds a player whose connection drops mid game has to come back before they forfeit, 0 forfeits straight away')
+    parser.add_argument('-m', '--max-games', type=int, default=DEFAULT_MAX_GAMES, help='Maximum number of games played at once')
     args = parser.parse_args()
+    if args.workers > 1 and args.engine != 'selectors':
+        parser.error('--workers runs the selectors engine in each worker')
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--workers needs SO_REUSEPORT, which this platform does not have')
+    if args.engine == 'asyncio':
+        import asyncio # only the asyncio engine uses it, the selectors engine starts faster without it
     handle_args()
-    main()
+    if args.workers > 1:
+        run_supervisor()
+    else:
+        main()
 
 # python3 server.py -i -p
\ No newline at end of file
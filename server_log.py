@@ -0,0 +1,133 @@
+import os
+import queue
+import sys
+import threading
+
+ERROR = 0
+INFO = 1
+DEBUG = 2 # every message sent and received, and the board after every move
+LOG_LEVELS = {'error': ERROR, 'info': INFO, 'debug': DEBUG}
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+MAX_BATCH = 4096 # most records written with one write call
+REDACTED_KEYS = ('pub_key', 'signature', 'session_key')
+
+def format_message(direction, message, proto_names):
+    """the log file and console text of a message dict, with its keys redacted"""
+    message = message.copy()
+    lines = [direction + '\n'] if direction else []
+    for key, value in message.items():
+        if key in REDACTED_KEYS:
+            message[key] = 'REDACTED'
+        lines.append(f"\t{key}: {message[key]}\n")
+        if key == 'proto':
+            lines.append(f"\tmessag_type: {proto_names[value]}\n")
+    return ''.join(lines), str(message)
+
+class ServerLog:
+    """
+    The server's log. Callers only put records on a queue, a background thread formats them and writes everything
+    queued with one write to the log file (or to sink, see below) and one to the console, so logging never waits on disk.
+    The file is rotated once it passes max_bytes, keeping backups old files (server-log.log.1 is the newest).
+    Records above level are dropped before anything is formatted, callers building expensive text can check enabled first.
+    With sink, the log file text is passed to sink(text) from the writer thread instead of written to path.
+    """
+
+    def __init__(self, path, level=INFO, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS, sink=None, prefix='') -> None:
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sink = sink
+        self.prefix = prefix # put in front of every record in the log file, e.g. which worker it came from
+        self.file = None
+        self.records = queue.Queue()
+        self.thread = threading.Thread(target=self._write_records, name='server-log', daemon=True)
+        self.thread.start()
+        os.register_at_fork(before=self.flush) # don't fork while the writer holds the console's lock
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, text, level=INFO, console=True):
+        """log a line of text, printing it too unless console is False or other text to print is given"""
+        if level <= self.level:
+            self.records.put((text + '\n', text if console is True else console or None))
+
+    def write(self, text, level=INFO):
+        """append text to the log file as is, without printing it"""
+        if level <= self.level:
+            self.records.put((text, None))
+
+    def log_message(self, direction, message, proto_names, level=DEBUG):
+        """log a message dict, it's redacted and formatted on the writer thread"""
+        if level <= self.level:
+            self.records.put((direction, message.copy(), proto_names))
+
+    def flush(self):
+        """wait until everything logged so far is written"""
+        if self.thread.is_alive():
+            self.records.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+
+    def _write_records(self):
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            file_text, console_text = [], []
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                if len(record) == 3:
+                    record = format_message(*record)
+                file_text.append(self.prefix + record[0])
+                if record[1] is not None:
+                    console_text.append(record[1] + '\n')
+            try:
+                self._write_file(''.join(file_text))
+                if console_text:
+                    sys.stdout.write(''.join(console_text))
+                    sys.stdout.flush()
+            except (OSError, ValueError) as e: # keep logging if the disk is full or stdout went away
+                print(f"Unable to write to the log: {e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.records.task_done()
+        if self.file is not None:
+            self.file.close()
+
+    def _write_file(self, text):
+        if not text:
+            return
+        if self.sink is not None:
+            self.sink(text)
+            return
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(text)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        if self.backups == 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
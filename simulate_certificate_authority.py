@@ -2,23 +2,62 @@ import hashlib
 import rsa
 import base64
 import os
+import shutil
+import sys
 import time
+import uuid
+from collections import OrderedDict
+
+VERIFY_CACHE_SIZE = 4096
+CA_FOLDER = os.path.join(".", "ca_keys")
+CA_KEY_BITS = 512
+WAIT_POLL_INTERVAL = 0.2 # only where inotify isn't available
+IN_CREATE = 0x100 # inotify event masks, from <sys/inotify.h>
+IN_MOVED_TO = 0x80
+
+_CA_KEYS = {} # folder -> loaded CA keys, every CertificateAuthority in a process shares them
 
 class CertificateAuthority:
 
-    def __init__(self, is_server: bool):
-        self.ca_keys = self._get_CA_keys()
+    def __init__(self, is_server: bool, cache_size: int = VERIFY_CACHE_SIZE):
         self.is_server = is_server
+        self.ca_keys = get_ca_keys(is_server)
+        self.cache_size = cache_size
+        self.verify_cache = OrderedDict() # (key fingerprint, signature) -> verified, least recently used first
+        self.signed_keys = {} # key fingerprint -> (serialized key, signature), for keys this process signs repeatedly
+        self.cache_stats = {'hits': 0, 'misses': 0}
 
     def verify_signature(self, to_be_verified: rsa.PublicKey, signature: bytes) -> bool:
-        """Simulates verifying signature with installed public key of CA"""
-        to_be_verified_str = key_to_string(to_be_verified)
-        hash_hex = self._get_hash(to_be_verified_str)
-        try:
-            rsa.verify(hash_hex.encode('utf-8'), signature, self.ca_keys['pri_key'])
-            return True
-        except rsa.VerificationError:
-            return False
+        """Simulates verifying signature with installed public key of CA, results are remembered in a bounded LRU cache"""
+        cache_key = (key_fingerprint(to_be_verified), signature)
+        if cache_key in self.verify_cache:
+            self.verify_cache.move_to_end(cache_key)
+            self.cache_stats['hits'] += 1
+            return self.verify_cache[cache_key]
+        verified = check_signature(self.ca_keys['pri_key'], to_be_verified, signature)
+        self.remember_verification(to_be_verified, signature, verified)
+        return verified
+
+    def is_cached(self, to_be_verified: rsa.PublicKey, signature: bytes) -> bool:
+        return (key_fingerprint(to_be_verified), signature) in self.verify_cache
+
+    def remember_verification(self, to_be_verified: rsa.PublicKey, signature: bytes, verified: bool):
+        """add a verification to the cache, including ones done by check_signature in another process"""
+        self.cache_stats['misses'] += 1
+        self.verify_cache[(key_fingerprint(to_be_verified), signature)] = verified
+        if len(self.verify_cache) > self.cache_size:
+            self.verify_cache.popitem(last=False)
+
+    def sign_key(self, key: rsa.PublicKey):
+        """Serialized key and its signature, cached because the same key (like the server's own) is sent over and over"""
+        fingerprint = key_fingerprint(key)
+        if fingerprint not in self.signed_keys:
+            key_ser = key_to_string(key)
+            self.signed_keys[fingerprint] = (key_ser, self.create_signature(key_ser))
+        return self.signed_keys[fingerprint]
+
+    def cache_info(self) -> dict:
+        return {**self.cache_stats, 'size': len(self.verify_cache), 'max_size': self.cache_size}
 
     def create_signature(self, to_be_signed) -> bytes:
         """Simulates getting certificate authenticated by CA"""
@@ -28,33 +67,6 @@ class CertificateAuthority:
         ca_signature = rsa.sign(hash_digest.encode('utf-8'), self.ca_keys['pri_key'], 'SHA-256') # message_bytes, private key, hash method
         return ca_signature
 
-    def _get_CA_keys(self) -> dict:
-        """Returns the CA keys, create them if they don't exist but only for server. Client will sleep and try again to avoid a race condition (though a race conidtion still exists)"""
-        ca_keys = dict()
-        ca_folder = os.path.join(".", "ca_keys")
-        got_keys = False
-        while not got_keys: 
-            if not os.path.exists(ca_folder) and self.is_server: # if keys don't exist, create, save, and use them
-                os.makedirs(ca_folder, exist_ok=True)
-                ca_keys['pub_key'], ca_keys['pri_key'] = rsa.newkeys(512)
-                with open(os.path.join(ca_folder, "public_key.pem"), "wb") as pub_file:
-                    pub_file.write(ca_keys['pub_key'].save_pkcs1(format='PEM'))
-                with open(os.path.join(ca_folder, "private_key.pem"), "wb") as pri_file:
-                    pri_file.write(ca_keys['pri_key'].save_pkcs1(format='PEM'))
-                got_keys = True
-            elif not os.path.exists(ca_folder) and not self.is_server: #only the server can cause the keys to generate
-                got_keys = False
-                print('waiting')
-                time.sleep(0.2)
-            else: # if keys do exist, load and use them
-                with open(os.path.join(ca_folder, "public_key.pem"), "rb") as pub_file:
-                    ca_keys['pub_key'] = rsa.PublicKey.load_pkcs1(pub_file.read(), format='PEM')
-                with open(os.path.join(ca_folder, "private_key.pem"), "rb") as pri_file:
-                    ca_keys['pri_key'] = rsa.PrivateKey.load_pkcs1(pri_file.read(), format='PEM')
-                got_keys = True
-        
-        return ca_keys
-
     def _get_hash(self, to_be_hashed: str) -> str:
         """creates a hash using SHA256 for a given string"""
         hasher = hashlib.sha256()
@@ -62,6 +74,81 @@ class CertificateAuthority:
         hash_hex = hasher.hexdigest()
         return hash_hex
 
+def get_ca_keys(is_server: bool, ca_folder: str = CA_FOLDER) -> dict:
+    """
+    The CA keys, loaded once per process. Only a server creates them if they don't exist yet, a client blocks until a
+    server has published them
+    """
+    ca_keys = _CA_KEYS.get(ca_folder)
+    if ca_keys is None:
+        if not os.path.exists(ca_folder):
+            if is_server:
+                publish_ca_keys(ca_folder)
+            else:
+                print(f"waiting for a server to create the CA keys in {ca_folder}")
+                wait_for_path(ca_folder)
+        ca_keys = _CA_KEYS[ca_folder] = load_ca_keys(ca_folder)
+    return ca_keys
+
+def load_ca_keys(ca_folder: str) -> dict:
+    ca_keys = dict()
+    with open(os.path.join(ca_folder, "public_key.pem"), "rb") as pub_file:
+        ca_keys['pub_key'] = rsa.PublicKey.load_pkcs1(pub_file.read(), format='PEM')
+    with open(os.path.join(ca_folder, "private_key.pem"), "rb") as pri_file:
+        ca_keys['pri_key'] = rsa.PrivateKey.load_pkcs1(pri_file.read(), format='PEM')
+    return ca_keys
+
+def publish_ca_keys(ca_folder: str):
+    """
+    Create the keys in a temporary folder and rename it into place, so other processes see both keys or no folder at all.
+    If another server published first its keys are kept and these thrown away
+    """
+    tmp_folder = f"{ca_folder}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_folder)
+    pub_key, pri_key = rsa.newkeys(CA_KEY_BITS)
+    for name, key in (("public_key.pem", pub_key), ("private_key.pem", pri_key)):
+        with open(os.path.join(tmp_folder, name), "wb") as key_file:
+            key_file.write(key.save_pkcs1(format='PEM'))
+            key_file.flush()
+            os.fsync(key_file.fileno()) # on disk before the rename makes it visible
+    try:
+        os.rename(tmp_folder, ca_folder)
+    except OSError: # the folder exists now, another server won
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+
+def wait_for_path(path: str):
+    """
+    Block until path exists. On Linux this waits on inotify for entries created or renamed into its parent folder, so a
+    waiting client uses no CPU and wakes the moment the keys are published. Elsewhere it falls back to polling
+    """
+    inotify_fd = _watch_folder(os.path.dirname(os.path.abspath(path)))
+    try:
+        while not os.path.exists(path): # checked after the watch is added, so a rename in between isn't missed
+            if inotify_fd is None:
+                time.sleep(WAIT_POLL_INTERVAL)
+            else:
+                os.read(inotify_fd, 4096) # the events themselves don't matter, only that something changed
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+def _watch_folder(folder: str):
+    """an inotify file descriptor watching folder for new entries, None if inotify isn't available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if inotify_fd < 0:
+        return None
+    if libc.inotify_add_watch(inotify_fd, os.fsencode(folder), IN_CREATE | IN_MOVED_TO) < 0:
+        os.close(inotify_fd)
+        return None
+    return inotify_fd
+
 # Everything below is for testing and debugging only
 def main():
     ca_obj = CertificateAuthority(True)
@@ -74,6 +161,19 @@ def main():
     verified = ca_obj.verify_signature(message_recv['pub_key'], message_recv['signature'])
     print(f"verified: {verified}")
 
+def check_signature(ca_key, to_be_verified: rsa.PublicKey, signature: bytes) -> bool:
+    """the uncached verification, a plain function so it can also run in a worker process"""
+    hash_hex = hashlib.sha256(key_to_string(to_be_verified).encode('utf-8')).hexdigest()
+    try:
+        rsa.verify(hash_hex.encode('utf-8'), signature, ca_key)
+        return True
+    except rsa.VerificationError:
+        return False
+
+def key_fingerprint(key) -> bytes:
+    """SHA256 of the key's modulus and exponent, identifies a key without serializing it"""
+    return hashlib.sha256(f"{key.n}:{key.e}".encode('utf-8')).digest()
+
 def key_to_string(key):
     return base64.b64encode(key.save_pkcs1(format='PEM')).decode('utf-8')
 
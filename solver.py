@@ -0,0 +1,229 @@
+import time
+
+from Board import Board, NUM_COLS, NUM_ROWS, WINNING_NUMBER
+from BitBoard import COL_BITS, BOTTOM_MASKS, COLUMN_MASKS, FULL_MASK
+
+# Positions are (current, mask, moves): the bits of the player to move, every occupied slot and the number of tiles,
+# in BitBoard's layout. Scores are from the player to move's point of view: positive wins, the sooner the higher
+# ((cells + 1 - moves) / 2 for a win on move number moves, like Pascal Pons' solver), 0 a draw, negative loses.
+# Searches that run out of depth score the position with a heuristic strictly between -1 and 1.
+CELLS = NUM_COLS * NUM_ROWS
+BOTTOM = sum(BOTTOM_MASKS)
+CENTRE_ORDER = sorted(range(NUM_COLS), key=lambda col: abs(2 * col - (NUM_COLS - 1))) # centre columns are usually best
+INFINITY = CELLS
+DEFAULT_TABLE_SIZE = (1 << 20) + 7 # odd so keys spread over the whole table
+DEFAULT_TIME_BUDGET = 0.05
+EXACT, LOWER, UPPER = 0, 1, 2
+
+if WINNING_NUMBER != 4:
+    raise ImportError("the solver's threat detection only handles four in a row")
+
+class TimeUp(Exception):
+    pass
+
+def winning_cells(position, mask):
+    """empty cells that would give position four in a row"""
+    # vertical
+    cells = (position << 1) & (position << 2) & (position << 3)
+    # horizontal, then the two diagonals, with up to three tiles on either side of the empty cell
+    for shift in (COL_BITS, COL_BITS - 1, COL_BITS + 1):
+        pair = (position << shift) & (position << 2 * shift)
+        cells |= pair & (position << 3 * shift)
+        cells |= pair & (position >> shift)
+        pair = (position >> shift) & (position >> 2 * shift)
+        cells |= pair & (position << shift)
+        cells |= pair & (position >> 3 * shift)
+    return cells & (FULL_MASK ^ mask)
+
+def playable(mask):
+    """the lowest empty cell of every column that isn't full"""
+    return (mask + BOTTOM) & FULL_MASK
+
+def position_of(board, player_id):
+    """(current, mask, moves) of a Board or BitBoard with player_id to move"""
+    if hasattr(board, 'position'): # a BitBoard already has them
+        return board.position[player_id], board.mask, board.mask.bit_count()
+    current = mask = 0
+    for row, tiles in enumerate(board.rows()):
+        for col, tile in enumerate(tiles):
+            if tile != Board.FILL_VALUE:
+                bit = 1 << (col * COL_BITS + row)
+                mask |= bit
+                if tile == player_id:
+                    current |= bit
+    return current, mask, mask.bit_count()
+
+def centre_most_move(mask):
+    """the column nearest the centre that isn't full"""
+    possible = playable(mask)
+    return next(col for col in CENTRE_ORDER if possible & COLUMN_MASKS[col])
+
+class Solver:
+    """
+    Negamax with alpha-beta pruning over bitboards. Moves are tried best first: the transposition table's best move,
+    then by how many threats they make, then centre first. Moves that hand the opponent a win are never searched.
+    The transposition table has a fixed number of slots, a new entry replaces whatever was in its slot.
+    """
+
+    def __init__(self, table_size: int = DEFAULT_TABLE_SIZE) -> None:
+        self.table_size = table_size
+        self.table_keys = [-1] * table_size # -1 is never a key, the empty board's is 0
+        self.table_entries = [None] * table_size # (depth, bound type, score, best column)
+        self.nodes = 0
+        self.deadline = None
+
+    def best_move(self, current, mask, moves, time_budget=DEFAULT_TIME_BUDGET):
+        """
+        iterative deepening until time_budget seconds are up or the position is solved,
+        returns (column counted from 0, score, depth searched)
+        """
+        self.deadline = time.perf_counter() + time_budget
+        self.nodes = 0
+        possible = playable(mask)
+        for col in CENTRE_ORDER:
+            if winning_cells(current, mask) & possible & COLUMN_MASKS[col]:
+                return col, (CELLS + 1 - moves) // 2, 1
+        best = centre_most_move(mask)
+        score, depth = 0, 0
+        for depth in range(1, CELLS - moves + 1):
+            try:
+                score, col = self.search_root(current, mask, moves, depth)
+            except TimeUp:
+                depth -= 1
+                break
+            if col is not None:
+                best = col
+            if score >= 1 or score <= -1: # a forced win or loss, deeper searches won't change it
+                break
+        self.deadline = None
+        return best, score, depth
+
+    def score_move(self, current, mask, moves, column, time_budget=DEFAULT_TIME_BUDGET):
+        """
+        score of playing column (counted from 0) by iterative deepening for time_budget seconds, from the side of the
+        player to move. None if the column is full
+        """
+        move = playable(mask) & COLUMN_MASKS[column]
+        if not move:
+            return None
+        if winning_cells(current, mask) & move:
+            return (CELLS + 1 - moves) // 2
+        self.deadline = time.perf_counter() + time_budget
+        self.nodes = 0
+        score = 0
+        for depth in range(CELLS - moves):
+            try:
+                score = -self.negamax(current ^ mask, mask | move, moves + 1, -INFINITY, INFINITY, depth)
+            except TimeUp:
+                break
+            if score >= 1 or score <= -1:
+                break
+        self.deadline = None
+        return score
+
+    def search_root(self, current, mask, moves, depth):
+        alpha, best = -INFINITY, None
+        for col, move in self.ordered_moves(current, mask, moves, self.safe_moves(current, mask)):
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -INFINITY, -alpha, depth - 1)
+            if score > alpha:
+                alpha, best = score, col
+        if best is None: # every move loses, play the one the table or the centre ordering likes best
+            return -((CELLS - moves) // 2), None
+        return alpha, best
+
+    def safe_moves(self, current, mask):
+        """moves that don't let the opponent win straight away, 0 if there aren't any"""
+        possible = playable(mask)
+        opponent_wins = winning_cells(current ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1): # two threats, only one can be blocked
+                return 0
+            possible = forced
+        return possible & ~(opponent_wins >> 1) # don't play under a cell the opponent needs
+
+    def ordered_moves(self, current, mask, moves, candidates):
+        key = current + mask
+        slot = key % self.table_size
+        table_best = self.table_entries[slot][3] if self.table_keys[slot] == key else None
+        ordered = []
+        for col in CENTRE_ORDER:
+            move = candidates & COLUMN_MASKS[col]
+            if move:
+                threats = (winning_cells(current | move, mask | move)).bit_count()
+                ordered.append((col == table_best, threats, col, move))
+        ordered.sort(key=lambda option: (option[0], option[1]), reverse=True) # stable, so ties stay centre first
+        return [(col, move) for _, _, col, move in ordered]
+
+    def negamax(self, current, mask, moves, alpha, beta, depth):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and self.deadline is not None and time.perf_counter() > self.deadline:
+            raise TimeUp()
+        if moves == CELLS:
+            return 0
+        possible = playable(mask)
+        if winning_cells(current, mask) & possible:
+            return (CELLS + 1 - moves) // 2
+        candidates = self.safe_moves(current, mask)
+        if not candidates:
+            return -((CELLS - moves) // 2)
+        if depth <= 0:
+            return self.heuristic(current, mask)
+
+        highest = (CELLS - 1 - moves) // 2 # we can't win on this move, so at best on our next one
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        key = current + mask
+        slot = key % self.table_size
+        if self.table_keys[slot] == key:
+            entry_depth, bound, score, _ = self.table_entries[slot]
+            if entry_depth >= depth or score >= 1 or score <= -1:
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        original_alpha, best, best_col = alpha, -INFINITY, None
+        for col, move in self.ordered_moves(current, mask, moves, candidates):
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -beta, -alpha, depth - 1)
+            if score > best:
+                best, best_col = score, col
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+
+        bound = LOWER if best >= beta else UPPER if best <= original_alpha else EXACT
+        self.table_keys[slot] = key
+        self.table_entries[slot] = (depth, bound, best, best_col)
+        return best
+
+    def heuristic(self, current, mask):
+        """more open threats than the opponent is better, scaled to stay between -1 and 1"""
+        mine = winning_cells(current, mask).bit_count()
+        theirs = winning_cells(current ^ mask, mask).bit_count()
+        return (mine - theirs) / (2 * CELLS)
+
+SOLVER = None # one per process, so its transposition table carries over between moves
+
+def shared_solver():
+    global SOLVER
+    if SOLVER is None:
+        SOLVER = Solver()
+    return SOLVER
+
+# plain functions using this process's solver, so they can run in a worker process
+def search(current, mask, moves, time_budget=DEFAULT_TIME_BUDGET):
+    return shared_solver().best_move(current, mask, moves, time_budget)
+
+def score_move(current, mask, moves, column, time_budget=DEFAULT_TIME_BUDGET):
+    return shared_solver().score_move(current, mask, moves, column, time_budget)
+
+def choose_move(current, mask, moves, time_budget=DEFAULT_TIME_BUDGET):
+    """the solver's move for a position, counted from 0"""
+    return search(current, mask, moves, time_budget)[0]
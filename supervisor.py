@@ -0,0 +1,192 @@
+import json
+import os
+import selectors
+import signal
+import socket
+import time
+
+MAX_CHANNEL_MESSAGE = 64 * 1024
+STATS_INTERVAL = 30 # seconds between the supervisor's aggregated stats lines
+
+def send_control(channel, message, fds=()):
+    """one JSON message (and optionally file descriptors) over a SOCK_SEQPACKET channel"""
+    socket.send_fds(channel, [json.dumps(message).encode('utf-8')], list(fds))
+
+def recv_control(channel):
+    """
+    returns (message, fds), message is None when the other end has closed. Raises ValueError for a message that was cut
+    off or isn't a JSON object with an op, after closing any fds that came with it
+    """
+    data, fds, flags, _ = socket.recv_fds(channel, MAX_CHANNEL_MESSAGE, 4)
+    if not data:
+        return None, fds
+    try:
+        if flags & socket.MSG_TRUNC:
+            raise ValueError(f"longer than {MAX_CHANNEL_MESSAGE} bytes")
+        message = json.loads(data.decode('utf-8')) # bad utf-8 and bad JSON are both ValueErrors
+        if not isinstance(message, dict) or 'op' not in message:
+            raise ValueError("not an object with an op")
+    except ValueError as e:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError(f"Dropped a malformed control message ({e})") from None
+    return message, fds
+
+class Supervisor:
+    """
+    Forks the server's worker processes and keeps them running. Each worker listens on the same port with SO_REUSEPORT
+    and talks to the supervisor over a SOCK_SEQPACKET channel, which carries their log text, periodic stats and matchmaking.
+
+    Matchmaking: a worker asks the supervisor before seating each new player. If another worker has a lone waiting
+    player, the new connection's socket is passed (SCM_RIGHTS) through the supervisor to that worker, so the two players
+    end up in the same process.
+    """
+
+    def __init__(self, num_workers, run_worker, write_log, log) -> None:
+        self.num_workers = num_workers
+        self.run_worker = run_worker # run_worker(index, channel) runs in the forked child and returns an exit code
+        self.write_log = write_log # appends text to the aggregated log
+        self.log = log # prints and logs a line
+        self.sel = selectors.DefaultSelector()
+        self.workers = {} # index -> dict of the worker's pid, channel and latest stats
+        self.lobbies = {} # worker indexes with a lone waiting player, used as an ordered set
+        self.running = True
+
+    def run(self):
+        for index in range(self.num_workers):
+            self.start_worker(index)
+        next_stats = time.monotonic() + STATS_INTERVAL
+        try:
+            while self.running:
+                for key, _ in self.sel.select(timeout=1.0):
+                    self.handle_channel(key.data)
+                self.reap_workers()
+                if time.monotonic() >= next_stats:
+                    next_stats += STATS_INTERVAL
+                    self.log(self.stats_line())
+        finally:
+            self.running = False
+            self.stop_workers()
+            self.log(self.stats_line())
+
+    def start_worker(self, index):
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid == 0: # the worker
+            parent_end.close()
+            for worker in self.workers.values():
+                worker['channel'].close()
+            self.sel.close()
+            code = 1
+            try:
+                code = self.run_worker(index, child_end)
+            finally:
+                os._exit(code)
+        child_end.close()
+        self.workers[index] = {'pid': pid, 'channel': parent_end, 'stats': {}}
+        self.sel.register(parent_end, selectors.EVENT_READ, data=index)
+        self.log(f"Started worker {index}, pid {pid}")
+
+    def reap_workers(self):
+        """restart any worker that has died"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for index, worker in list(self.workers.items()):
+                if worker['pid'] == pid:
+                    self.forget_worker(index)
+                    if self.running:
+                        self.log(f"Worker {index} (pid {pid}) exited with status {status}, restarting it")
+                        self.start_worker(index)
+
+    def forget_worker(self, index):
+        worker = self.workers.pop(index)
+        try:
+            self.sel.unregister(worker['channel'])
+        except KeyError: # already unregistered when its channel closed
+            pass
+        worker['channel'].close()
+        self.lobbies.pop(index, None)
+
+    def stop_workers(self):
+        for worker in self.workers.values():
+            try:
+                os.kill(worker['pid'], signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        for worker in self.workers.values():
+            try:
+                os.waitpid(worker['pid'], 0)
+            except ChildProcessError:
+                pass
+
+    def handle_channel(self, index):
+        worker = self.workers.get(index)
+        if worker is None:
+            return
+        try:
+            message, fds = recv_control(worker['channel'])
+        except ConnectionResetError:
+            message, fds = None, []
+        except ValueError as e:
+            self.log(f"Worker {index}: {e}")
+            return
+        if message is None: # the worker is gone, reap_workers restarts it
+            self.sel.unregister(worker['channel'])
+            return
+        match message['op']:
+            case 'log':
+                self.write_log(message['text'])
+            case 'stats':
+                worker['stats'] = message['stats']
+            case 'lobby?':
+                self.match(index)
+            case 'lobby_claim': # a worker claims its own lobby, or gives back one it was matched with but didn't use
+                claimed = message.get('worker', index)
+                if claimed in self.workers:
+                    self.lobbies[claimed] = True
+            case 'lobby_empty':
+                self.lobbies.pop(index, None)
+            case 'handoff':
+                self.forward_handoff(message, fds)
+
+    def match(self, index):
+        """
+        decide where a worker's newly verified player is seated. Every pairing goes through here so two workers can't
+        both end up with a lone waiting player. Replies carry whether the supervisor now counts the worker as having a
+        waiting player, the worker corrects that with lobby_claim/lobby_empty if it turns out otherwise
+        """
+        if index in self.lobbies: # pair them with the worker's own waiting player
+            del self.lobbies[index]
+            send_control(self.workers[index]['channel'], {'op': 'keep', 'waiting': False})
+            return
+        for other in self.lobbies:
+            if other in self.workers:
+                del self.lobbies[other]
+                send_control(self.workers[index]['channel'], {'op': 'handoff', 'to': other})
+                return
+        self.lobbies[index] = True
+        send_control(self.workers[index]['channel'], {'op': 'keep', 'waiting': True})
+
+    def forward_handoff(self, message, fds):
+        target = self.workers.get(message['to'])
+        try:
+            if target is not None:
+                send_control(target['channel'], {**message, 'op': 'adopt', 'waiting': False}, fds)
+            else:
+                self.log(f"Worker {message['to']} went away before a handoff, dropping the connection")
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def stats_line(self):
+        totals = {}
+        for worker in self.workers.values():
+            for name, value in worker['stats'].items():
+                totals[name] = totals.get(name, 0) + value
+        per_worker = ", ".join(f"{index}: {worker['stats']}" for index, worker in sorted(self.workers.items()))
+        return f"Server stats across {len(self.workers)} workers: {totals} ({per_worker})"
@@ -0,0 +1,71 @@
+import sys
+
+import auxillary as aux
+from Board import NUM_COLS, NUM_ROWS
+
+CIRCLE = '\u25CF'
+HEADER = '\n  ' + "   ".join(str(n+1) for n in range(NUM_COLS)) + ' \n\n'
+
+# Where things are on the screen for the TerminalRenderer, counted from 1 like ANSI cursor positions
+FIRST_ROW_LINE = HEADER.count('\n') + 1 # the top row of the board
+STATUS_LINE = FIRST_ROW_LINE + NUM_ROWS + 1 # under the board and a blank line
+PROMPT_LINE = STATUS_LINE + 1 # input prompts and anything else the client prints
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_LINE = '\x1b[2K'
+CLEAR_BELOW = '\x1b[J'
+
+def tile_texts(board):
+    """what each tile value looks like on the terminal"""
+    tiles = {board.FILL_VALUE: ' '}
+    for player in board.players:
+        tiles[player.id] = aux.color_text(player, CIRCLE)
+    return tiles
+
+def draw_board(board):
+    """the board for the terminal, with each player's tiles as circles in their color"""
+    tiles = tile_texts(board)
+    lines = [HEADER]
+    for row in reversed(board.rows()): # top row first
+        lines.append('| ' + " | ".join(tiles.get(tile, str(tile)) for tile in row) + ' |\n')
+    return ''.join(lines)
+
+def move_to(line, column=1):
+    return f'\x1b[{line};{column}H'
+
+class TerminalRenderer:
+    """
+    Keeps a board up to date on the terminal: the whole board is drawn once, after that only the cells that changed and
+    the status line are rewritten, by moving the cursor to them with ANSI escape codes. The cursor is left on the line
+    under the status so input prompts always appear in the same place. When the output isn't a terminal (it's
+    redirected to a file or a pipe) nothing is drawn at all
+    """
+
+    def __init__(self, board, out=sys.stdout) -> None:
+        self.board = board
+        self.out = out
+        self.enabled = out.isatty()
+        self.tiles = tile_texts(board)
+        self.drawn = None # tile value on screen per cell, row 0 at the bottom, None until the first draw
+        self.status = None
+
+    def draw(self, status=""):
+        if not self.enabled:
+            return
+        rows = self.board.rows()
+        parts = []
+        if self.drawn is None:
+            parts.append(CLEAR_SCREEN + draw_board(self.board))
+            self.drawn = rows
+        else:
+            for row, tiles in enumerate(rows):
+                drawn = self.drawn[row]
+                for col, tile in enumerate(tiles):
+                    if drawn[col] != tile:
+                        drawn[col] = tile
+                        parts.append(move_to(FIRST_ROW_LINE + NUM_ROWS - 1 - row, 3 + 4 * col) + self.tiles.get(tile, str(tile)))
+        if status != self.status:
+            parts.append(move_to(STATUS_LINE) + CLEAR_LINE + status)
+            self.status = status
+        parts.append(move_to(PROMPT_LINE) + CLEAR_BELOW) # clear whatever was printed under the board last time
+        self.out.write(''.join(parts))
+        self.out.flush()
@@ -0,0 +1,69 @@
+"""
+The bitboard engine against the NumPy Board on the same random games: every move, the tiles, game over and winner.
+
+Run from the repository root: python3 -m pytest tests
+"""
+import random
+
+import pytest
+
+from BitBoard import BitBoard
+from Board import Board, NUM_COLS, NUM_ROWS
+from GameStore import GameStore
+from Player import Player
+from solver import position_of
+
+def make_players():
+    players = [Player('red', 0), Player('blue', 1)]
+    Player.set_player_colors(players)
+    return players
+
+def play_random_game(rng, boards):
+    """plays random columns, some of them full or off the board, on every board at once and checks they agree"""
+    turn = 0
+    while True:
+        col = rng.randint(0, NUM_COLS + 1)
+        placed = [board.place_tile(col, turn) for board in boards]
+        assert len(set(placed)) == 1, f"column {col}"
+        if not placed[0]:
+            continue
+        rows = [board.rows() for board in boards]
+        assert all(tiles == rows[0] for tiles in rows)
+        over = [board.game_over() for board in boards]
+        assert len(set(over)) == 1
+        if over[0]:
+            return [board.winner for board in boards]
+        turn = (turn + 1) % 2
+
+@pytest.mark.parametrize('seed', range(200))
+def test_same_games(seed):
+    rng = random.Random(seed)
+    winners = play_random_game(rng, [Board(make_players()), BitBoard(make_players())])
+    assert winners[0] == winners[1]
+
+def test_store_backed_board():
+    store = GameStore(2)
+    boards = [Board(make_players(), store=store), Board(make_players()), BitBoard(make_players())]
+    play_random_game(random.Random(457), boards)
+    boards[0].release()
+    assert store.live_count() == 0
+    assert boards[0].rows() == boards[1].rows() # still readable once the slot is given back
+
+def test_full_board_is_a_draw():
+    # columns in pairs, each pair's colour swapping every row, has no four in a row anywhere
+    boards = [Board(make_players()), BitBoard(make_players())]
+    for col in range(NUM_COLS):
+        for row in range(NUM_ROWS):
+            for board in boards:
+                assert not board.game_over()
+                assert board.place_tile(col + 1, (col // 2 + row) % 2)
+    assert all(board.game_over() for board in boards)
+    assert [board.winner for board in boards] == [-1, -1]
+
+def test_solver_reads_both_engines_the_same():
+    boards = [Board(make_players()), BitBoard(make_players())]
+    rng = random.Random(458)
+    for turn in range(10):
+        col = next(col for col in rng.sample(range(1, NUM_COLS + 1), NUM_COLS) if boards[0].place_tile(col, turn % 2))
+        boards[1].place_tile(col, turn % 2)
+        assert position_of(boards[0], turn % 2) == position_of(boards[1], turn % 2)
@@ -0,0 +1,116 @@
+"""
+Opening book lookups of positions and their mirror images, on a book written with made up moves and on one built by
+solving every position.
+
+Run from the repository root: python3 -m pytest tests
+"""
+import multiprocessing
+
+import pytest
+
+import opening_book
+from BitBoard import COLUMN_MASKS
+from Board import NUM_COLS
+from opening_book import OpeningBook, build_book, canonical_key, mirror, positions_up_to, write_book
+from solver import INFINITY, Solver, playable
+
+DEPTH = 3
+SEARCH_DEPTH = 4 # plies the built book's positions are searched, with a fresh solver each time so every search agrees
+
+def made_up_entry(key):
+    """a lopsided (column, score) so a lookup that forgets to mirror the column gets caught"""
+    return key % NUM_COLS, key % 7 - 3
+
+def play(columns):
+    current = mask = 0
+    for col in columns:
+        move = playable(mask) & COLUMN_MASKS[col]
+        current, mask = current ^ mask, mask | move
+    return current, mask
+
+def mirrored(columns):
+    return [NUM_COLS - 1 - col for col in columns]
+
+@pytest.fixture(scope='module')
+def book(tmp_path_factory):
+    positions = positions_up_to(DEPTH)
+    path = tmp_path_factory.mktemp('book') / 'book.c4b'
+    write_book(str(path), DEPTH, {key: made_up_entry(key) for key in positions})
+    book = OpeningBook(str(path))
+    yield book
+    book.close()
+
+def test_mirror_round_trip():
+    for current, mask, _ in positions_up_to(DEPTH).values():
+        assert mirror(mirror(current + mask)) == current + mask
+        assert mirror(current) + mirror(mask) == mirror(current + mask)
+
+def test_every_position_and_its_mirror(book):
+    positions = positions_up_to(DEPTH)
+    assert len(book) == len(positions)
+    for key, (current, mask, _) in positions.items():
+        column, score = made_up_entry(key)
+        assert book.lookup(current, mask) == (column, score)
+        if mirror(key) != key: # a symmetric position is its own mirror image, its column isn't flipped
+            assert book.lookup(mirror(current), mirror(mask)) == (NUM_COLS - 1 - column, score)
+
+@pytest.mark.parametrize('columns', [[0], [6, 5], [1, 2, 3], [0, 0, 6], [2, 4, 4], [3, 3, 1]])
+def test_games_and_their_mirrors(book, columns):
+    key, _ = canonical_key(*play(columns))
+    column, score = made_up_entry(key)
+    found = book.lookup(*play(columns))
+    found_mirrored = book.lookup(*play(mirrored(columns)))
+    assert found[1] == found_mirrored[1] == score
+    assert found[0] == NUM_COLS - 1 - found_mirrored[0]
+    assert column in (found[0], found_mirrored[0])
+
+def test_positions_past_the_depth_are_missing(book):
+    assert book.lookup(*play([3, 3, 3, 3])) is None
+
+def test_positions_are_stored_as_the_image_with_the_smaller_key():
+    for key, (current, mask, _) in positions_up_to(DEPTH + 1).items():
+        assert current + mask == key
+        assert canonical_key(current, mask) == (key, False)
+
+def test_a_position_and_its_mirror_share_a_key():
+    for current, mask, _ in positions_up_to(DEPTH).values():
+        assert canonical_key(current, mask)[0] == canonical_key(mirror(current), mirror(mask))[0]
+
+def test_symmetric_positions(book):
+    for columns in ([], [3], [3, 3], [2, 4]):
+        key, _ = canonical_key(*play(columns))
+        assert book.lookup(*play(columns)) == made_up_entry(key)
+
+def test_old_versions_are_refused(tmp_path):
+    path = tmp_path / 'old.c4b'
+    write_book(str(path), 0, {0: (3, 0)})
+    data = bytearray(path.read_bytes())
+    data[4] = 2 # version 2 books have some columns mirrored
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        OpeningBook(str(path))
+
+def fixed_depth_search(current, mask, moves, time_budget):
+    """stands in for solver.search while building a book, searching to SEARCH_DEPTH instead of for time_budget seconds"""
+    score, column = Solver(table_size=4099).search_root(current, mask, moves, SEARCH_DEPTH)
+    return column, score, SEARCH_DEPTH
+
+def column_score(current, mask, moves, column):
+    """the score of playing column to the same depth as fixed_depth_search"""
+    move = playable(mask) & COLUMN_MASKS[column]
+    return -Solver(table_size=4099).negamax(current ^ mask, mask | move, moves + 1, -INFINITY, INFINITY, SEARCH_DEPTH - 1)
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="the book's workers only see the patched search when forked")
+def test_built_book_moves_are_the_solvers_best(tmp_path, monkeypatch):
+    monkeypatch.setattr(opening_book, 'search', fixed_depth_search)
+    path = tmp_path / 'built.c4b'
+    build_book(str(path), 3, time_budget=0, workers=2)
+    book = OpeningBook(str(path))
+    try:
+        for current, mask, moves in positions_up_to(3).values():
+            for image in ((current, mask), (mirror(current), mirror(mask))):
+                column, _ = book.lookup(*image)
+                _, best, _ = fixed_depth_search(*image, moves, 0)
+                assert column_score(*image, moves, column) == best
+    finally:
+        book.close()
@@ -0,0 +1,113 @@
+"""
+Round trips through the JSON and binary wire formats, and malformed payloads that must be dropped rather than crash.
+
+Run from the repository root: python3 -m pytest tests
+"""
+import socket
+import struct
+
+import pytest
+
+import protocols
+from auxillary import CustomError
+from framing import FrameDecoder
+from protocols import Modes, Protocols, SessionCipher, WireFormats
+
+MESSAGES = [
+    protocols.other_player('paige', 1),
+    protocols.your_turn(4),
+    protocols.make_move(7),
+    protocols.game_over(0, 1),
+    protocols.error_response(1, 'no room'),
+]
+
+CIPHER = SessionCipher(SessionCipher.generate_key())
+
+def decode(frame):
+    header_size, length, mode, proto = protocols.parse_header(frame, 0, len(frame))
+    return protocols.decrypt_payload(mode, frame[header_size:header_size + length], None, CIPHER), proto
+
+@pytest.mark.parametrize('wire_format', [WireFormats.JSON, WireFormats.BINARY])
+@pytest.mark.parametrize('message', MESSAGES, ids=lambda message: Protocols.PROTO_NAMES[message['proto']])
+def test_round_trip(message, wire_format):
+    for key in (None, CIPHER):
+        frame = protocols.encode_message(message, wire_format, key, encrypt=key is not None)
+        payload, proto = decode(frame)
+        assert protocols.load_message(payload, proto) == message
+
+@pytest.mark.parametrize('name', ['é' * 200, '棋' * 100, 'a' * 254 + '🙂'])
+def test_long_names_are_cut_on_a_character_boundary(name):
+    payload = protocols.make_binary_bytes(protocols.other_player(name, 1))
+    received = protocols.read_binary_bytes(Protocols.OTHER_PLAYER, payload)['other_name']
+    assert len(received.encode('utf-8')) <= 255
+    assert name.startswith(received)
+
+@pytest.mark.parametrize('proto, payload', [
+    (Protocols.MAKE_MOVE, b''),
+    (Protocols.GAME_OVER, b'\x01'),
+    (Protocols.OTHER_PLAYER, b'\x01'),
+    (Protocols.OTHER_PLAYER, b'\x01\x02\xc3\x28'),
+    (Protocols.ERROR, b'\x01\x00\x01\xff'),
+])
+def test_malformed_binary_bodies(proto, payload):
+    with pytest.raises(CustomError):
+        protocols.load_message(payload, proto)
+
+@pytest.mark.parametrize('payload', [b'\xff', b'{', b'[6]', b'{"move": 3}', b'{"proto": 0, "pub_key": "!", "signature": ""}'])
+def test_malformed_json(payload):
+    with pytest.raises(CustomError):
+        protocols.load_message(payload)
+
+def test_unknown_binary_type():
+    with pytest.raises(CustomError):
+        protocols.load_message(b'\x00', Protocols.REGISTER_CLIENT)
+
+def test_plain_frames_are_unencrypted():
+    frame = protocols.encode_message(protocols.make_move(3), WireFormats.BINARY, None, encrypt=False)
+    assert protocols.parse_header(frame, 0, len(frame))[2] == Modes.PLAIN
+
+def test_oversized_frames_are_refused():
+    header = struct.pack(protocols.HEADER_FORMAT, b'length', protocols.MAX_FRAME_SIZE + 1, Modes.PLAIN)
+    with pytest.raises(CustomError):
+        protocols.parse_header(header, 0, len(header))
+    header = struct.pack(protocols.HEADER_FORMAT, b'length', protocols.MAX_FRAME_SIZE, Modes.PLAIN)
+    assert protocols.parse_header(header, 0, len(header))[1] == protocols.MAX_FRAME_SIZE
+
+def test_decoder_doesnt_grow_for_an_oversized_frame():
+    decoder = FrameDecoder(size=64)
+    ours, theirs = socket.socketpair()
+    with ours, theirs:
+        theirs.sendall(struct.pack(protocols.HEADER_FORMAT, b'length', 0xFFFFFFFF, Modes.PLAIN))
+        with pytest.raises(CustomError):
+            decoder.next_frame(ours)
+    assert len(decoder.buffer) == 64
+
+def test_decoder_checks_the_frame_size_while_the_socket_is_still_full():
+    decoder = FrameDecoder(size=64)
+    ours, theirs = socket.socketpair()
+    with ours, theirs:
+        ours.setblocking(False)
+        theirs.sendall(protocols.encode_message(protocols.make_move(3), WireFormats.JSON, None, encrypt=False))
+        theirs.sendall(struct.pack(protocols.HEADER_FORMAT, b'length', protocols.MAX_FRAME_SIZE + 1, Modes.PLAIN) + bytes(100_000))
+        with pytest.raises(CustomError):
+            decoder.read_from(ours)
+    assert len(decoder.buffer) == 64
+
+def test_decoder_reads_frames_bigger_than_its_buffer():
+    decoder = FrameDecoder(size=64)
+    message = protocols.error_response(1, 'x' * 100_000)
+    ours, theirs = socket.socketpair()
+    with ours, theirs:
+        ours.setblocking(False)
+        theirs.setblocking(False)
+        frame = protocols.encode_message(message, WireFormats.JSON, None, encrypt=False) * 2
+        sent = 0
+        frames = []
+        while len(frames) < 2:
+            if sent < len(frame):
+                try:
+                    sent += theirs.send(frame[sent:])
+                except BlockingIOError:
+                    pass
+            frames += decoder.read_from(ours)[0]
+    assert [protocols.load_message(payload, proto) for _, payload, proto in frames] == [message, message]
@@ -0,0 +1,79 @@
+"""
+The solver's scores against a plain minimax over every move on nearly full boards, small enough to search exhaustively.
+
+Run from the repository root: python3 -m pytest tests
+"""
+import random
+
+import pytest
+
+from BitBoard import COLUMN_MASKS, has_winning_line
+from Board import NUM_COLS
+from solver import CELLS, Solver, playable, winning_cells
+
+EMPTY_CELLS = 9
+
+def random_position(rng, tiles):
+    """(current, mask, moves) after tiles random moves where nobody has won, None if the game couldn't avoid a win"""
+    current = mask = 0
+    for moves in range(tiles):
+        possible = playable(mask)
+        options = [possible & COLUMN_MASKS[col] for col in range(NUM_COLS) if possible & COLUMN_MASKS[col]]
+        options = [move for move in options if not has_winning_line(current | move)]
+        if not options:
+            return None
+        move = rng.choice(options)
+        current, mask = current ^ mask, mask | move
+    return current, mask, tiles
+
+def brute_force(current, mask, moves):
+    """the exact score of a position by trying every move, scored like solver.py"""
+    if moves == CELLS:
+        return 0
+    possible = playable(mask)
+    if winning_cells(current, mask) & possible:
+        return (CELLS + 1 - moves) // 2
+    return max(-brute_force(current ^ mask, mask | move, moves + 1)
+               for move in (possible & column for column in COLUMN_MASKS) if move)
+
+def near_full_positions(count, seed=457):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = random_position(rng, CELLS - EMPTY_CELLS)
+        if position is not None:
+            positions.append(position)
+    return positions
+
+@pytest.mark.parametrize('position', near_full_positions(12))
+def test_best_move_score_is_exact(position):
+    expected = brute_force(*position)
+    column, score, _ = Solver(table_size=4099).best_move(*position, time_budget=60)
+    assert score == expected
+    current, mask, moves = position
+    move = playable(mask) & COLUMN_MASKS[column]
+    assert move
+    assert (CELLS + 1 - moves) // 2 == score or -brute_force(current ^ mask, mask | move, moves + 1) == expected
+
+@pytest.mark.parametrize('position', near_full_positions(6, seed=458))
+def test_score_move_matches_every_column(position):
+    current, mask, moves = position
+    solver = Solver(table_size=4099)
+    for column in range(NUM_COLS):
+        move = playable(mask) & COLUMN_MASKS[column]
+        score = solver.score_move(current, mask, moves, column, time_budget=60)
+        if not move:
+            assert score is None
+        elif winning_cells(current, mask) & move:
+            assert score == (CELLS + 1 - moves) // 2
+        else:
+            assert score == -brute_force(current ^ mask, mask | move, moves + 1)
+
+def test_no_safe_moves_loses_on_the_next_move():
+    # positions where every move hands the opponent a win, their win on the next move is worth (CELLS - moves) // 2 to them
+    solver = Solver(table_size=4099)
+    for position in near_full_positions(40, seed=459):
+        current, mask, moves = position
+        if solver.safe_moves(current, mask) or winning_cells(current, mask) & playable(mask):
+            continue
+        assert solver.negamax(current, mask, moves, -CELLS, CELLS, 1) == -((CELLS - moves) // 2) == brute_force(*position)